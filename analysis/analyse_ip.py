@@ -1,21 +1,135 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from glob import iglob
 from os import listdir
 from os.path import isfile, join
 from pathlib import Path
-from typing import TextIO
+from typing import Iterable, Mapping, TextIO
 
 import numpy as np
 import openpyxl
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
 
 """
 This script is not a dropin solution and requires you to follow specific naming conventions
 """
 
+# Bump when read_quantification_sheet changes, so cached tables are parsed again
+CACHE_VERSION = 1
+CACHE_INDEX = "index.json"
+
+# Levels of the frame of stack_tables, a table is identified by the first three
+STACK_LEVELS = ["ip", "repeat", "antibody", "sample"]
+TABLE_LEVELS = ["ip", "repeat", "antibody"]
+# The DHX30 IPs are GFP pulldowns, every IP is compared to the one of its repeat
+REFERENCE_ANTIBODY = "GFP"
+# The GFP only lane, which is left out of the normalisation, and the sample everything is relative to
+CONTROL_SAMPLE = "GFP"
+REFERENCE_SAMPLE = "WT"
+
+
+def _convert_cell(cell) -> object:
+    """
+    Same conversion as pd.read_excel with openpyxl
+    """
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def read_quantification_sheet(file: Path | TextIO) -> tuple[str, pd.DataFrame]:
+    """
+    Reads the name in cell A1 and the table below it (header in the second row) in one read-only pass over the
+    active sheet. The table is the same pd.read_excel(file, header=1) returns.
+    :param file:
+    :return: The name cell and the table
+    """
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = wb.active
+        # the dimensions stored in read only files can be wrong
+        sheet.reset_dimensions()
+        data: list[list[object]] = []
+        last_row_with_data = -1
+        for row_number, row in enumerate(sheet.rows):
+            converted_row = [_convert_cell(cell) for cell in row]
+            while converted_row and converted_row[-1] == "":
+                converted_row.pop()
+            if converted_row:
+                last_row_with_data = row_number
+            data.append(converted_row)
+    finally:
+        wb.close()
+
+    data = data[:last_row_with_data + 1]
+    max_width = max((len(row) for row in data), default=0)
+    data = [row + [""] * (max_width - len(row)) for row in data]
+    name_cell = data[0][0] if data and data[0] else None
+    return name_cell, TextParser(data, header=1).read()
+
+
+class SheetCache(object):
+    """
+    Parsed quantification sheets stored as Arrow (feather) files in a directory, named after the SHA-256 of the
+    workbook. An index maps every workbook path to its mtime, size and hash, so unchanged workbooks are neither parsed
+    nor hashed again. A workbook that was only touched is hashed and still found.
+    The cache is only read and written by the process calling read_all_tables.
+    """
+    directory: Path
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index_path = self.directory / CACHE_INDEX
+        self._index: dict = json.loads(index_path.read_text()) if index_path.exists() else {}
+        if self._index.get("version") != CACHE_VERSION:
+            self._index = {"version": CACHE_VERSION}
+
+    def key(self, file: Path) -> str:
+        stat = file.stat()
+        entry = self._index.get(str(file.resolve()))
+        if entry is not None and entry[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return entry[2]
+
+        digest = hashlib.sha256(file.read_bytes()).hexdigest()
+        self._index[str(file.resolve())] = [stat.st_mtime_ns, stat.st_size, digest]
+        return digest
+
+    def get(self, file: Path) -> tuple[str, pd.DataFrame] | None:
+        path = self.directory / f"{self.key(file)}.feather"
+        if not path.exists():
+            return None
+        table = feather.read_table(str(path))
+        return json.loads(table.schema.metadata[b"name_cell"]), table.to_pandas()
+
+    def put(self, file: Path, sheet: tuple[str, pd.DataFrame]):
+        name_cell, df = sheet
+        try:
+            table = pa.Table.from_pandas(df)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # columns mixing text and numbers can not be stored, the sheet is parsed again next time
+            return
+        table = table.replace_schema_metadata({**table.schema.metadata, b"name_cell": json.dumps(name_cell)})
+        feather.write_feather(table, str(self.directory / f"{self.key(file)}.feather"))
+
+    def save(self):
+        (self.directory / CACHE_INDEX).write_text(json.dumps(self._index))
+
+
 @dataclass()
 class QuantificationTable:
     df: pd.DataFrame
@@ -23,11 +137,14 @@ class QuantificationTable:
     antibody_number: str
     antibody: str
 
-    def __init__(self, file: Path | TextIO, index: None | list[str] = None):
-        df = pd.read_excel(file, header=1, skiprows=0)
-        wb = openpyxl.load_workbook(file)
-        sheet = wb.active
-        name_cell = sheet.cell(1, 1).value
+    def __init__(self, file: Path | TextIO, index: None | list[str] = None,
+                 sheet: tuple[str, pd.DataFrame] | None = None):
+        """
+        :param file:
+        :param index: The samples in the order of the rows
+        :param sheet: The result of read_quantification_sheet for file, if it was read before
+        """
+        name_cell, df = sheet if sheet is not None else read_quantification_sheet(file)
         name = name_cell.split(" ")[-1]
         details = name.split("_")
         if len(details) == 3:
@@ -60,7 +177,7 @@ class QuantificationTable:
 
     @property
     def normalised_to_overall(self) -> pd.Series:
-        except_gfp_control = self.adj_total_band[self.adj_total_band.index != "GFP"]
+        except_gfp_control = self.adj_total_band[self.adj_total_band.index != CONTROL_SAMPLE]
         except_gfp_control = except_gfp_control / except_gfp_control.sum()
         return except_gfp_control
 
@@ -74,44 +191,138 @@ class QuantificationTable:
 
     def get_relative_quantification(self, dhx_30_quant: QuantificationTable):
         per_gfp = self.get_ip_by_ip(dhx_30_quant)
-        rel_to_wt = round(per_gfp / per_gfp["WT"], 2)
+        rel_to_wt = round(per_gfp / per_gfp[REFERENCE_SAMPLE], 2)
         rel_to_wt.name = self.repeat + "_" + self.antibody
         return rel_to_wt
 
 
-def read_all_tables(files: Path | list[Path] | list[TextIO]):
+def read_all_tables(files: Path | list[Path] | list[TextIO], processes: int | None = None,
+                    cache_dir: Path | None = None):
+    """
+    Reads the quantification tables of a directory or a list of files. Workbooks are parsed in a process pool.
+    :param files:
+    :param processes: Size of the process pool, the number of CPUs by default. 1 parses in this process.
+    :param cache_dir: Keep parsed sheets in this directory, unchanged workbooks are not parsed again
+    :return:
+    """
     if isinstance(files, Path):
         files = [Path(join(files, f)) for f in listdir(files) if isfile(join(files, f))]
+    files = [file for file in files if "Quanti" not in file.name and "~$" not in file.name]
 
-    all_quant_table = []
-    for file in files:
+    cache = SheetCache(cache_dir) if cache_dir is not None else None
+    sheets: dict[int, tuple[str, pd.DataFrame]] = {}
+    if cache is not None:
+        for i, file in enumerate(files):
+            if isinstance(file, Path) and (sheet := cache.get(file)) is not None:
+                sheets[i] = sheet
 
-        if "Quanti" in file.name or "~$" in file.name:
-            continue
+    missing = [i for i in range(len(files)) if i not in sheets]
+    # open files can not be sent to other processes
+    if processes == 1 or len(missing) < 2 or not all(isinstance(files[i], Path) for i in missing):
+        parsed = [read_quantification_sheet(files[i]) for i in missing]
+    else:
+        with ProcessPoolExecutor(processes) as executor:
+            parsed = list(executor.map(read_quantification_sheet, [files[i] for i in missing]))
+    for i, sheet in zip(missing, parsed):
+        sheets[i] = sheet
+        if cache is not None and isinstance(files[i], Path):
+            cache.put(files[i], sheet)
+    if cache is not None:
+        cache.save()
+
+    all_quant_table = []
+    for i, file in enumerate(files):
         print(file)
-        all_quant_table.append(QuantificationTable(file))
+        all_quant_table.append(QuantificationTable(file, sheet=sheets[i]))
 
     return all_quant_table
 
 
-dhx_30_cache: dict[str, QuantificationTable] = {}
-
-
-def get_dhx30_quantification(quant_tables: list[QuantificationTable], repeat: str) -> QuantificationTable:
+def get_dhx30_quantification(quant_tables: list[QuantificationTable], repeat: str) -> QuantificationTable | None:
     """
     Finds the DHX30 measurement for a given repeat in a list of Quantification Tables.
-    Results are cached for fast access
+    normalise_all finds the references of all tables at once.
     :param quant_tables:
     :param repeat:
     :return:
     """
-    if repeat in dhx_30_cache:
-        return dhx_30_cache[repeat]
-
     for quant_table in quant_tables:
-        if "GFP" in quant_table.antibody and quant_table.repeat == repeat:
-            dhx_30_cache[repeat] = quant_table
+        if REFERENCE_ANTIBODY in quant_table.antibody and quant_table.repeat == repeat:
             return quant_table
+    return None
+
+
+def stack_tables(tables_by_ip: Mapping[str, Iterable[QuantificationTable]]) -> pd.DataFrame:
+    """
+    Stacks the adjusted total band volumes of all tables into one frame.
+    :param tables_by_ip: The tables of every IP (directory), e.g. the result of read_all_tables
+    :return: A frame with the column adj_total_band indexed by STACK_LEVELS, tables keep their order
+    """
+    keys: list[tuple[str, str, str]] = []
+    bands: list[pd.Series] = []
+    for ip, quant_tables in tables_by_ip.items():
+        for quant_table in quant_tables:
+            keys.append((ip, quant_table.repeat, quant_table.antibody))
+            bands.append(quant_table.df["Adj. Total Band Vol. (Int)"])
+
+    duplicates = sorted({key for key in keys if keys.count(key) > 1})
+    if duplicates:
+        raise ValueError(f"Several tables for {', '.join('_'.join(key) for key in duplicates)}")
+    if not bands:
+        return pd.DataFrame({"adj_total_band": pd.Series(dtype=float)},
+                            index=pd.MultiIndex.from_tuples([], names=STACK_LEVELS))
+    stacked = pd.concat(bands, keys=keys, names=STACK_LEVELS)
+    return stacked.astype(float).to_frame("adj_total_band")
+
+
+def _per_table(values: pd.Series, table_values: pd.Series) -> np.ndarray:
+    """
+    :param values: Indexed by STACK_LEVELS
+    :param table_values: One value per table or per (ip, repeat), indexed by a subset of the levels
+    :return: The value of table_values of the table of every row of values, NaN if there is none
+    """
+    index = values.index.droplevel([level for level in STACK_LEVELS if level not in table_values.index.names])
+    return table_values.reindex(index.reorder_levels(table_values.index.names)).to_numpy()
+
+
+def normalise_all(stacked: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the three normalisations of QuantificationTable for all stacked tables at once:
+    normalised_to_overall divides the bands of every table (without the GFP control lane) by their sum,
+    ip_by_ip divides that by the normalised bands of the DHX30 (GFP) reference of the same IP and repeat and
+    relative_quantification divides ip_by_ip by its WT sample. Both ratios are rounded to 2 digits.
+    Missing references or samples and divisions by 0 give 0, like in the result workbooks.
+    :param stacked: The result of stack_tables
+    :return: A frame with one column per normalisation, indexed like stacked without the GFP control samples
+    """
+    band = stacked["adj_total_band"]
+    band = band[band.index.get_level_values("sample") != CONTROL_SAMPLE]
+    normalised = band / band.groupby(level=TABLE_LEVELS, sort=False).transform("sum")
+
+    # the first reference table of every IP and repeat
+    antibodies = normalised.index.droplevel("sample").unique().to_frame(index=False)
+    references = antibodies[antibodies["antibody"].str.contains(REFERENCE_ANTIBODY, regex=False)]
+    references = pd.MultiIndex.from_frame(references.drop_duplicates(["ip", "repeat"]))
+    reference = normalised[normalised.index.droplevel("sample").isin(references)].droplevel("antibody")
+    ip_by_ip = (normalised / _per_table(normalised, reference)).round(2)
+
+    wt = ip_by_ip[ip_by_ip.index.get_level_values("sample") == REFERENCE_SAMPLE].droplevel("sample")
+    relative = (ip_by_ip / _per_table(ip_by_ip, wt)).round(2)
+
+    result = pd.DataFrame({"normalised_to_overall": normalised, "ip_by_ip": ip_by_ip,
+                           "relative_quantification": relative})
+    return result.replace([np.inf, -np.inf], np.nan).fillna(0)
+
+
+def to_wide(values: pd.Series) -> pd.DataFrame:
+    """
+    :param values: One normalisation of normalise_all for a single IP, indexed by repeat, antibody and sample
+    :return: The layout of the result workbooks, one row per sample and one column named repeat_antibody per table
+    """
+    columns = values.index.get_level_values("repeat") + "_" + values.index.get_level_values("antibody")
+    samples = values.index.get_level_values("sample")
+    wide = pd.Series(values.to_numpy(), index=pd.MultiIndex.from_arrays([samples, columns])).unstack()
+    return wide.reindex(index=samples.unique(), columns=columns.unique()).fillna(0)
 
 
 if __name__ == "__main__":
@@ -119,28 +330,24 @@ if __name__ == "__main__":
     rootdir_glob = r'PATH_TO_FOLDER_CONTAINING_QUANTIFIED_EXCELS'
     # This will return absolute paths
     dir_list = [f for f in iglob(rootdir_glob, recursive=True) if os.path.isdir(f)]
+    stacked_by_ip: dict[str, pd.DataFrame] = {}
     for dir in dir_list:
+        ip_number = Path(dir).name
         try:
-            result = read_all_tables(list(Path(dir).rglob("*.xlsx")))
-            all_relative = []
-            all_ip_by_ip = []
-            all_normalised_to_overall = []
-            for quant in result:
-                dhx30 = get_dhx30_quantification(result, quant.repeat)
-                all_ip_by_ip.append(quant.get_ip_by_ip(dhx30))
-                all_relative.append(quant.get_relative_quantification(dhx30))
-                all_normalised_to_overall.append(quant.normalised_to_overall)
-
-            normed = pd.DataFrame(all_normalised_to_overall).transpose().fillna(0).replace([np.inf, -np.inf], 0)
-            ip_by_ip = pd.DataFrame(all_ip_by_ip).transpose().fillna(0).replace([np.inf, -np.inf], 0)
-            end_result = pd.DataFrame(all_relative).transpose().fillna(0).replace([np.inf, -np.inf], 0)
-
-            ip_number = Path(dir).name
-            ex_writer = pd.ExcelWriter(Path(f"data/result_{ip_number}.xlsx"))
-            end_result.to_excel(ex_writer, sheet_name="NormedToWT")
-            ip_by_ip.to_excel(ex_writer, sheet_name="IPByIP")
-            normed.to_excel(ex_writer, sheet_name="NormedToOverall")
-            ex_writer.close()
+            tables = read_all_tables(list(Path(dir).rglob("*.xlsx")), cache_dir=Path("data/quantification_cache"))
+            # an IP with several tables for one repeat and antibody is left out, the others are still analysed
+            stacked_by_ip[ip_number] = stack_tables({ip_number: tables})
         except Exception as e:
-            print(e)
+            print(f"Skipping {ip_number}: {e}")
+            continue
+
+    results = normalise_all(pd.concat(stacked_by_ip.values()) if stacked_by_ip else stack_tables({}))
+    for ip_number in stacked_by_ip:
+        if ip_number not in results.index.get_level_values("ip"):
             continue
+        ip_results = results.xs(ip_number, level="ip")
+        ex_writer = pd.ExcelWriter(Path(f"data/result_{ip_number}.xlsx"))
+        to_wide(ip_results["relative_quantification"]).to_excel(ex_writer, sheet_name="NormedToWT")
+        to_wide(ip_results["ip_by_ip"]).to_excel(ex_writer, sheet_name="IPByIP")
+        to_wide(ip_results["normalised_to_overall"]).to_excel(ex_writer, sheet_name="NormedToOverall")
+        ex_writer.close()
@@ -1,3 +0,0 @@
-from classes import *
-from util import *
-from scripts import *
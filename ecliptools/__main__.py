@@ -0,0 +1,3 @@
+from ecliptools.cli import cli
+
+cli(prog_name="ecliptools")
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+from pathlib import Path
+
+import numpy as np
+
+from ecliptools.benchmark.fake_ensembl import FakeEnsembl
+from ecliptools.util.ensembl_client import EnsemblClient, set_ensembl_client
+from ecliptools.util.fasta import IndexedFasta, Region, set_genome_fasta
+from ecliptools.util.get_binding_sequence import BindingRegion, get_binding_sequences
+from ecliptools.util.response_cache import ResponseCache, set_response_cache
+
+# one gene per strand, in the 0-based coordinates of the genome
+CHECK_GENES = {
+    "ENSG00000000001": Region("1", 1_000, 6_000, "+"),
+    "ENSG00000000002": Region("1", 8_000, 14_000, "-"),
+}
+
+
+def write_genome(out_path: Path, length: int, rng: np.random.Generator, line_bases=60):
+    sequence = "".join(rng.choice(list("ACGT"), length))
+    with out_path.open("w") as f:
+        f.write(">1\n")
+        for start in range(0, length, line_bases):
+            f.write(sequence[start:start + line_bases] + "\n")
+
+
+def check_sequence_backends(work_dir: Path, peak_count=200, seed=0) -> list[str]:
+    """
+    Extracts the same peaks from a plus and a minus strand gene once from a local genome and once from the gene
+    sequences of a fake Ensembl, which answers like the real one (1-based positions, minus strand genes reverse
+    complemented). Peaks are on both strands and lie within the genes, Ensembl has no sequence beyond them.
+    :return: A message for every peak the two backends disagree on
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    genome_path = work_dir / "check-genome.fa"
+    write_genome(genome_path, 16_000, rng)
+    genome = IndexedFasta(genome_path)
+
+    regions: list[BindingRegion] = []
+    for accession, gene in CHECK_GENES.items():
+        starts = rng.integers(gene.start, gene.end - 1, peak_count)
+        ends = np.minimum(starts + rng.integers(1, 80, peak_count), gene.end)
+        # the first and last bases of the gene, where an off by one shows
+        starts[:2], ends[:2] = [gene.start, gene.end - 30], [gene.start + 30, gene.end]
+        for start, end, strand in zip(starts, ends, rng.choice(["+", "-"], peak_count)):
+            regions.append(BindingRegion(accession, int(start), int(end), gene.chrom, str(strand)))
+
+    set_response_cache(ResponseCache(None))
+    with FakeEnsembl(genome=genome, genes=CHECK_GENES) as server, \
+            EnsemblClient(server.url, rate_limit=10_000) as client:
+        set_ensembl_client(client)
+        set_genome_fasta(None)
+        remote = get_binding_sequences(regions)
+    set_genome_fasta(genome)
+    try:
+        local = get_binding_sequences(regions)
+    finally:
+        set_genome_fasta(None)
+        genome.close()
+
+    return [f"{region}: local {local_sequence}, Ensembl {remote_sequence}"
+            for region, local_sequence, remote_sequence in zip(regions, local, remote)
+            if local_sequence != remote_sequence]
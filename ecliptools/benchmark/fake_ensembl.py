@@ -0,0 +1,103 @@
+#!/usr/bin/python
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ecliptools.util.fasta import IndexedFasta, Region
+
+
+def lookup_response(accession: str) -> dict:
+    response = {"id": accession, "object_type": "Gene", "display_name": f"FAKE-{accession[-4:]}",
+                "biotype": "protein_coding", "description": "fake", "seq_region_name": "1", "start": 1000,
+                "end": 30000, "strand": 1}
+    if accession.startswith("ENST"):
+        response |= {"object_type": "Transcript", "Parent": f"ENSG{accession[4:]}", "is_canonical": 1}
+    return response
+
+
+def xrefs_response(accession: str) -> list[dict]:
+    return [{"dbname": "HGNC", "primary_id": accession, "synonyms": [f"ALIAS{accession[-3:]}", f"{accession}-AS"]},
+            {"dbname": "EntrezGene", "primary_id": accession[-6:], "synonyms": []}]
+
+
+def sequence_response(accession: str, genome: IndexedFasta, gene: Region) -> dict:
+    """
+    /sequence/id of a gene the way Ensembl answers it: the position in desc is 1-based and inclusive, genes on the
+    minus strand are reverse complemented.
+    """
+    return {"id": accession, "query": accession, "molecule": "dna", "version": 1,
+            "desc": f"chromosome:GRCh38:{gene.chrom}:{gene.start + 1}:{gene.end}:{1 if gene.strand == '+' else -1}",
+            "seq": genome.fetch(*gene)}
+
+
+class FakeEnsemblHandler(BaseHTTPRequestHandler):
+    """
+    Answers /lookup/id (GET and POST) and /xrefs/id with generated data, optionally after a delay.
+    /sequence/id is answered for the genes given with a genome.
+    """
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    genome: IndexedFasta | None = None
+    genes: dict[str, Region] = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, status=200):
+        if self.latency:
+            time.sleep(self.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if parts[:2] == ["lookup", "id"] and len(parts) == 3:
+            self._send(lookup_response(parts[2]))
+        elif parts[:2] == ["xrefs", "id"] and len(parts) == 3:
+            self._send(xrefs_response(parts[2]))
+        elif parts[:2] == ["sequence", "id"] and len(parts) == 3 and parts[2] in self.genes:
+            self._send(sequence_response(parts[2], self.genome, self.genes[parts[2]]))
+        else:
+            self._send({"error": f"{self.path} not found"}, 400)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.split("?", 1)[0].strip("/") == "lookup/id":
+            self._send({accession: lookup_response(accession) for accession in body["ids"]})
+        else:
+            self._send({"error": f"{self.path} not found"}, 400)
+
+
+class FakeEnsembl(object):
+    """
+    Local stand-in for the Ensembl REST API running in a background thread, usable as a context manager.
+    """
+
+    def __init__(self, latency=0.0, genome: IndexedFasta | None = None, genes: dict[str, Region] | None = None):
+        """
+        :param latency: Seconds to wait before answering
+        :param genome: Serve the sequences of genes from this genome
+        :param genes: The position of every gene /sequence/id knows
+        """
+        handler = type("Handler", (FakeEnsemblHandler,), {"latency": latency, "genome": genome,
+                                                           "genes": genes or {}})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
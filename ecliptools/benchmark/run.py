@@ -0,0 +1,190 @@
+#!/usr/bin/python
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, TextIO
+
+import click
+import numpy as np
+import pandas as pd
+
+from ecliptools.benchmark.checks import check_sequence_backends
+from ecliptools.benchmark.fake_ensembl import FakeEnsembl
+from ecliptools.benchmark.synthetic import SyntheticData, generate
+from ecliptools.scripts.append_references import append_references
+from ecliptools.scripts.convert_bed import tojson
+from ecliptools.scripts.count_gene_peaks import count_gene_peaks, create_peak_union
+from ecliptools.util.ensembl_client import EnsemblClient, set_ensembl_client
+from ecliptools.util.read_peak_json import read_peak_json
+from ecliptools.util.response_cache import ResponseCache, set_response_cache
+
+DEFAULT_SCALES = (1_000, 10_000, 100_000)
+
+
+def measure(function: Callable[[], Any], memory=True) -> dict[str, float]:
+    """
+    Runs function once for the wall time and, if memory is set, a second time under tracemalloc for the peak
+    memory, so tracing does not distort the time.
+    :return: seconds and peak_memory_mb
+    """
+    start = time.perf_counter()
+    function()
+    result = {"seconds": time.perf_counter() - start}
+
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def _tojson(data: SyntheticData, json_paths: list[Path]):
+    for mapped_path, json_path in zip(data.mapped_paths, json_paths):
+        with data.lookup_path.open("r") as lookup_file, json_path.open("w") as out_file:
+            tojson(mapped_path, lookup_file, out_file)
+
+
+def _read_peak_json(json_paths: list[Path]):
+    for json_path in json_paths:
+        with json_path.open("r") as f:
+            read_peak_json(f.read())
+
+
+def _count(union: pd.DataFrame, counted_path: Path):
+    # count_gene_peaks adds its columns in place
+    with counted_path.open("w") as f:
+        count_gene_peaks(union.copy(), f)
+
+
+def _append_references(server: FakeEnsembl, counted_path: Path, lookup_path: Path, out_path: Path):
+    # a cold in-memory cache and a fresh client, so every run sends the same requests
+    set_response_cache(ResponseCache(None))
+    with EnsemblClient(server.url, rate_limit=10_000) as client:
+        set_ensembl_client(client)
+        with counted_path.open("r") as in_file, lookup_path.open("r") as lookup_file, out_path.open("w") as out_file:
+            append_references(in_file, out_file, lookup_file)
+
+
+def run_scale(work_dir: Path, peak_count: int, fan_out: int, experiments: int, server: FakeEnsembl, memory=True) \
+        -> dict[str, dict[str, float]]:
+    """
+    Generates one synthetic data set and times all stages on it.
+    :return: Per stage the seconds, items (peaks or genes), items_per_second and, with memory, peak_memory_mb
+    """
+    data = generate(work_dir, peak_count, fan_out, experiments=experiments)
+    json_paths = [work_dir / f"peaks-{experiment}.json" for experiment in range(experiments)]
+    counted_path = work_dir / "counted.tsv"
+
+    union: dict[str, pd.DataFrame] = {}
+
+    def _union():
+        union["df"] = create_peak_union(*json_paths)
+
+    stages: dict[str, tuple[Callable[[], Any], Callable[[], int]]] = {
+        "tojson": (lambda: _tojson(data, json_paths), lambda: peak_count * experiments),
+        "read_peak_json": (lambda: _read_peak_json(json_paths), lambda: peak_count * experiments),
+        "create_peak_union": (_union, lambda: peak_count * experiments),
+        "count_gene_peaks": (lambda: _count(union["df"], counted_path), lambda: len(union["df"])),
+        "append_references": (
+            lambda: _append_references(server, counted_path, data.lookup_path, work_dir / "referenced.tsv"),
+            lambda: len(pd.read_csv(counted_path, sep="\t", usecols=[0]))),
+    }
+
+    results = {}
+    for name, (function, items) in stages.items():
+        result = measure(function, memory)
+        result["items"] = items()
+        result["items_per_second"] = result["items"] / result["seconds"] if result["seconds"] else float("inf")
+        results[name] = result
+        click.echo(f"{peak_count:>10} peaks  {name:<20} {result['seconds']:9.3f} s "
+                   f"{result['items_per_second']:12.0f} items/s"
+                   + (f" {result['peak_memory_mb']:9.1f} MB" if memory else ""), file=sys.stderr)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    :return: A message for every stage and scale that got slower (or used more memory) by more than tolerance
+    """
+    regressions = []
+    for scale, stages in results["scales"].items():
+        for stage, result in stages.items():
+            old = baseline.get("scales", {}).get(scale, {}).get(stage)
+            if old is None:
+                continue
+            for metric in ("seconds", "peak_memory_mb"):
+                if metric in result and metric in old and result[metric] > old[metric] * tolerance:
+                    regressions.append(
+                        f"{stage} at {scale} peaks: {metric} {old[metric]:.3f} -> {result[metric]:.3f}")
+    return regressions
+
+
+@click.command("benchmark")
+@click.option("-n", "--peaks", "scales", type=click.IntRange(1), multiple=True, default=DEFAULT_SCALES,
+              show_default=True, help="Peaks per experiment, can be given several times (1k to 10M).")
+@click.option("--fan-out", type=click.IntRange(1), default=3, show_default=True,
+              help="Annotations (transcripts) per peak.")
+@click.option("--experiments", type=click.IntRange(1), default=2, show_default=True)
+@click.option("--latency", type=click.FloatRange(0), default=0.0, show_default=True,
+              help="Seconds the fake Ensembl server waits before answering.")
+@click.option("--memory/--no-memory", default=True, help="Measure peak memory in a second, traced run.")
+@click.option("-o", "--out-file", type=click.File("w"), default=None, help="Write the results as JSON.")
+@click.option("--baseline", type=click.File("r"), default=None,
+              help="Results of an earlier run, stages that got slower are reported and fail the command.")
+@click.option("--tolerance", type=click.FloatRange(1), default=1.25, show_default=True,
+              help="Factor a stage may get slower than the baseline.")
+@click.option("--work-dir", type=click.Path(file_okay=False, path_type=Path), default=None,
+              help="Keep the generated data here instead of in a temporary directory.")
+@click.option("--check/--no-check", default=True,
+              help="First check that binding sequences from Ensembl and from a local genome agree.")
+def benchmark_command(scales: tuple[int], fan_out=3, experiments=2, latency=0.0, memory=True,
+                      out_file: TextIO | None = None, baseline: TextIO | None = None, tolerance=1.25,
+                      work_dir: Path | None = None, check=True):
+    """
+    Times tojson, read_peak_json, create_peak_union, count_gene_peaks and append_references on synthetic
+    eCLIP data against a local fake Ensembl server and reports throughput and peak memory.
+    """
+    if check:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mismatches = check_sequence_backends(work_dir or Path(temp_dir))
+        for mismatch in mismatches:
+            click.echo(f"MISMATCH: {mismatch}", file=sys.stderr)
+        if mismatches:
+            raise click.ClickException(f"{len(mismatches)} binding sequences differ between Ensembl and the "
+                                       f"local genome")
+
+    results: dict[str, Any] = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "fan_out": fan_out,
+        "experiments": experiments,
+        "scales": {},
+    }
+
+    with FakeEnsembl(latency) as server, tempfile.TemporaryDirectory() as temp_dir:
+        for peak_count in scales:
+            scale_dir = (work_dir or Path(temp_dir)) / str(peak_count)
+            results["scales"][str(peak_count)] = run_scale(scale_dir, peak_count, fan_out, experiments, server,
+                                                           memory)
+
+    if out_file:
+        json.dump(results, out_file, indent=2)
+
+    if baseline:
+        regressions = compare(results, json.load(baseline), tolerance)
+        for regression in regressions:
+            click.echo(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            raise click.ClickException(f"{len(regressions)} regressions")
+
+
+if __name__ == "__main__":
+    benchmark_command()
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+import json
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+CHROMS = [f"chr{number}" for number in range(1, 23)] + ["chrX"]
+GENE_LENGTH = 20_000
+GENE_SPACING = 50_000
+
+
+class SyntheticData(NamedTuple):
+    peak_paths: list[Path]
+    annotation_path: Path
+    mapped_paths: list[Path]
+    lookup_path: Path
+    peak_count: int
+    gene_count: int
+
+
+def gene_accession(gene: int) -> str:
+    return f"ENSG{gene:011d}"
+
+
+def transcript_accession(gene: int, transcript: int, fan_out: int) -> str:
+    return f"ENST{gene * fan_out + transcript:011d}"
+
+
+def _layout(gene_count: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    chrom = np.arange(gene_count) % len(CHROMS)
+    start = (np.arange(gene_count) // len(CHROMS)) * GENE_SPACING + rng.integers(0, 1000, gene_count)
+    minus_strand = rng.random(gene_count) < 0.5
+    return chrom, start, minus_strand
+
+
+def write_annotations(out_path: Path, gene_count: int, fan_out: int, rng: np.random.Generator):
+    """
+    Writes fan_out transcripts per gene in the 7 column genes and rRNA bed format (chrom, start, end, strand, name,
+    type, sub type). All transcripts of a gene cover the whole gene, so every peak in it overlaps all of them.
+    """
+    chrom, start, minus_strand = _layout(gene_count, rng)
+    with out_path.open("w") as f:
+        for gene in range(gene_count):
+            strand = "-" if minus_strand[gene] else "+"
+            for transcript in range(fan_out):
+                f.write(f"{CHROMS[chrom[gene]]}\t{start[gene] + transcript}\t{start[gene] + GENE_LENGTH}\t{strand}\t"
+                        f"{transcript_accession(gene, transcript, fan_out)}.1\tTRANSCRIPT\tprotein_coding\n")
+
+
+def write_experiment(peak_path: Path, mapped_path: Path, peak_count: int, gene_count: int, fan_out: int,
+                     layout_seed: int, rng: np.random.Generator):
+    """
+    Writes peaks in the 10 column ENCODE format and the same peaks annotated like bedmap --echo --echo-map does.
+    Every peak lies in a random gene and gets the fan_out transcripts of that gene as annotation blocks.
+    """
+    chrom, gene_start, minus_strand = _layout(gene_count, np.random.default_rng(layout_seed))
+    genes = rng.integers(0, gene_count, peak_count)
+    # peaks of one experiment snap to a grid, so experiments share part of their peaks
+    starts = gene_start[genes] + fan_out + rng.integers(0, (GENE_LENGTH - 200) // 10, peak_count) * 10
+    ends = starts + rng.integers(20, 100, peak_count)
+
+    with peak_path.open("w") as peak_file, mapped_path.open("w") as mapped_file:
+        for i in range(peak_count):
+            gene = genes[i]
+            strand = "-" if minus_strand[gene] else "+"
+            peak = f"{CHROMS[chrom[gene]]}\t{starts[i]}\t{ends[i]}\tpeak_{i}\t1000\t{strand}\t3.5\t4.2\t-1\t-1"
+            peak_file.write(peak + "\n")
+
+            blocks = [f"{CHROMS[chrom[gene]]}\t{gene_start[gene] + transcript}\t{gene_start[gene] + GENE_LENGTH}\t"
+                      f"{strand}\t{transcript_accession(gene, transcript, fan_out)}.1\tTRANSCRIPT\tprotein_coding"
+                      for transcript in range(fan_out)]
+            mapped_file.write(peak + "\t" + "\t".join(blocks) + "\n")
+
+
+def write_lookup(out_path: Path, gene_count: int, fan_out: int):
+    """
+    Writes a lookup file as created by get-lookup-file for all synthetic genes and transcripts.
+    """
+    lookup = {}
+    for gene in range(gene_count):
+        gene_id = gene_accession(gene)
+        lookup[gene_id] = {"ID": gene_id, "object_type": "Gene", "display_name": f"GENE{gene}",
+                           "biotype": "protein_coding", "description": f"synthetic gene {gene}",
+                           "seq_region_name": CHROMS[gene % len(CHROMS)][3:], "parent": "", "is_canonical": ""}
+        for transcript in range(fan_out):
+            transcript_id = transcript_accession(gene, transcript, fan_out)
+            lookup[transcript_id] = {"ID": transcript_id, "object_type": "Transcript",
+                                     "display_name": f"GENE{gene}-{201 + transcript}", "biotype": "protein_coding",
+                                     "description": f"synthetic gene {gene}",
+                                     "seq_region_name": CHROMS[gene % len(CHROMS)][3:], "parent": gene_id,
+                                     "is_canonical": 1 if transcript == 0 else ""}
+    with out_path.open("w") as f:
+        json.dump(lookup, f)
+
+
+def generate(out_dir: Path, peak_count: int, fan_out=3, gene_count: int | None = None, experiments=2, seed=0) \
+        -> SyntheticData:
+    """
+    Generates a synthetic eCLIP data set.
+    :param out_dir:
+    :param peak_count: Peaks per experiment
+    :param fan_out: Transcripts per gene, which is the number of annotations of every peak
+    :param gene_count: Defaults to one gene per 20 peaks
+    :param experiments: Number of peak files
+    :param seed:
+    :return: The paths of all written files
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    gene_count = gene_count or max(1, peak_count // 20)
+    rng = np.random.default_rng(seed)
+
+    annotation_path = out_dir / "annotations.bed"
+    write_annotations(annotation_path, gene_count, fan_out, np.random.default_rng(seed))
+
+    peak_paths, mapped_paths = [], []
+    for experiment in range(experiments):
+        peak_path = out_dir / f"peaks-{experiment}.bed"
+        mapped_path = out_dir / f"mapped-{experiment}.bed"
+        write_experiment(peak_path, mapped_path, peak_count, gene_count, fan_out, seed, rng)
+        peak_paths.append(peak_path)
+        mapped_paths.append(mapped_path)
+
+    lookup_path = out_dir / "lookup.json"
+    write_lookup(lookup_path, gene_count, fan_out)
+    return SyntheticData(peak_paths, annotation_path, mapped_paths, lookup_path, peak_count, gene_count)
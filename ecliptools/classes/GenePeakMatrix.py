@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class GenePeakMatrix(object):
+    """
+    Sparse gene × peak incidence matrices, one per experiment (input file).
+    Genes, peaks and experiments are integer encoded, peaks by their (chrom, start, end) position.
+    Counts, unions and overlaps are sparse reductions, memory is proportional to the number of gene-peak pairs.
+    """
+    genes: pd.Index
+    peaks: pd.MultiIndex
+    experiments: list[str]
+    strands: pd.Series
+    incidence: dict[str, sparse.csr_matrix]
+
+    def __init__(self, genes: pd.Index, peaks: pd.MultiIndex, experiments: list[str], strands: pd.Series,
+                 incidence: dict[str, sparse.csr_matrix]):
+        self.genes = genes
+        self.peaks = peaks
+        self.experiments = experiments
+        self.strands = strands
+        self.incidence = incidence
+
+    @classmethod
+    def from_long(cls, long_df: pd.DataFrame) -> "GenePeakMatrix":
+        """
+        :param long_df: One row per annotation with the columns experiment, gene, strand, chrom, start and end.
+        Experiments keep the order of their first appearance, the strand of a gene is the one of its last row.
+        :return:
+        """
+        gene_codes, genes = pd.factorize(long_df["gene"], sort=False)
+        peak_codes, peaks = pd.MultiIndex.from_arrays(
+            [long_df["chrom"], long_df["start"], long_df["end"]]).factorize()
+        peaks = peaks.set_names(["chrom", "start", "end"])
+        experiment_codes, experiments = pd.factorize(long_df["experiment"], sort=False)
+
+        shape = (len(genes), len(peaks))
+        incidence: dict[str, sparse.csr_matrix] = {}
+        for code, experiment in enumerate(experiments):
+            rows = experiment_codes == code
+            matrix = sparse.csr_matrix((np.ones(rows.sum(), dtype=np.int32), (gene_codes[rows], peak_codes[rows])),
+                                       shape=shape)
+            # duplicate gene-peak pairs were summed, an incidence matrix only needs to know they exist
+            matrix.data[:] = 1
+            incidence[experiment] = matrix.astype(np.bool_)
+
+        strands = pd.Series(long_df["strand"].to_numpy(), index=gene_codes).groupby(level=0).last()
+        strands.index = genes[strands.index]
+
+        return cls(pd.Index(genes), peaks, list(experiments), strands, incidence)
+
+    @property
+    def union(self) -> sparse.csr_matrix:
+        """
+        Gene × peak incidence over all experiments
+        """
+        union = sparse.csr_matrix((len(self.genes), len(self.peaks)), dtype=np.bool_)
+        for matrix in self.incidence.values():
+            union = union + matrix
+        return union
+
+    def gene_experiment_counts(self) -> sparse.csr_matrix:
+        """
+        Gene × experiment matrix with the number of peaks of a gene in an experiment
+        """
+        return sparse.csr_matrix(np.column_stack(
+            [np.asarray(matrix.sum(axis=1, dtype=np.int64)).ravel() for matrix in self.incidence.values()]))
+
+    def counts(self) -> pd.DataFrame:
+        """
+        :return: A DataFrame indexed by gene with the columns counts-<experiment>, count-union and union-max-diff
+        """
+        counts = self.gene_experiment_counts().toarray()
+        df = pd.DataFrame(counts, index=self.genes, columns=[f"counts-{experiment}" for experiment in self.experiments])
+        df["count-union"] = np.asarray(self.union.sum(axis=1, dtype=np.int64)).ravel()
+        df["union-max-diff"] = df["count-union"] - (counts.max(axis=1) - counts.min(axis=1))
+        return df
+
+    def pairwise_overlaps(self) -> pd.DataFrame:
+        """
+        :return: Experiment × experiment DataFrame with the number of gene-peak pairs found in both experiments
+        """
+        matrices = list(self.incidence.values())
+        overlaps = np.zeros((len(matrices), len(matrices)), dtype=np.int64)
+        for a in range(len(matrices)):
+            for b in range(a, len(matrices)):
+                overlaps[a, b] = overlaps[b, a] = matrices[a].multiply(matrices[b]).nnz
+        return pd.DataFrame(overlaps, index=self.experiments, columns=self.experiments)
+
+    def gene_overlaps(self, experiment_a: str, experiment_b: str) -> pd.Series:
+        """
+        :return: The number of peaks every gene has in both experiments
+        """
+        shared = self.incidence[experiment_a].multiply(self.incidence[experiment_b])
+        return pd.Series(np.asarray(shared.sum(axis=1, dtype=np.int64)).ravel(), index=self.genes)
+
+    def merged_sites(self, min_overlap=1, max_gap=0) -> pd.DataFrame:
+        """
+        Merges the overlapping or nearby peaks of every gene over all experiments into binding sites.
+        The pairs are sorted once per gene and chromosome and swept with a running maximum of the peak ends,
+        which makes this O(n log n) in the number of gene-peak pairs.
+        :param min_overlap: Bases a peak has to overlap the current site to be merged into it
+        :param max_gap: If > 0, peaks up to this many bases away from the current site are merged as well
+        (min_overlap is ignored then)
+        :return: One row per site with the columns gene, chrom, start, end, peaks (number of distinct peaks)
+        and support (number of experiments with at least one peak in the site)
+        """
+        threshold = -max_gap if max_gap > 0 else min_overlap
+
+        gene_codes, peak_codes, experiment_codes = [], [], []
+        for code, matrix in enumerate(self.incidence.values()):
+            coo = matrix.tocoo()
+            gene_codes.append(coo.row)
+            peak_codes.append(coo.col)
+            experiment_codes.append(np.full(coo.nnz, code))
+        gene_codes = np.concatenate(gene_codes)
+        peak_codes = np.concatenate(peak_codes)
+        experiment_codes = np.concatenate(experiment_codes)
+
+        chrom_codes = pd.factorize(self.peaks.get_level_values("chrom"))[0][peak_codes]
+        starts = self.peaks.get_level_values("start").to_numpy(dtype=np.int64)[peak_codes]
+        ends = self.peaks.get_level_values("end").to_numpy(dtype=np.int64)[peak_codes]
+
+        order = np.lexsort((ends, starts, chrom_codes, gene_codes))
+        gene_codes, peak_codes, experiment_codes = gene_codes[order], peak_codes[order], experiment_codes[order]
+        chrom_codes, starts, ends = chrom_codes[order], starts[order], ends[order]
+
+        group_change = np.ones(len(order), dtype=np.bool_)
+        group_change[1:] = (gene_codes[1:] != gene_codes[:-1]) | (chrom_codes[1:] != chrom_codes[:-1])
+        groups = np.cumsum(group_change)
+
+        # offsetting every group keeps the running maximum from leaking into the next group
+        offset = int(ends.max(initial=0)) + abs(threshold) + 1
+        running_end = np.maximum.accumulate(groups * offset + ends) - groups * offset
+        new_site = group_change.copy()
+        new_site[1:] |= running_end[:-1] - starts[1:] < threshold
+        sites = np.cumsum(new_site) - 1
+
+        site_df = pd.DataFrame({"site": sites, "peak": peak_codes, "experiment": experiment_codes,
+                                "start": starts, "end": ends})
+        grouped = site_df.groupby("site", sort=True)
+        first = np.flatnonzero(new_site)
+        return pd.DataFrame({
+            "gene": self.genes[gene_codes[first]],
+            "chrom": self.peaks.get_level_values("chrom")[peak_codes[first]],
+            "start": grouped["start"].min().to_numpy(),
+            "end": grouped["end"].max().to_numpy(),
+            "peaks": grouped["peak"].nunique().to_numpy(),
+            "support": grouped["experiment"].nunique().to_numpy(),
+        })
+
+    def merged_union(self, min_overlap=1, max_gap=0) -> pd.DataFrame:
+        """
+        :param min_overlap: See merged_sites
+        :param max_gap: See merged_sites
+        :return: A DataFrame indexed by gene with the columns merged-union ({"chr:start-end": support})
+        and count-merged-union
+        """
+        sites = self.merged_sites(min_overlap, max_gap)
+        site_names = sites["chrom"].astype(str) + ":" + sites["start"].astype(str) + "-" + sites["end"].astype(str)
+
+        merged: dict[str, dict[str, int]] = {}
+        for gene, site_name, support in zip(sites["gene"], site_names, sites["support"].tolist()):
+            merged.setdefault(gene, {})[site_name] = support
+
+        df = pd.DataFrame({"merged-union": pd.Series(merged, dtype=object).reindex(self.genes)}, index=self.genes)
+        df["count-merged-union"] = sites.groupby("gene", sort=False).size().reindex(self.genes).fillna(0).astype(int)
+        return df
+
+    def peak_strings(self) -> np.ndarray:
+        return np.array([f"{chrom}:{start}-{end}" for chrom, start, end in self.peaks], dtype=object)
+
+    def peak_sets(self, matrix: sparse.csr_matrix, peak_strings: np.ndarray | None = None) -> pd.Series:
+        """
+        Converts the rows of an incidence matrix into sets of "chr:start-end" strings, genes without peaks get NaN.
+        """
+        if peak_strings is None:
+            peak_strings = self.peak_strings()
+
+        sets = np.empty(len(self.genes), dtype=object)
+        sets[:] = np.nan
+        matrix = matrix.tocsr()
+        for row in np.flatnonzero(np.diff(matrix.indptr)):
+            sets[row] = set(peak_strings[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]])
+        return pd.Series(sets, index=self.genes, dtype=object)
+
+    def to_frame(self, merge=False, min_overlap=1, max_gap=0) -> pd.DataFrame:
+        """
+        :param merge: Add the merged-union and count-merged-union columns of merged_union
+        :param min_overlap: See merged_sites
+        :param max_gap: See merged_sites
+        :return: The count-gene-peaks table: peaks-<experiment>, strand, peak-union, counts-<experiment>,
+        count-union and union-max-diff
+        """
+        peak_strings = self.peak_strings()
+        df = pd.DataFrame({f"peaks-{experiment}": self.peak_sets(matrix, peak_strings)
+                           for experiment, matrix in self.incidence.items()}, index=self.genes)
+        df["strand"] = self.strands.reindex(self.genes)
+        df["peak-union"] = self.peak_sets(self.union, peak_strings)
+        df = df.join(self.counts())
+        if merge:
+            df = df.join(self.merged_union(min_overlap, max_gap))
+        return df
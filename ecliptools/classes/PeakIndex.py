@@ -0,0 +1,250 @@
+import json
+import re
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from ecliptools.classes.Peak import BasePeak
+from ecliptools.classes.PeakTable import PeakTable
+from ecliptools.util.peak_arrow import arrow_to_peak_table, peak_table_to_arrow, read_peak_arrow
+
+# schema metadata key of the files written by PeakIndex.save
+INDEX_METADATA_KEY = b"ecliptools.peak_index"
+INDEX_FORMAT_VERSION = 1
+_REGION_PATTERN = re.compile(r"^(?P<chrom>[^:\s]+)(?::(?P<start>[\d,]+)-(?P<end>[\d,]+))?$")
+
+
+class Region(NamedTuple):
+    chrom: str
+    start: int
+    end: int
+
+    @classmethod
+    def parse(cls, region: str) -> "Region":
+        """
+        :param region: "chrom:start-end" in the bed coordinates of the peak files (0-based, end exclusive),
+        thousands separators are allowed, e.g. chr3:193,593,144-193,697,811. A chromosome alone is the whole
+        chromosome.
+        :return:
+        """
+        match = _REGION_PATTERN.match(region.strip())
+        if match is None:
+            raise ValueError(f"{region} is not a region like chr3:193,593,144-193,697,811")
+        if match["start"] is None:
+            return cls(match["chrom"], 0, np.iinfo(np.int32).max)
+        start, end = int(match["start"].replace(",", "")), int(match["end"].replace(",", ""))
+        if end < start:
+            raise ValueError(f"The end of {region} is before its start")
+        return cls(match["chrom"], start, end)
+
+
+class PeakGroup(NamedTuple):
+    # the peaks of one chromosome and strand are the index rows begin:end, sorted by start
+    begin: int
+    end: int
+    max_length: int
+
+
+class PeakIndex(object):
+    """
+    Region and gene index over the peaks of one or more converted peak files.
+    The peaks are kept in a PeakTable sorted by chromosome, strand and start, so the peaks of every chromosome and
+    strand are one contiguous block. Region queries bisect the start column of a block (with the longest peak of the
+    block as search window) and sorted end columns give counts without visiting peaks. Genes are found through an
+    inverted index from accession to peaks, in CSR layout: the peaks of gene i are
+    gene_peaks[gene_offsets[i]:gene_offsets[i + 1]].
+    Peaks are identified by their row in the index, BasePeaks are only created for query results.
+    """
+    peaks: PeakTable
+    sources: list[str]
+    peak_source: np.ndarray
+    groups: dict[tuple[str, str], PeakGroup]
+
+    genes: np.ndarray
+    gene_offsets: np.ndarray
+    gene_peaks: np.ndarray
+
+    def __init__(self, peaks: PeakTable, sources: list[str], peak_source: np.ndarray,
+                 groups: dict[tuple[str, str], PeakGroup]):
+        self.peaks = peaks
+        self.sources = sources
+        self.peak_source = np.asarray(peak_source, dtype=np.int32)
+        self.groups = groups
+        self._sorted_ends = {key: np.sort(peaks.peak_end[group.begin:group.end]) for key, group in groups.items()}
+        self._index_genes()
+
+    @classmethod
+    def from_peaks(cls, peaks: Iterable[BasePeak] | PeakTable, source="peaks") -> "PeakIndex":
+        return cls.from_sources({source: peaks})
+
+    @classmethod
+    def from_sources(cls, sources: dict[str, Iterable[BasePeak] | PeakTable]) -> "PeakIndex":
+        """
+        :param sources: The peaks of every file by the name they are reported with
+        :return:
+        """
+        tables = [peaks if isinstance(peaks, PeakTable) else PeakTable.from_peaks(peaks)
+                  for peaks in sources.values()]
+        peak_table = PeakTable.from_peaks(peak for table in tables for peak in table) if len(tables) != 1 \
+            else tables[0]
+        peak_source = np.repeat(np.arange(len(tables), dtype=np.int32), [len(table) for table in tables])
+
+        order = np.lexsort((peak_table.peak_end, peak_table.peak_start, peak_table.peak_minus_strand,
+                            peak_table.peak_chrom))
+        peak_table = peak_table.take(order)
+        return cls(peak_table, list(sources), peak_source[order], cls._find_groups(peak_table))
+
+    @staticmethod
+    def _find_groups(peak_table: PeakTable) -> dict[tuple[str, str], PeakGroup]:
+        """
+        :param peak_table: Sorted by chromosome, strand and start
+        """
+        if not len(peak_table):
+            return {}
+        group_keys = peak_table.peak_chrom.astype(np.int64) * 2 + peak_table.peak_minus_strand
+        bounds = np.concatenate([[0], np.flatnonzero(np.diff(group_keys)) + 1, [len(peak_table)]])
+        lengths = peak_table.peak_end - peak_table.peak_start
+
+        groups: dict[tuple[str, str], PeakGroup] = {}
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            strand = "-" if peak_table.peak_minus_strand[begin] else "+"
+            key = (peak_table.chroms[peak_table.peak_chrom[begin]], strand)
+            groups[key] = PeakGroup(int(begin), int(end), int(lengths[begin:end].max()))
+        return groups
+
+    def _index_genes(self):
+        """
+        Every peak is found by the unversioned accessions of its annotations and by the parent gene of their
+        transcripts, the gene count-gene-peaks counts them for.
+        """
+        peak_table = self.peaks
+        annotation_peaks = np.repeat(np.arange(len(peak_table), dtype=np.int64),
+                                     np.diff(peak_table.annotation_offsets))
+        unversioned = np.array([name.split(".")[0] for name in peak_table.names.values] or [""], dtype=object)
+        parents = np.array([info.parent or "" for info in peak_table.infos] + [""], dtype=object)
+
+        names = unversioned[peak_table.annotation_name]
+        # -1 (no info) picks the empty parent appended last
+        annotation_parents = parents[peak_table.annotation_info]
+        keys = np.concatenate([names, annotation_parents[annotation_parents != ""]])
+        key_peaks = np.concatenate([annotation_peaks, annotation_peaks[annotation_parents != ""]])
+
+        genes, gene_codes = np.unique(keys.astype(str), return_inverse=True)
+        pairs = np.unique(gene_codes.astype(np.int64) * max(len(peak_table), 1) + key_peaks)
+        self.genes = genes
+        self.gene_peaks = pairs % max(len(peak_table), 1)
+        self.gene_offsets = np.searchsorted(pairs // max(len(peak_table), 1), np.arange(len(genes) + 1))
+
+    def __len__(self):
+        return len(self.peaks)
+
+    def _strands(self, strand: str | None) -> list[str]:
+        return ["+", "-"] if strand is None else [strand]
+
+    def region(self, chrom: str, start: int, end: int, strand: str | None = None) -> np.ndarray:
+        """
+        :param chrom:
+        :param start: 0-based
+        :param end: exclusive
+        :param strand: "+", "-" or None for both
+        :return: The rows of the peaks overlapping the region by at least one base, sorted by strand and start
+        """
+        rows = []
+        for peak_strand in self._strands(strand):
+            group = self.groups.get((chrom, peak_strand))
+            if group is None:
+                continue
+            starts = self.peaks.peak_start[group.begin:group.end]
+            # no peak starting before start - max_length can reach the region
+            low = group.begin + int(np.searchsorted(starts, start - group.max_length, side="right"))
+            high = group.begin + int(np.searchsorted(starts, end, side="left"))
+            rows.append(low + np.flatnonzero(self.peaks.peak_end[low:high] > start))
+        return np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+
+    def count_region(self, chrom: str, start: int, end: int, strand: str | None = None) -> int:
+        """
+        Number of peaks overlapping the region, from the sorted starts and ends alone: all peaks starting before the
+        end of the region, minus those ending before its start.
+        """
+        count = 0
+        for peak_strand in self._strands(strand):
+            group = self.groups.get((chrom, peak_strand))
+            if group is None:
+                continue
+            starts = self.peaks.peak_start[group.begin:group.end]
+            count += int(np.searchsorted(starts, end, side="left")) - \
+                int(np.searchsorted(self._sorted_ends[(chrom, peak_strand)], start, side="right"))
+        return count
+
+    def gene(self, accession: str) -> np.ndarray:
+        """
+        :param accession: A gene or transcript accession, the version is ignored
+        :return: The rows of the peaks annotated to it, sorted
+        """
+        i = int(np.searchsorted(self.genes, accession.split(".")[0]))
+        if i == len(self.genes) or self.genes[i] != accession.split(".")[0]:
+            return np.zeros(0, dtype=np.int64)
+        return self.gene_peaks[self.gene_offsets[i]:self.gene_offsets[i + 1]]
+
+    def source(self, row: int) -> str:
+        return self.sources[self.peak_source[row]]
+
+    def save(self, out_path: Path | str):
+        """
+        Writes the index as an uncompressed Arrow file: the sorted peaks as written by write_peak_arrow with an
+        additional source column, the blocks of every chromosome and strand are kept in the schema metadata.
+        The file can be read by everything that reads to-arrow files.
+        """
+        table = peak_table_to_arrow(self.peaks)
+        source = pa.DictionaryArray.from_arrays(pa.array(self.peak_source[table.column("peak_id").to_numpy()]),
+                                                pa.array(self.sources, type=pa.string()))
+        table = table.append_column("source", source)
+        metadata = {
+            "version": INDEX_FORMAT_VERSION,
+            "sources": self.sources,
+            "groups": [[chrom, strand, *group] for (chrom, strand), group in self.groups.items()],
+        }
+        table = table.replace_schema_metadata({INDEX_METADATA_KEY: json.dumps(metadata).encode()})
+        with pa.OSFile(str(out_path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    @classmethod
+    def load(cls, in_path: Path | str) -> "PeakIndex":
+        table = read_peak_arrow(in_path)
+        metadata = index_metadata(table.schema)
+        if metadata is None:
+            raise ValueError(f"{in_path} is not a peak index written by PeakIndex.save")
+        if metadata["version"] != INDEX_FORMAT_VERSION:
+            raise ValueError(f"{in_path} has index version {metadata['version']}, rebuild it")
+
+        peak_table = arrow_to_peak_table(table)
+        first_rows = np.flatnonzero(np.diff(table.column("peak_id").to_numpy(), prepend=-1) != 0)
+        sources = metadata["sources"]
+        peak_source = pc.index_in(table.column("source").take(first_rows).cast(pa.string()),
+                                  value_set=pa.array(sources, type=pa.string()))
+        groups = {(chrom, strand): PeakGroup(begin, end, max_length)
+                  for chrom, strand, begin, end, max_length in metadata["groups"]}
+        return cls(peak_table, sources, peak_source.to_numpy(zero_copy_only=False), groups)
+
+
+def index_metadata(schema: pa.Schema) -> dict | None:
+    """
+    :return: The index metadata of a file written by PeakIndex.save, None for other Arrow files
+    """
+    if not schema.metadata or INDEX_METADATA_KEY not in schema.metadata:
+        return None
+    return json.loads(schema.metadata[INDEX_METADATA_KEY])
+
+
+def is_peak_index(path: Path | str) -> bool:
+    """
+    Only the schema of the file is read.
+    """
+    try:
+        with pa.memory_map(str(path)) as source:
+            return index_metadata(pa.ipc.open_file(source).schema) is not None
+    except (pa.ArrowInvalid, OSError):
+        return False
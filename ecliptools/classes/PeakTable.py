@@ -0,0 +1,226 @@
+from array import array
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from ecliptools.classes.Peak import Annotation, BasePeak, Info
+
+
+class StringTable(object):
+    """
+    Interns strings to consecutive integer codes.
+    """
+    values: list[str]
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.values = []
+        self._codes: dict[str, int] = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value: str) -> int:
+        if value not in self._codes:
+            self._codes[value] = len(self.values)
+            self.values.append(value)
+        return self._codes[value]
+
+    def __getitem__(self, code: int) -> str:
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class PeakTable(object):
+    """
+    Column store for BasePeaks and their Annotations.
+    Peaks and annotations are kept in typed numpy arrays, strings are stored once in StringTables and every
+    Info only once in a side table. The annotations of peak i are the rows
+    annotation_offsets[i]:annotation_offsets[i + 1] of the annotation columns.
+    Indexing or iterating returns BasePeak objects that are created on access, so code written for
+    lists of BasePeaks keeps working.
+    """
+    chroms: StringTable
+    names: StringTable
+    types: StringTable
+    infos: list[Info]
+
+    peak_chrom: np.ndarray
+    peak_start: np.ndarray
+    peak_end: np.ndarray
+    peak_minus_strand: np.ndarray
+    peak_name: np.ndarray
+
+    annotation_offsets: np.ndarray
+    annotation_chrom: np.ndarray
+    annotation_start: np.ndarray
+    annotation_end: np.ndarray
+    annotation_minus_strand: np.ndarray
+    annotation_name: np.ndarray
+    annotation_type: np.ndarray
+    annotation_sub_type: np.ndarray
+    annotation_info: np.ndarray
+
+    def __init__(self, chroms: StringTable, names: StringTable, types: StringTable, infos: list[Info],
+                 peak_columns: dict[str, np.ndarray], annotation_columns: dict[str, np.ndarray]):
+        self.chroms = chroms
+        self.names = names
+        self.types = types
+        self.infos = infos
+
+        self.peak_chrom = np.asarray(peak_columns["chrom"], dtype=np.int32)
+        self.peak_start = np.asarray(peak_columns["start"], dtype=np.int32)
+        self.peak_end = np.asarray(peak_columns["end"], dtype=np.int32)
+        self.peak_minus_strand = np.asarray(peak_columns["minus_strand"], dtype=np.bool_)
+        self.peak_name = np.asarray(peak_columns["name"], dtype=np.int32)
+
+        self.annotation_offsets = np.asarray(annotation_columns["offsets"], dtype=np.int64)
+        self.annotation_chrom = np.asarray(annotation_columns["chrom"], dtype=np.int32)
+        self.annotation_start = np.asarray(annotation_columns["start"], dtype=np.int32)
+        self.annotation_end = np.asarray(annotation_columns["end"], dtype=np.int32)
+        self.annotation_minus_strand = np.asarray(annotation_columns["minus_strand"], dtype=np.bool_)
+        self.annotation_name = np.asarray(annotation_columns["name"], dtype=np.int32)
+        self.annotation_type = np.asarray(annotation_columns["type"], dtype=np.int32)
+        self.annotation_sub_type = np.asarray(annotation_columns["sub_type"], dtype=np.int32)
+        self.annotation_info = np.asarray(annotation_columns["info"], dtype=np.int32)
+
+    @classmethod
+    def from_peaks(cls, peaks: Iterable[BasePeak]) -> "PeakTable":
+        """
+        Builds a PeakTable from BasePeaks, peaks can come from a generator.
+        Infos are deduplicated by their ID.
+        :param peaks:
+        :return:
+        """
+        chroms = StringTable()
+        names = StringTable()
+        types = StringTable()
+        infos: list[Info] = []
+        info_codes: dict[str, int] = {}
+
+        peak_columns = {column: array("i") for column in ("chrom", "start", "end", "name")}
+        peak_columns["minus_strand"] = array("b")
+        annotation_columns = {column: array("i") for column in
+                              ("chrom", "start", "end", "name", "type", "sub_type", "info")}
+        annotation_columns["minus_strand"] = array("b")
+        annotation_columns["offsets"] = array("q", [0])
+
+        for peak in peaks:
+            peak_columns["chrom"].append(chroms.code(peak.chrom))
+            peak_columns["start"].append(int(peak.start))
+            peak_columns["end"].append(int(peak.end))
+            peak_columns["name"].append(names.code(peak.name))
+            peak_columns["minus_strand"].append(peak.strand == "-")
+
+            for annotation in peak.annotations:
+                info_code = -1
+                if annotation.info is not None:
+                    if annotation.info.ID not in info_codes:
+                        info_codes[annotation.info.ID] = len(infos)
+                        infos.append(annotation.info)
+                    info_code = info_codes[annotation.info.ID]
+
+                annotation_columns["chrom"].append(chroms.code(annotation.chrom))
+                annotation_columns["start"].append(int(annotation.start))
+                annotation_columns["end"].append(int(annotation.end))
+                annotation_columns["name"].append(names.code(annotation.name))
+                annotation_columns["type"].append(types.code(annotation.type))
+                annotation_columns["sub_type"].append(types.code(annotation.sub_type))
+                annotation_columns["info"].append(info_code)
+                annotation_columns["minus_strand"].append(annotation.strand == "-")
+
+            annotation_columns["offsets"].append(len(annotation_columns["chrom"]))
+
+        return cls(chroms, names, types, infos,
+                   {column: np.frombuffer(values, dtype=values.typecode) for column, values in peak_columns.items()},
+                   {column: np.frombuffer(values, dtype=values.typecode)
+                    for column, values in annotation_columns.items()})
+
+    @classmethod
+    def concatenate(cls, tables: list["PeakTable"]) -> "PeakTable":
+        """
+        :param tables: PeakTables sharing their string tables and infos, e.g. the chunks of one file
+        :return: A PeakTable with the peaks of all tables in their order
+        """
+        offsets = [tables[0].annotation_offsets[:1]]
+        for table in tables:
+            offsets.append(table.annotation_offsets[1:] + offsets[-1][-1])
+        peak_columns = {column: np.concatenate([getattr(table, f"peak_{column}") for table in tables])
+                        for column in ("chrom", "start", "end", "minus_strand", "name")}
+        annotation_columns = {column: np.concatenate([getattr(table, f"annotation_{column}") for table in tables])
+                              for column in ("chrom", "start", "end", "minus_strand", "name", "type", "sub_type",
+                                             "info")}
+        annotation_columns["offsets"] = np.concatenate(offsets)
+        first = tables[0]
+        return cls(first.chroms, first.names, first.types, first.infos, peak_columns, annotation_columns)
+
+    def __len__(self):
+        return len(self.peak_start)
+
+    @property
+    def annotation_count(self) -> int:
+        return len(self.annotation_start)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the numpy columns, without the string and info tables
+        """
+        return sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+
+    def take(self, peak_ids: np.ndarray) -> "PeakTable":
+        """
+        :param peak_ids: The peaks of the new table in their new order
+        :return: A PeakTable with these peaks and their annotations, the string tables and infos are shared
+        """
+        peak_ids = np.asarray(peak_ids, dtype=np.int64)
+        counts = np.diff(self.annotation_offsets)[peak_ids]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        # the old annotation index of every new annotation, annotation ranges are copied as a whole
+        annotation_ids = np.repeat(self.annotation_offsets[peak_ids] - offsets[:-1], counts) + np.arange(offsets[-1])
+
+        peak_columns = {column: getattr(self, f"peak_{column}")[peak_ids]
+                        for column in ("chrom", "start", "end", "minus_strand", "name")}
+        annotation_columns = {column: getattr(self, f"annotation_{column}")[annotation_ids]
+                              for column in ("chrom", "start", "end", "minus_strand", "name", "type", "sub_type",
+                                             "info")}
+        annotation_columns["offsets"] = offsets
+        return PeakTable(self.chroms, self.names, self.types, self.infos, peak_columns, annotation_columns)
+
+    def annotation(self, i: int) -> Annotation:
+        info_code = self.annotation_info[i]
+        return Annotation(
+            chrom=self.chroms[self.annotation_chrom[i]],
+            start=int(self.annotation_start[i]),
+            end=int(self.annotation_end[i]),
+            name=self.names[self.annotation_name[i]],
+            strand="-" if self.annotation_minus_strand[i] else "+",
+            type=self.types[self.annotation_type[i]],
+            sub_type=self.types[self.annotation_sub_type[i]],
+            info=self.infos[info_code] if info_code >= 0 else None
+        )
+
+    def peak(self, i: int) -> BasePeak:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("PeakTable index out of range")
+
+        annotation_range = range(self.annotation_offsets[i], self.annotation_offsets[i + 1])
+        return BasePeak(
+            chrom=self.chroms[self.peak_chrom[i]],
+            start=int(self.peak_start[i]),
+            end=int(self.peak_end[i]),
+            name=self.names[self.peak_name[i]],
+            strand="-" if self.peak_minus_strand[i] else "+",
+            annotations=[self.annotation(j) for j in annotation_range]
+        )
+
+    def __getitem__(self, item: int | slice) -> BasePeak | list[BasePeak]:
+        if isinstance(item, slice):
+            return [self.peak(i) for i in range(*item.indices(len(self)))]
+        return self.peak(item)
+
+    def __iter__(self) -> Iterator[BasePeak]:
+        for i in range(len(self)):
+            yield self.peak(i)
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+import importlib
+from typing import NamedTuple
+
+import click
+
+
+class CommandEntry(NamedTuple):
+    # "module:attribute" of the click command, the module is only imported when the command is used
+    import_path: str
+    short_help: str
+
+
+# the short help is repeated here, so listing the commands does not import pandas, requests and the like
+COMMANDS: dict[str, CommandEntry] = {
+    "annotate": CommandEntry("ecliptools.scripts.annotate:annotate_command",
+                             "Annotate an eCLIP peak bed file with genes and rRNA."),
+    "convert": CommandEntry("ecliptools.scripts.convert_bed:convert",
+                            "Convert bedmap annotated bed files to json or Arrow."),
+    "get-lookup-file": CommandEntry("ecliptools.scripts.get_lookup:get_lookup_file",
+                                    "Look up all Ensembl identifiers found in files."),
+    "count-gene-peaks": CommandEntry("ecliptools.scripts.count_gene_peaks:count_gene_peaks_command",
+                                     "Count the peaks of every gene per input file."),
+    "append-refs": CommandEntry("ecliptools.scripts.append_references:append_references_command",
+                                "Add lookup information and aliases to a counted table."),
+    "extract-sequences": CommandEntry("ecliptools.scripts.extract_sequences:extract_sequences_command",
+                                      "Extract the peak sequences from a local genome FASTA."),
+    "count-codons": CommandEntry("ecliptools.scripts.count_codons:count_codons_command",
+                                 "Count the codons of peaks in coding transcripts."),
+    "kmer-enrichment": CommandEntry("ecliptools.scripts.kmer_enrichment:kmer_enrichment_command",
+                                    "Test the k-mers of peak sequences for enrichment."),
+    "query": CommandEntry("ecliptools.scripts.query_peaks:query",
+                          "Find the peaks in genomic regions or of genes."),
+    "pipeline": CommandEntry("ecliptools.scripts.pipeline:pipeline_command",
+                             "Download, annotate, count and reference eCLIP experiments."),
+    "cache": CommandEntry("ecliptools.scripts.cache:cache", "Manage the persistent Ensembl response cache."),
+    "benchmark": CommandEntry("ecliptools.benchmark.run:benchmark_command",
+                              "Benchmark the processing steps on synthetic data."),
+}
+
+
+class LazyGroup(click.Group):
+    """
+    A click group that imports the module of a subcommand only when that subcommand is invoked or its help is shown.
+    """
+
+    def __init__(self, *args, lazy_commands: dict[str, CommandEntry] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        command = super().get_command(ctx, cmd_name)
+        if command is not None or cmd_name not in self.lazy_commands:
+            return command
+
+        module_name, attribute = self.lazy_commands[cmd_name].import_path.split(":")
+        command = getattr(importlib.import_module(module_name), attribute)
+        if not isinstance(command, click.Command):
+            raise TypeError(f"{module_name}:{attribute} is not a click command")
+        # the commands are registered under the name used here, independent of the name in their module
+        self.commands[cmd_name] = command
+        return command
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter):
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                command = self.commands[name]
+                if command.hidden:
+                    continue
+                rows.append((name, command.get_short_help_str(formatter.width - 6 - len(name))))
+            else:
+                rows.append((name, self.lazy_commands[name].short_help))
+
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
+
+
+@click.group("ecliptools", cls=LazyGroup, lazy_commands=COMMANDS)
+def cli():
+    """
+    Tools to annotate, count and reference eCLIP peaks.
+    """
+    pass
+
+
+if __name__ == "__main__":
+    cli()
@@ -1,15 +1,3 @@
-# Get HepG2 Cell Line DHX30 eCLIP IDR Data
-wget https://www.encodeproject.org/files/ENCFF663QIZ/@@download/ENCFF663QIZ.bed.gz
-gunzip ENCFF663QIZ.bed.gz
-
-# Get K562 Cell Line DHX30 eCLIP IDR Data
-wget https://www.encodeproject.org/files/ENCFF128AKC/@@download/ENCFF128AKC.bed.gz
-gunzip ENCFF128AKC.bed.gz
-
-# Sort by chromosome then position using BEDTOOLS bed-sort
-sort-bed ENCFF128AKC.bed > ENCFF128AKC.sorted.bed
-sort-bed ENCFF128AKC.bed > ENCFF128AKC.sorted.bed
-
 # Get ucsc whole genome comprehensive annotation data
 wget http://hgdownload.cse.ucsc.edu/goldenpath/hg38/database/wgEncodeGencodeCompV43.txt.gz
 gunzip wgEncodeGencodeCompV43.txt.gz
@@ -29,10 +17,7 @@ sort-bed rRNA_loci.bed > rRNA_loci.sorted.bed
 # Merge the knownGenes and rRNA annotation bed files for easier processing
 # NOTE: those bed files are NOT .bed compliant they also contain some data delimited by ; instead of \t
 cat knownGenes.sorted.bed rRNA_loci.sorted.bed > genesAndrRNA.bed
-sort-bed genesAndrRNA.bed > genesAndrRNA.sorted.bed
-
-# annotate the file using the BEDTOOLS bedmap utility
-bedmap --delim "\t" --multidelim "\t" --unmapped-val "UNKNOWN" --echo --echo-map ENCFF663QIZ.sorted.bed genesAndrRNA.sorted.bed > ENCFF663QIZ.mapped.bed
-bedmap --delim "\t" --multidelim "\t" --unmapped-val "UNKNOWN" --echo --echo-map ENCFF128AKC.sorted.bed genesAndrRNA.sorted.bed > ENCFF128AKC.mapped.bed
-
 
+# Download the HepG2 (ENCFF663QIZ) and K562 (ENCFF128AKC) DHX30 eCLIP IDR data, look up, annotate, count and
+# reference them. Steps whose inputs did not change are skipped, so more experiments can be appended later.
+python -m ecliptools pipeline --annotation genesAndrRNA.bed ENCFF663QIZ ENCFF128AKC
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+from pathlib import Path
+from typing import Mapping, TextIO, Iterator, NamedTuple
+
+import click
+
+from ecliptools.classes.Peak import Annotation, BasePeak
+from ecliptools.util.get_info import InfoCache
+from ecliptools.util.lookup_store import open_lookup
+from ecliptools.util.peak_filter import NO_FILTER, PeakFilter, peak_filter_options
+from ecliptools.util.write_peak_json import write_peak_json
+
+
+class BedInterval(NamedTuple):
+    chrom: str
+    start: int
+    end: int
+    strand: str
+    fields: tuple[str, ...]
+
+
+def read_peak_bed(in_file: TextIO | Path) -> dict[str, list[BedInterval]]:
+    """
+    Reads a ENCODE eCLIP peak bed file (chrom, start, end, name, score, strand, ...) grouped by chromosome.
+    Every chromosome is sorted by start and end position.
+    :param in_file:
+    :return:
+    """
+    return _read_bed(in_file, strand_column=5)
+
+
+def read_annotation_bed(in_file: TextIO | Path) -> dict[str, list[BedInterval]]:
+    """
+    Reads the merged genes and rRNA annotation bed file (chrom, start, end, strand, name, type, sub_type)
+    grouped by chromosome. Every chromosome is sorted by start and end position.
+    :param in_file:
+    :return:
+    """
+    return _read_bed(in_file, strand_column=3)
+
+
+def _read_bed(in_file: TextIO | Path, strand_column: int) -> dict[str, list[BedInterval]]:
+    if isinstance(in_file, Path):
+        in_file = in_file.open("r")
+
+    by_chrom: dict[str, list[BedInterval]] = {}
+    for line in in_file:
+        line = line.rstrip("\n")
+        if not line or line.startswith(("#", "track", "browser")):
+            continue
+        fields = line.split("\t")
+        interval = BedInterval(
+            chrom=fields[0],
+            start=int(fields[1]),
+            end=int(fields[2]),
+            strand=fields[strand_column],
+            fields=tuple(fields)
+        )
+        by_chrom.setdefault(interval.chrom, []).append(interval)
+
+    for intervals in by_chrom.values():
+        intervals.sort(key=lambda interval: (interval.start, interval.end))
+
+    return by_chrom
+
+
+def sweep_overlaps(peaks: list[BedInterval], annotations: list[BedInterval]) \
+        -> Iterator[tuple[BedInterval, list[BedInterval]]]:
+    """
+    Sorted sweep-line over the peaks and annotations of a single chromosome.
+    Both lists have to be sorted by start. Yields every peak together with all annotations overlapping it
+    by at least one base, regardless of strand (same as bedmap).
+    :param peaks:
+    :param annotations:
+    :return:
+    """
+    active: list[BedInterval] = []
+    next_annotation = 0
+    for peak in peaks:
+        # Annotations ending before this peak can not overlap any following peak either
+        active = [annotation for annotation in active if annotation.end > peak.start]
+
+        while next_annotation < len(annotations) and annotations[next_annotation].start < peak.end:
+            annotation = annotations[next_annotation]
+            if annotation.end > peak.start:
+                active.append(annotation)
+            next_annotation += 1
+
+        # A long previous peak may have activated annotations that start behind this peak
+        yield peak, [annotation for annotation in active if annotation.start < peak.end]
+
+
+def annotate_peaks(peaks: dict[str, list[BedInterval]], annotations: dict[str, list[BedInterval]],
+                   lookup: Mapping[str, dict[str, any]], peak_filter: PeakFilter = NO_FILTER) -> Iterator[BasePeak]:
+    """
+    Annotates the peaks in one pass per chromosome. Chromosomes are processed in the same order as sort-bed.
+    Peaks without any overlapping annotation are dropped, annotations on the opposite strand are removed.
+    Annotations of the same accession share one Info.
+    Peaks rejected by the filter are removed before the sweep. Annotations are filtered per peak like in to-json,
+    so peaks without accepted annotations are kept with empty annotations unless the filter drops them.
+    :param peaks: Peaks as returned by read_peak_bed
+    :param annotations: Annotations as returned by read_annotation_bed
+    :param lookup: The lookup data created by get-lookup-file (dict or LookupStore)
+    :param peak_filter:
+    :return:
+    """
+    infos = InfoCache(lookup)
+    for chrom in sorted(peaks):
+        chrom_peaks = [peak for peak in peaks[chrom] if peak_filter.accepts_peak(peak.chrom, peak.start, peak.end)]
+        for peak, overlapping in sweep_overlaps(chrom_peaks, annotations.get(chrom, [])):
+            if not overlapping:
+                continue
+
+            peak_annotations: list[Annotation] = []
+            for annotation in overlapping:
+                if annotation.strand != peak.strand:
+                    continue
+
+                fields = annotation.fields
+                if not peak_filter.accepts_annotation(fields[5], fields[6]):
+                    continue
+                info = infos.get(fields[4])
+                if not peak_filter.accepts_info(info):
+                    continue
+
+                peak_annotations.append(Annotation(
+                    chrom=annotation.chrom,
+                    start=annotation.start,
+                    end=annotation.end,
+                    strand=annotation.strand,
+                    name=fields[4],
+                    type=fields[5],
+                    sub_type=fields[6],
+                    info=info
+                ))
+
+            if not peak_annotations and peak_filter.drop_unannotated:
+                continue
+
+            yield BasePeak(
+                chrom=peak.chrom,
+                start=peak.start,
+                end=peak.end,
+                name=peak.fields[3],
+                strand=peak.strand,
+                annotations=peak_annotations
+            )
+
+
+def annotate(peak_file: TextIO | Path, annotation_file: TextIO | Path, lookup_file: TextIO | Path,
+             out_file: TextIO | Path, clear_text=False, peak_filter: PeakFilter = NO_FILTER) -> int:
+    """
+    Annotates a peak bed file with a genes and rRNA bed file and writes the same json as to-json.
+    Replaces the sort-bed, bedmap and to-json steps.
+    :param peak_file: The eCLIP peak bed file, does not need to be sorted
+    :param annotation_file: The merged genes and rRNA bed file, does not need to be sorted
+    :param lookup_file: A JSON file or SQLite lookup store containing additional information created by
+    get_lookup_file
+    :param out_file:
+    :param clear_text:
+    :param peak_filter:
+    :return: The number of written peaks
+    """
+    if isinstance(out_file, Path):
+        out_file = out_file.open("w")
+
+    lookup = open_lookup(lookup_file)
+    peaks = annotate_peaks(read_peak_bed(peak_file), read_annotation_bed(annotation_file), lookup, peak_filter)
+    return write_peak_json(peaks, out_file, clear_text)
+
+
+@click.command("annotate")
+@click.argument("peak_file", type=click.File("r"))
+@click.argument("annotation_file", type=click.File("r"))
+@click.argument("lookup_file", type=click.File("r"))
+@click.argument("out_file", type=click.File("w"))
+@click.option("--clear/--no-clear", default=False,
+              help="If True this will output humanly readable json. False will allow further use with this tools.")
+@peak_filter_options
+def annotate_command(peak_file: TextIO, annotation_file: TextIO, lookup_file: TextIO, out_file: TextIO, clear=False,
+                     peak_filter: PeakFilter = NO_FILTER):
+    """
+    Annotates an eCLIP peak bed file with a genes and rRNA bed file and writes the result as json.
+    Overlaps are found in process with a sweep-line per chromosome, so neither sort-bed nor bedmap are needed.
+    Annotations that do not respect strandedness are removed.
+    :param peak_file: The eCLIP peak bed file
+    :param annotation_file: The merged genes and rRNA bed file
+    :param lookup_file: A JSON file or SQLite lookup store containing additional information created by
+    get_lookup_file
+    :param out_file:
+    :param clear: If True this outputs more humanly readable json, but further processing with ecliptools is not possible
+    :param peak_filter: Built from the filter options
+    :return:
+    """
+    annotate(peak_file, annotation_file, lookup_file, out_file, clear, peak_filter)
+
+
+if __name__ == "__main__":
+    annotate_command()
@@ -1,71 +1,83 @@
 #!/usr/bin/python
+import asyncio
 import json
 import sys
 from pathlib import Path
-from typing import TextIO, Hashable
+from typing import TextIO
 
 import click
 import pandas as pd
-import requests
 
-REQUEST_CACHE: dict[Hashable, str] = {}
+from ecliptools.util.ensembl_client import EnsemblClient, ensembl_client_options, gather_with_progress, \
+    get_ensembl_client
+from ecliptools.util.lookup_store import lookup_many, open_lookup
+from ecliptools.util.profiling import get_profiler, profile_options
+from ecliptools.util.response_cache import get_response_cache
 
 
-def get_references(gene_id: Hashable) -> str:
-    if pd.isna(gene_id):
-        return ""
-
-    server = "https://rest.ensembl.org"
-    ext = f"/xrefs/id/{gene_id}?"
-    full_url = server+ext
-
-    if gene_id in REQUEST_CACHE:
-        return REQUEST_CACHE[gene_id]
-
-    r = requests.get(server + ext, headers={"Content-Type": "application/json"})
-
-    if not r.ok:
-        click.echo(f"Request Error for {full_url} {r.status_code}: {r.reason}", file=sys.stderr)
-        return "\"[]\""
+async def fetch_aliases(client: EnsemblClient, gene_id: str) -> list[str]:
+    """
+    Collects the synonyms of all cross references of a gene from the /xrefs/id endpoint.
+    :param client:
+    :param gene_id:
+    :return: The sorted synonyms, empty if the request failed
+    """
+    cache = get_response_cache()
+    decoded = cache.get(client.server, "xrefs/id", gene_id)
+    if decoded is None:
+        decoded = await client.get_json(f"/xrefs/id/{gene_id}?")
+        if decoded is None:
+            return []
 
-    decoded = r.json()
+        cache.set(client.server, "xrefs/id", gene_id, decoded)
 
     synonym_set = set()
     for ref in decoded:
         if ref["synonyms"]:
             synonym_set.update(ref["synonyms"])
 
-    synonym_set_string = "[\"" + "\",\"".join(synonym_set) + "\"]"
-    if len(synonym_set) == 0:
-        synonym_set_string = "[]"
-    REQUEST_CACHE[gene_id] = synonym_set_string
-    return synonym_set_string
+    return sorted(synonym_set)
 
 
-def get_ref_df(df: pd.DataFrame) -> pd.DataFrame:
-    reference_dict: dict[Hashable, str] = {}
+def get_aliases(gene_id: str) -> list[str]:
+    return asyncio.run(fetch_aliases(get_ensembl_client(), gene_id))
 
-    with click.progressbar(df.iterrows(), length=df.shape[0], file=sys.stderr) as bar:
-        for i, row in bar:
-            reference_dict[i] = get_references(i)
 
-    return pd.DataFrame.from_dict(reference_dict, orient="index", columns=["aliases"])
+def get_ref_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fetches the aliases of every unique, non null gene id in the index of df concurrently.
+    :param df:
+    :return: A DataFrame indexed by gene id with the list typed column aliases, ready to be joined with df
+    """
+    gene_ids = [str(gene_id) for gene_id in df.index.dropna().unique()]
 
+    client = get_ensembl_client()
+    aliases = asyncio.run(gather_with_progress((fetch_aliases(client, gene_id) for gene_id in gene_ids), "Aliases"))
 
-def append_references(in_file: TextIO | Path, out_file: TextIO | Path | None, lookup_file: TextIO | Path) -> pd.DataFrame:
+    return pd.DataFrame({"aliases": pd.Series(aliases, index=gene_ids, dtype=object)})
 
-    main_df = pd.read_csv(in_file, sep="\t", header=0, index_col=0)
 
-    ref_df = get_ref_df(main_df)
-    joined = main_df.join(ref_df)
+def _aliases_to_json(aliases: pd.Series) -> pd.Series:
+    return aliases.map(lambda gene_aliases: json.dumps(gene_aliases if isinstance(gene_aliases, list) else [],
+                                                         separators=(",", ":")))
 
-    if isinstance(lookup_file, Path):
-        lookup_file = lookup_file.open("r")
 
-    lookup_json = json.load(lookup_file)
-    lookup_df = pd.DataFrame.from_dict(lookup_json, orient="index")
-    lookup_df.drop("ID", axis=1, inplace=True)
-    joined = joined.join(lookup_df)
+def append_references(in_file: TextIO | Path, out_file: TextIO | Path | None, lookup_file: TextIO | Path) -> pd.DataFrame:
+    profiler = get_profiler()
+    with profiler.stage("read"):
+        main_df = pd.read_csv(in_file, sep="\t", header=0, index_col=0)
+
+    with profiler.stage("aliases"):
+        ref_df = get_ref_df(main_df)
+
+    with profiler.stage("join"):
+        joined = main_df.join(ref_df)
+        # only the genes of the table are read from the lookup
+        lookup = open_lookup(lookup_file)
+        gene_ids = [str(gene_id) for gene_id in main_df.index.dropna().unique()]
+        lookup_df = pd.DataFrame.from_dict(lookup_many(lookup, gene_ids), orient="index")
+        lookup_df.drop("ID", axis=1, inplace=True, errors="ignore")
+        joined = joined.join(lookup_df)
 
     if not out_file:
         return joined
@@ -73,7 +85,10 @@ def append_references(in_file: TextIO | Path, out_file: TextIO | Path | None, lo
     if isinstance(out_file, Path):
         out_file = out_file.open("w")
 
-    joined.to_csv(out_file, sep="\t", encoding="utf8", lineterminator="\n")
+    # lists are written as JSON arrays
+    with profiler.stage("write"):
+        joined.assign(aliases=_aliases_to_json(joined["aliases"])).to_csv(out_file, sep="\t", encoding="utf8",
+                                                                         lineterminator="\n")
     return joined
 
 
@@ -81,13 +96,16 @@ def append_references(in_file: TextIO | Path, out_file: TextIO | Path | None, lo
 @click.option("-o", "--out-file", type=click.File("w"), default=sys.stdout)
 @click.option("-i", "--in-file", type=click.File("r"), default=sys.stdin)
 @click.argument("lookup_file", type=click.File("r"))
+@profile_options
+@ensembl_client_options
 def append_references_command(out_file: TextIO, in_file: TextIO, lookup_file: TextIO):
     """
-    This will take in annotated table and adds information from a JSON formatted lookup file to it.
+    This will take in annotated table and adds information from a JSON formatted lookup file (or SQLite lookup
+    store) to it.
     It will also search for different names in the ENSEMBLE database and append them as well.
     :param out_file:
     :param in_file: The base table to enrich with reference data
-    :param lookup_file: A JSON file obtained by get-lookup-file
+    :param lookup_file: A JSON file or SQLite lookup store obtained by get-lookup-file
     :return:
     """
     append_references(in_file, out_file, lookup_file)
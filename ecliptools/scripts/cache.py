@@ -0,0 +1,47 @@
+#!/usr/bin/python
+import click
+
+from ecliptools.util.response_cache import get_response_cache
+
+
+@click.group("cache")
+def cache():
+    """
+    Manage the persistent Ensembl response cache.
+    It is configured with ECLIPTOOLS_CACHE, ECLIPTOOLS_CACHE_TTL, ECLIPTOOLS_CACHE_MAX_ENTRIES and ENSEMBL_RELEASE.
+    """
+    pass
+
+
+@cache.command("stats")
+def stats_command():
+    """
+    Prints the number of cached responses per server and endpoint.
+    """
+    response_cache = get_response_cache()
+    click.echo(f"Cache: {response_cache.path or 'in memory'}")
+    for (server, endpoint), count in sorted(response_cache.entry_counts().items()):
+        click.echo(f"{server}\t{endpoint}\t{count}")
+
+
+@cache.command("purge")
+def purge_command():
+    """
+    Removes expired responses and responses of other Ensembl releases.
+    """
+    removed = get_response_cache().purge()
+    click.echo(f"Removed {removed} responses")
+
+
+@cache.command("clear")
+@click.option("--endpoint", default=None, help="Only clear this endpoint, e.g. lookup/id")
+@click.option("--server", default=None, help="Only clear the responses of this server, e.g. https://rest.ensembl.org")
+def clear_command(endpoint: str | None = None, server: str | None = None):
+    """
+    Removes all cached responses.
+    """
+    get_response_cache().clear(endpoint, server.rstrip("/") if server else None)
+
+
+if __name__ == "__main__":
+    cache()
@@ -1,92 +1,47 @@
 #!/usr/bin/python
-import json
 from pathlib import Path
 from typing import TextIO
 import click
-import jsonpickle
-import pandas as pd
-from ecliptools.classes.Peak import Annotation, Info, BasePeak
-from ecliptools.util.create_dynamic_column_names import create_dynamic_column_names
+from ecliptools.classes.PeakTable import PeakTable
+from ecliptools.util.lookup_store import open_lookup
+from ecliptools.util.peak_arrow import write_peak_arrow
+from ecliptools.util.peak_filter import NO_FILTER, PeakFilter, peak_filter_options
+from ecliptools.util.profiling import get_profiler, profile_options
+from ecliptools.util.read_mapped_bed import read_mapped_bed, read_mapped_table
+from ecliptools.util.write_peak_json import write_peak_json
 
 
 @click.group()
 def convert():
+    """
+    Converts bedmap annotated bed files to json or Arrow.
+    """
     pass
 
 
-def convert_df_to_json(df: pd.DataFrame, enst_lookup_json: dict[str, dict[str, any]]):
-    out = []
-    for _, row in df.iterrows():
-        annotations: list[Annotation] = []
-
-        if row[10] == "UNKNOWN":
-            continue
-        for i, column in row.items():
-            if pd.isna(column):
-                continue
-
-            column_num = int(i)
-            if column_num <= 8 or (column_num - 10) % 7 != 0:
-                continue
-
-            if row[column_num+3] != row[5]:
-                continue
-
-            info: Info | None = None
-            unversioned_name = row[column_num+4].split(".")[0]
-            if unversioned_name in enst_lookup_json:
-                info_dict = enst_lookup_json[unversioned_name]
-                info = Info(info_dict=info_dict)
-
-            annotation = Annotation(
-                chrom=row[column_num],
-                start=int(row[column_num+1]),
-                end=int(row[column_num+2]),
-                strand=row[column_num+3],
-                name=row[column_num+4],
-                type=row[column_num+5],
-                sub_type=row[column_num+6],
-                info=info
-            )
-            annotations.append(annotation)
-
-        base_peak = BasePeak(
-            chrom=row[0],
-            start=row[1],
-            end=row[2],
-            name=row[3],
-            strand=row[5],
-            annotations=annotations
-        )
-
-        out.append(base_peak)
-
-    return out
-
-
-def tojson(in_path: Path, lookup_file: TextIO | Path, out_file: TextIO | Path, clear_text=False):
+def tojson(in_path: Path, lookup_file: TextIO | Path, out_file: TextIO | Path, clear_text=False,
+           peak_filter: PeakFilter = NO_FILTER):
     """
     Takes in a annotated bed file and returns a json file. Appends further information from a lookup file.
-    Remove annotations that did not respect strandedness
+    Remove annotations that did not respect strandedness.
+    The bed file is streamed line by line, peaks are written as soon as they are parsed.
     :param in_path: Path to the annotated bed file that is to be converted
-    :param lookup_file: A JSON file containing additional information created by get_lookup_file
+    :param lookup_file: A JSON file or SQLite lookup store containing additional information created by
+    get_lookup_file
     :param out_file:
     :param clear_text:
+    :param peak_filter: Applied while parsing, see read_mapped_bed
     :return:
     """
-    if isinstance(lookup_file, Path):
-        lookup_file = lookup_file.open("r")
-
     if isinstance(out_file, Path):
         out_file = out_file.open("w")
 
-    df = pd.read_csv(in_path, sep="\t", header=None, index_col=None, names=create_dynamic_column_names(in_path),
-                     engine="python")
-
-    lookup = json.load(lookup_file)
-    json_df = convert_df_to_json(df, lookup)
-    out_json = jsonpickle.encode(json_df, unpicklable=not clear_text, indent=4, include_properties=True)
-    out_file.write(out_json)
+    profiler = get_profiler()
+    with profiler.stage("read-lookup"):
+        lookup = open_lookup(lookup_file)
+    # parsing and encoding are interleaved, their share is in the parse and encode counters
+    with profiler.stage("convert"), open(in_path, "r") as in_file:
+        write_peak_json(read_mapped_bed(in_file, lookup, peak_filter=peak_filter), out_file, clear_text)
 
 
 @convert.command("to-json")
@@ -95,18 +50,69 @@ def tojson(in_path: Path, lookup_file: TextIO | Path, out_file: TextIO | Path, c
 @click.argument("out_file", type=click.File("w"))
 @click.option("--clear/--no-clear", default=False,
               help="If True this will output humanly readable json. False will allow further use with this tools.")
-def tojson_command(in_path: Path, lookup_file: TextIO, out_file: TextIO, clear=False):
+@peak_filter_options
+@profile_options
+def tojson_command(in_path: Path, lookup_file: TextIO, out_file: TextIO, clear=False,
+                   peak_filter: PeakFilter = NO_FILTER):
     """
     Takes in one or more annotated bed files and returns a json file.
     Appends further information from a lookup file.
     Remove annotations that did not respect strandedness.
     :param in_path: Path to the annotated bed file that is to be converted
-    :param lookup_file: A JSON file containing additional information created by get_lookup_file
+    :param lookup_file: A JSON file or SQLite lookup store containing additional information created by
+    get_lookup_file
     :param out_file:
     :param clear: If True this outputs more humanly readable json, but further processing with ecliptools is not possible
+    :param peak_filter: Built from the filter options
+    :return:
+    """
+    tojson(in_path, lookup_file, out_file, clear, peak_filter)
+
+
+def toarrow(in_path: Path, lookup_file: TextIO | Path, out_path: Path, compression="uncompressed",
+            peak_filter: PeakFilter = NO_FILTER) -> PeakTable:
+    """
+    Takes in a annotated bed file and writes a columnar Arrow IPC file. Appends further information from a lookup file.
+    Remove annotations that did not respect strandedness.
+    The result can be read with read_peak_arrow and is understood by count-gene-peaks.
+    :param in_path: Path to the annotated bed file that is to be converted
+    :param lookup_file: A JSON file or SQLite lookup store containing additional information created by
+    get_lookup_file
+    :param out_path:
+    :param compression: "uncompressed" allows memory mapping the file when reading
+    :param peak_filter: Applied while parsing, see read_mapped_bed
+    :return:
+    """
+    lookup = open_lookup(lookup_file)
+    # the columns are built from the bed file directly, no BasePeak is created
+    with open(in_path, "r") as in_file:
+        peak_table = read_mapped_table(in_file, lookup, peak_filter=peak_filter)
+    write_peak_arrow(peak_table, out_path, compression)
+    return peak_table
+
+
+@convert.command("to-arrow")
+@click.argument("in_path", type=click.Path(exists=True, path_type=Path))
+@click.argument("lookup_file", type=click.File("r"))
+@click.argument("out_path", type=click.Path(dir_okay=False, path_type=Path))
+@click.option("--compression", type=click.Choice(["uncompressed", "lz4", "zstd"]), default="uncompressed",
+              help="Compressed files are smaller but can not be memory mapped.")
+@peak_filter_options
+def toarrow_command(in_path: Path, lookup_file: TextIO, out_path: Path, compression="uncompressed",
+                    peak_filter: PeakFilter = NO_FILTER):
+    """
+    Takes in an annotated bed file and writes a columnar Arrow IPC (.arrow) file.
+    Appends further information from a lookup file.
+    Remove annotations that did not respect strandedness.
+    :param in_path: Path to the annotated bed file that is to be converted
+    :param lookup_file: A JSON file or SQLite lookup store containing additional information created by
+    get_lookup_file
+    :param out_path:
+    :param compression:
+    :param peak_filter: Built from the filter options
     :return:
     """
-    tojson(in_path, lookup_file, out_file, clear)
+    toarrow(in_path, lookup_file, out_path, compression, peak_filter)
 
 
 if __name__ == "__main__":
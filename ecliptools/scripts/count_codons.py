@@ -0,0 +1,139 @@
+#!/usr/bin/python
+import asyncio
+import sys
+from pathlib import Path
+from typing import Awaitable, TextIO, TypeVar
+
+import click
+import numpy as np
+import pandas as pd
+
+from ecliptools.classes.PeakTable import PeakTable
+from ecliptools.util.ensembl_client import ensembl_client_options, gather_with_progress, get_ensembl_client
+from ecliptools.util.fasta import IndexedFasta
+from ecliptools.util.reading_frame import CODONS, CdsMap, EnsemblRequestFailed, count_codons, fetch_cds_map, \
+    fetch_cds_sequence
+from ecliptools.util.read_peak_table import read_peak_table
+
+T = TypeVar("T")
+
+
+def peak_transcripts(peak_table: PeakTable, canonical_only=False) -> pd.DataFrame:
+    """
+    :return: One row per peak and annotated transcript with the columns peak (index in the PeakTable) and transcript
+    """
+    peak_ids = np.repeat(np.arange(len(peak_table)), np.diff(peak_table.annotation_offsets))
+    names = np.array(peak_table.names.values, dtype=object)[peak_table.annotation_name] \
+        if peak_table.annotation_count else np.array([], dtype=object)
+    df = pd.DataFrame({"peak": peak_ids, "transcript": names})
+
+    keep = df["transcript"].str.startswith("ENST").fillna(False).to_numpy(dtype=bool)
+    if canonical_only:
+        canonical = np.array([info.is_canonical for info in peak_table.infos] + [False], dtype=bool)
+        keep &= canonical[peak_table.annotation_info]
+    return df[keep].drop_duplicates(ignore_index=True)
+
+
+async def _unless_failed(awaitable: Awaitable[T], failed: list[str], transcript: str) -> T | None:
+    """
+    :return: The result of the awaitable, None if its request failed, the transcript is added to failed then
+    """
+    try:
+        return await awaitable
+    except EnsemblRequestFailed:
+        failed.append(transcript)
+        return None
+
+
+async def _fetch_transcripts(transcripts: list[str], fasta: IndexedFasta | None) \
+        -> tuple[dict[str, tuple[CdsMap, str]], list[str]]:
+    """
+    :return: The CDS map and sequence of every coding transcript and the (unversioned) transcripts that could not
+    be fetched
+    """
+    client = get_ensembl_client()
+    failed: list[str] = []
+    cds_maps = await gather_with_progress((_unless_failed(fetch_cds_map(client, transcript), failed,
+                                                          transcript.split(".", 1)[0])
+                                           for transcript in transcripts), "Exons")
+    coding = [cds_map for cds_map in cds_maps if cds_map is not None]
+    sequences = await gather_with_progress((_unless_failed(fetch_cds_sequence(client, cds_map, fasta), failed,
+                                                           cds_map.transcript) for cds_map in coding), "CDS")
+    by_id = {cds_map.transcript: (cds_map, sequence) for cds_map, sequence in zip(coding, sequences)
+             if sequence is not None}
+    return {transcript: by_id[transcript.split(".", 1)[0]] for transcript in transcripts
+            if transcript.split(".", 1)[0] in by_id}, failed
+
+
+def codon_table(peak_table: PeakTable, canonical_only=False, fasta: IndexedFasta | None = None) -> pd.DataFrame:
+    """
+    Counts the codons every peak covers in the CDS of every transcript it is annotated with.
+    Peaks are mapped to CDS coordinates through the exon structure, all peaks of a transcript are counted together.
+    :param peak_table:
+    :param canonical_only: Only use canonical transcripts
+    :param fasta: Assemble the CDS from this genome instead of downloading it
+    Transcripts that could not be fetched are reported on stderr.
+    :return: One row per peak and coding transcript with the columns peak, chrom, start, end, strand, transcript,
+    cds_start, cds_end, frame (cds_start % 3) and one count column per codon
+    """
+    pairs = peak_transcripts(peak_table, canonical_only)
+    transcripts, failed = asyncio.run(_fetch_transcripts(pairs["transcript"].unique().tolist(), fasta))
+    if failed:
+        click.echo(f"WARN: {len(failed)} transcripts could not be fetched from Ensembl, their peaks are missing: "
+                   f"{', '.join(sorted(failed)[:10])}{', ...' if len(failed) > 10 else ''}", sys.stderr)
+
+    chroms = np.array(peak_table.chroms.values, dtype=object)
+    names = np.array(peak_table.names.values, dtype=object)
+    frames = []
+    for transcript, group in pairs.groupby("transcript", sort=False):
+        if transcript not in transcripts:
+            continue
+        cds_map, sequence = transcripts[transcript]
+        peaks = group["peak"].to_numpy()
+        cds_starts, cds_ends = cds_map.to_cds(peak_table.peak_start[peaks], peak_table.peak_end[peaks])
+        coding = cds_starts >= 0
+        if not coding.any():
+            continue
+
+        peaks, cds_starts, cds_ends = peaks[coding], cds_starts[coding], cds_ends[coding]
+        frame = pd.DataFrame({
+            "peak": names[peak_table.peak_name[peaks]],
+            "chrom": chroms[peak_table.peak_chrom[peaks]],
+            "start": peak_table.peak_start[peaks],
+            "end": peak_table.peak_end[peaks],
+            "strand": np.where(peak_table.peak_minus_strand[peaks], "-", "+"),
+            "transcript": transcript,
+            "cds_start": cds_starts,
+            "cds_end": cds_ends,
+            "frame": cds_starts % 3,
+        })
+        counts = pd.DataFrame(count_codons(sequence, cds_starts, cds_ends), columns=CODONS)
+        frames.append(pd.concat([frame, counts], axis=1))
+
+    if not frames:
+        return pd.DataFrame(columns=["peak", "chrom", "start", "end", "strand", "transcript", "cds_start", "cds_end",
+                                     "frame"] + CODONS)
+    return pd.concat(frames, ignore_index=True)
+
+
+@click.command("count-codons")
+@click.argument("in_path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("-o", "--out-file", type=click.File("w"), default=sys.stdout)
+@click.option("--canonical-only/--all-transcripts", default=False,
+              help="Only count codons in the canonical transcripts a peak is annotated with.")
+@click.option("--genome", type=click.Path(exists=True, dir_okay=False, path_type=Path), default=None,
+              envvar="ECLIPTOOLS_GENOME_FASTA",
+              help="Indexed genome FASTA to assemble the CDS from instead of downloading it from Ensembl.")
+@ensembl_client_options
+def count_codons_command(in_path: Path, out_file: TextIO, canonical_only=False, genome: Path | None = None):
+    """
+    Writes a peak × codon count table for the coding transcripts the peaks of a json or arrow file are annotated
+    with. Only codons lying completely inside a peak are counted.
+    """
+    peak_table = read_peak_table(in_path)
+    fasta = IndexedFasta(genome) if genome else None
+    codon_table(peak_table, canonical_only, fasta).to_csv(out_file, sep="\t", lineterminator="\n", index=False)
+
+
+if __name__ == "__main__":
+    count_codons_command()
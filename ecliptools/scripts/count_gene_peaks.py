@@ -2,75 +2,203 @@
 import collections.abc
 import os
 from pathlib import Path
-from typing import TextIO, TypedDict, Literal
+from typing import Iterable, TextIO
 import click
 import pandas as pd
+from ecliptools.classes.GenePeakMatrix import GenePeakMatrix
+from ecliptools.util.gene_peak_store import GenePeakStore
+from ecliptools.util.peak_arrow import ARROW_SUFFIXES, read_peak_arrow
+from ecliptools.util.profiling import get_profiler, profile_options
 from ecliptools.util.read_peak_json import read_peak_json
 
 
-class Gene(TypedDict):
-    peaks: set[str]
-    strand: Literal["+", "-"]
+def read_arrow_gene_peak_table(in_path: Path) -> pd.DataFrame:
+    """
+    Reads the gene peaks from a file written by to-arrow. Only the columns needed for counting are read.
+    :param in_path:
+    :return: A long DataFrame with the columns gene, strand, chrom, start and end
+    """
+    table = read_peak_arrow(in_path, columns=["peak_chrom", "peak_start", "peak_end", "name", "strand", "info_parent"])
+    df = table.to_pandas()
+    df = df[df["name"].notna()]
 
+    parent = df["info_parent"].astype(object)
+    gene = parent.where(parent.fillna("") != "", df["name"].astype(object))
+    return pd.DataFrame({"gene": gene.to_numpy(), "strand": df["strand"].astype(object).to_numpy(),
+                         "chrom": df["peak_chrom"].astype(object).to_numpy(), "start": df["peak_start"].to_numpy(),
+                         "end": df["peak_end"].to_numpy()})
 
-def read_gene_peaks(in_file: TextIO | Path):
-    if isinstance(in_file, Path):
-        in_file = in_file.open("r")
 
-    json_text = in_file.read()
-    peaks = read_peak_json(json_text)
+def read_json_gene_peak_table(in_file: TextIO) -> pd.DataFrame:
+    peaks = read_peak_json(in_file.read())
 
-    genes_peaks: dict[str, Gene] = {}
+    rows: list[tuple[str, str, str, int, int]] = []
     for peak in peaks:
         for annotation in peak.annotations:
             accession = annotation.name
             if annotation.info and annotation.info.parent:
                 accession = annotation.info.parent
+            rows.append((accession, annotation.strand, peak.chrom, int(peak.start), int(peak.end)))
 
-            if accession in genes_peaks:
-                genes_peaks[accession]["peaks"].add(peak.position_string)
-                genes_peaks[accession]["strand"] = annotation.strand
-            else:
-                genes_peaks[accession] = {"peaks": set()}
-                genes_peaks[accession]["peaks"] = {peak.position_string}
-                genes_peaks[accession]["strand"] = annotation.strand
+    return pd.DataFrame.from_records(rows, columns=["gene", "strand", "chrom", "start", "end"])
 
-    flattened: dict[str, dict] = {}
-    for accession, gene_peak in genes_peaks.items():
-        peaks_string = "{\"" + "\",\"".join(gene_peak["peaks"]) + "\"}"
-        flattened[accession] = {"peaks": peaks_string, "strand": gene_peak["strand"]}
 
-    df = pd.DataFrame.from_dict(flattened, orient="index")
-    df["peaks"] = df["peaks"].apply(eval)
+def read_gene_peak_table(in_file: TextIO | Path) -> pd.DataFrame:
+    """
+    Reads which peaks are annotated to which gene from a json file written by to-json or an arrow file written by
+    to-arrow. Transcripts are counted for their parent gene.
+    :param in_file:
+    :return: A long DataFrame with one row per annotation and the columns gene, strand, chrom, start and end
+    """
+    in_path = Path(in_file) if isinstance(in_file, Path) else Path(in_file.name)
+    if in_path.suffix in ARROW_SUFFIXES:
+        return read_arrow_gene_peak_table(in_path)
 
-    df.rename(columns={"peaks": f"peaks-{os.path.basename(in_file.name)}"}, inplace=True)
-    return df
+    if isinstance(in_file, Path):
+        in_file = in_file.open("r")
+    return read_json_gene_peak_table(in_file)
+
+
+def experiment_name(input_file: TextIO | Path) -> str:
+    return os.path.basename(input_file if isinstance(input_file, Path) else input_file.name)
 
 
-def create_peak_union(*input_files: TextIO | Path):
-    all_dfs = []
+def read_experiments(*input_files: TextIO | Path) -> pd.DataFrame:
+    """
+    :param input_files: json or arrow files, the file names are used as experiment names
+    :return: The tables of read_gene_peak_table of all files with the additional column experiment
+    """
     if len(input_files) < 1:
         raise ValueError("You need to provide at least one file")
 
+    long_dfs = []
     for input_file in input_files:
-        df = read_gene_peaks(input_file)
-        all_dfs.append(df)
-
-    df = all_dfs.pop()
-    for left_df in all_dfs:
-        df = df.merge(left_df.iloc[:, 0], how="outer", left_index=True, right_index=True, copy=False)
-        df = df.combine_first(left_df)
-
-    df["peak-union"] = pd.Series(dtype=object)
-
-    for i, row in df.iterrows():
-        overall_union = set()
-        for column, value in row.items():
-            if "peaks-" in column and not pd.isna(value):
-                overall_union = overall_union | value
-        df["peak-union"][i] = overall_union
-
-    return df
+        long_df = read_gene_peak_table(input_file)
+        long_df["experiment"] = experiment_name(input_file)
+        long_dfs.append(long_df)
+    return pd.concat(long_dfs, ignore_index=True)
+
+
+def create_gene_peak_matrix(*input_files: TextIO | Path) -> GenePeakMatrix:
+    """
+    Reads all input files into one sparse gene × peak incidence matrix per file.
+    :param input_files: json or arrow files, the file names are used as experiment names
+    :return:
+    """
+    return GenePeakMatrix.from_long(read_experiments(*input_files))
+
+
+def read_gene_peaks(in_file: TextIO | Path) -> pd.DataFrame:
+    """
+    :param in_file:
+    :return: A DataFrame indexed by gene with the set of peaks in the column peaks-<file name> and the strand
+    """
+    return create_gene_peak_matrix(in_file).to_frame().iloc[:, :2]
+
+
+def create_peak_union(*input_files: TextIO | Path) -> pd.DataFrame:
+    """
+    Collects the peaks of every gene per input file and over all input files.
+    Unions and counts are computed on the sparse incidence matrices of create_gene_peak_matrix,
+    the peak sets are only created for the resulting table.
+    :param input_files: json or arrow files
+    :return: A DataFrame indexed by gene with the columns peaks-<file> (set or NaN), strand, peak-union (set),
+    counts-<file>, count-union and union-max-diff
+    """
+    return create_gene_peak_matrix(*input_files).to_frame()
+
+
+def table_columns(experiments: list[str], merge=False) -> list[str]:
+    """
+    :return: The columns of a count-gene-peaks table in the order GenePeakMatrix.to_frame creates them
+    """
+    columns = [f"peaks-{experiment}" for experiment in experiments] + ["strand", "peak-union"]
+    columns += [f"counts-{experiment}" for experiment in experiments] + ["count-union", "union-max-diff"]
+    if merge:
+        columns += ["merged-union", "count-merged-union"]
+    return columns
+
+
+def write_store(store: GenePeakStore, long_df: pd.DataFrame, merge=False, min_overlap=1, max_gap=0):
+    """
+    Replaces the content of the store with all experiments of long_df (as returned by read_experiments)
+    and the settings the table was counted with.
+    """
+    store.clear()
+    for experiment, experiment_df in long_df.groupby("experiment", sort=False):
+        store.add(experiment, experiment_df)
+    store.set_setting("merge", merge)
+    store.set_setting("min_overlap", min_overlap)
+    store.set_setting("max_gap", max_gap)
+
+
+def check_changes(experiments: list[str], add: list[str], replace: list[str], remove: list[str]):
+    """
+    Checks all changes before the store is touched, so a bad name does not leave a half updated store.
+    :param experiments: The experiments in the store
+    :raises ValueError:
+    """
+    for action, names in (("added", add), ("replaced", replace), ("removed", remove)):
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"{', '.join(duplicates)} can only be {action} once")
+    unknown = [name for name in replace + remove if name not in experiments]
+    if unknown:
+        raise ValueError(f"{', '.join(unknown)} not part of the store, experiments are added with --add")
+    existing = [name for name in add if name in experiments and name not in remove]
+    if existing:
+        raise ValueError(f"{', '.join(existing)} already part of the store, use --replace")
+    both = sorted(set(replace) & set(remove))
+    if both:
+        raise ValueError(f"{', '.join(both)} can not be replaced and removed")
+
+
+def update_gene_peak_table(table: pd.DataFrame, store: GenePeakStore, add: Iterable[TextIO | Path] = (),
+                           replace: Iterable[TextIO | Path] = (), remove: Iterable[str] = ()) -> pd.DataFrame:
+    """
+    Adds, replaces or removes experiments of a table created by count-gene-peaks with --store, without reading the
+    other experiments again. Only the rows of genes that have peaks in a changed experiment are recounted from the
+    store. The other rows get empty columns for new experiments and their union-max-diff is updated by
+    count_gene_peaks. The merge settings of the original run are used.
+    :param table: The count-gene-peaks table indexed by gene
+    :param store: The store written together with the table, it is updated
+    :param add: json or arrow files of new experiments
+    :param replace: json or arrow files of experiments in the store, matched by file name
+    :param remove: Names (file names) of experiments to remove
+    :return: The updated table, unsorted
+    :raises ValueError: If a change does not fit the experiments of the store, nothing is changed then
+    """
+    check_changes(store.experiments, [experiment_name(input_file) for input_file in add],
+                  [experiment_name(input_file) for input_file in replace], list(remove))
+
+    affected: set[str] = set()
+    for experiment in remove:
+        affected |= store.genes(experiment)
+        store.remove(experiment)
+
+    for input_file in replace:
+        affected |= store.genes(experiment_name(input_file))
+
+    for input_file, replace_experiment in [(input_file, False) for input_file in add] + \
+                                          [(input_file, True) for input_file in replace]:
+        long_df = read_gene_peak_table(input_file)
+        affected |= set(long_df["gene"].dropna())
+        store.add(experiment_name(input_file), long_df, replace_experiment)
+
+    experiments = store.experiments
+    merge = store.get_setting("merge", False)
+    columns = table_columns(experiments, merge)
+    count_columns = [f"counts-{experiment}" for experiment in experiments]
+
+    table = table.drop(index=table.index.intersection(list(affected))).reindex(columns=columns)
+    pairs = store.pairs(affected)
+    if len(pairs):
+        matrix = GenePeakMatrix.from_long(pairs)
+        rows = matrix.to_frame(merge, store.get_setting("min_overlap", 1), store.get_setting("max_gap", 0))
+        table = pd.concat([table, rows.reindex(columns=columns)])
+
+    table[count_columns] = table[count_columns].fillna(0).astype("int64")
+    return table
 
 
 def safe_df(df: pd.DataFrame, out_file: TextIO):
@@ -96,7 +224,9 @@ def count_gene_peaks(df: pd.DataFrame, out_file: TextIO | Path | None = None):
         else:
             union_count_column = new_column_name
 
-        df[new_column_name] = df[column].apply(save_len)
+        # create_peak_union already counted while grouping
+        if new_column_name not in df.columns:
+            df[new_column_name] = df[column].apply(save_len)
 
     df["union-max-diff"] = df[union_count_column] - (df[count_columns].max(axis=1) - df[count_columns].min(axis=1))
 
@@ -116,9 +246,77 @@ def count_gene_peaks(df: pd.DataFrame, out_file: TextIO | Path | None = None):
 @click.command("count-gene-peaks")
 @click.argument("out_file", type=click.File("w"))
 @click.argument("in_files", type=click.File("r"), nargs=-1)
-def count_gene_peaks_command(out_file: TextIO, in_files: TextIO):
-    union = create_peak_union(*in_files)
-    count_gene_peaks(union, out_file)
+@click.option("--overlaps", type=click.File("w"), default=None,
+              help="Also write the number of gene-peak pairs shared by every pair of input files to this file.")
+@click.option("--merge/--no-merge", default=False,
+              help="Merge overlapping peaks of all files into sites and add merged-union and count-merged-union.")
+@click.option("--min-overlap", type=int, default=1, show_default=True,
+              help="Bases a peak has to overlap a site to be merged into it.")
+@click.option("--max-gap", type=click.IntRange(0), default=0, show_default=True,
+              help="If > 0 peaks up to this many bases apart are merged, instead of requiring --min-overlap.")
+@click.option("--sites", type=click.File("w"), default=None,
+              help="Write the merged sites with the number of supporting files to this file.")
+@click.option("--store", "store_path", type=click.Path(dir_okay=False, path_type=Path), default=None,
+              help="Sidecar SQLite store keeping the gene-peak pairs of every input file. It is written when counting "
+                   "and needed by --add, --replace and --remove.")
+@click.option("--add", type=click.File("r"), multiple=True,
+              help="Add this file to the existing OUT_FILE instead of counting IN_FILES, can be given several times.")
+@click.option("--replace", type=click.File("r"), multiple=True,
+              help="Replace the experiment with the name of this file in the existing OUT_FILE.")
+@click.option("--remove", multiple=True, help="Remove the experiment with this file name from the existing OUT_FILE.")
+@profile_options
+def count_gene_peaks_command(out_file: TextIO, in_files: TextIO, overlaps: TextIO | None = None, merge=False,
+                             min_overlap=1, max_gap=0, sites: TextIO | None = None, store_path: Path | None = None,
+                             add: tuple[TextIO] = (), replace: tuple[TextIO] = (), remove: tuple[str] = ()):
+    """
+    Counts the peaks of every gene in every input file (json or arrow) and over all input files.
+    With --store the gene-peak pairs are kept next to the table, later runs with --add, --replace or --remove
+    update OUT_FILE in place and only recount the genes of the changed files.
+    """
+    profiler = get_profiler()
+    incremental = bool(add or replace or remove)
+    store = GenePeakStore(store_path) if store_path else None
+
+    if incremental:
+        if in_files:
+            raise click.UsageError("IN_FILES can not be combined with --add, --replace or --remove")
+        if store is None or not store.experiments:
+            raise click.UsageError("--add, --replace and --remove need the --store written when counting OUT_FILE")
+        table_path = Path(out_file.name)
+        if not table_path.is_file():
+            raise click.UsageError(f"{out_file.name} has to be an existing count-gene-peaks table")
+
+        with profiler.stage("read"):
+            table = pd.read_csv(table_path, sep="\t", header=0, index_col=0)
+        with profiler.stage("update"):
+            try:
+                df = update_gene_peak_table(table, store, add, replace, remove)
+            except ValueError as error:
+                raise click.ClickException(str(error))
+        with profiler.stage("count"):
+            count_gene_peaks(df, out_file)
+        matrix = GenePeakMatrix.from_long(store.pairs()) if overlaps or sites else None
+        min_overlap, max_gap = store.get_setting("min_overlap", 1), store.get_setting("max_gap", 0)
+    else:
+        with profiler.stage("read"):
+            long_df = read_experiments(*in_files)
+            matrix = GenePeakMatrix.from_long(long_df)
+        if store is not None:
+            with profiler.stage("store"):
+                write_store(store, long_df, merge, min_overlap, max_gap)
+        with profiler.stage("union"):
+            df = matrix.to_frame(merge, min_overlap, max_gap)
+        with profiler.stage("count"):
+            count_gene_peaks(df, out_file)
+
+    if overlaps:
+        with profiler.stage("overlaps"):
+            matrix.pairwise_overlaps().to_csv(overlaps, sep="\t", lineterminator="\n")
+    if sites:
+        with profiler.stage("sites"):
+            matrix.merged_sites(min_overlap, max_gap).to_csv(sites, sep="\t", lineterminator="\n", index=False)
+    if store is not None:
+        store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,43 @@
+#!/usr/bin/python
+from pathlib import Path
+from typing import TextIO
+
+import click
+
+from ecliptools.util.fasta import IndexedFasta, peak_regions, write_fasta
+from ecliptools.util.read_peak_table import read_peak_table
+
+
+def extract_sequences(in_path: Path, fasta_path: Path, out_file: TextIO, line_width=60) -> int:
+    """
+    Writes the sequence of every peak as FASTA, named like bedtools getfasta -name -s: name::chrom:start-end(strand).
+    Minus strand peaks are reverse complemented.
+    :param in_path: Peaks as json or arrow
+    :param fasta_path: The genome, indexed with samtools faidx. A missing index is created.
+    :param out_file:
+    :param line_width:
+    :return: The number of written sequences
+    """
+    peak_table = read_peak_table(in_path)
+    regions = peak_regions(peak_table)
+    names = [f"{peak_table.names[code]}::{region.chrom}:{region.start}-{region.end}({region.strand})"
+             for code, region in zip(peak_table.peak_name.tolist(), regions)]
+
+    with IndexedFasta(fasta_path) as fasta:
+        return write_fasta(names, fasta.fetch_many(regions), out_file, line_width)
+
+
+@click.command("extract-sequences")
+@click.argument("in_path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.argument("fasta_path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("-o", "--out-file", type=click.File("w"), default="-")
+@click.option("--line-width", type=click.IntRange(1), default=60, show_default=True)
+def extract_sequences_command(in_path: Path, fasta_path: Path, out_file: TextIO, line_width=60):
+    """
+    Extracts the sequences of all peaks of a json or arrow peak file from a local genome FASTA.
+    """
+    extract_sequences(in_path, fasta_path, out_file, line_width)
+
+
+if __name__ == "__main__":
+    extract_sequences_command()
@@ -1,31 +1,33 @@
 #!/usr/bin/python
+import asyncio
 import json
 import sys
 from pathlib import Path
-from typing import TextIO
+from typing import TextIO, Iterable
 
 import click
 import regex
-import requests
 
+from ecliptools.util.ensembl_client import EnsemblClient, ensembl_client_options, gather_with_progress, \
+    get_ensembl_client
+from ecliptools.util.lookup_store import LookupStore
+from ecliptools.util.profiling import get_profiler, profile_options
+from ecliptools.util.response_cache import get_response_cache
 
-PARENT_CACHE = {}
-
-
-def get_lookup_data(ensembl_id: str, deep=True) -> dict:
-    server = "https://rest.ensembl.org"
-    head = ensembl_id.split(".", 1)[0]
-
-    ext = f"/lookup/id/{head}?"
+# Maximum number of ids the Ensembl POST /lookup/id endpoint accepts per request
+MAX_BATCH_SIZE = 1000
 
-    r = requests.get(server + ext, headers={"Content-Type": "application/json", "species": "homo_sapiens"})
+PARENT_CACHE = {}
 
-    if not r.ok:
-        stderr = click.get_text_stream("stderr")
-        stderr.write(f"Request Error for {server + ext} {r.status_code}: {r.reason}")
-        return {}
 
-    decoded = r.json()
+def format_lookup_data(ensembl_id: str, decoded: dict, parent: dict | None = None) -> dict:
+    """
+    Extracts the fields of a lookup file entry from a decoded /lookup/id response.
+    :param ensembl_id: The accession the entry is stored under
+    :param decoded: The decoded response for this accession
+    :param parent: The formatted entry of the parent, used if the accession has no description or display name
+    :return:
+    """
     description = ""
 
     if "description" in decoded:
@@ -55,13 +57,7 @@ def get_lookup_data(ensembl_id: str, deep=True) -> dict:
     if "is_canonical" in decoded:
         is_canonical = decoded["is_canonical"]
 
-    if deep and "Parent" in decoded:
-        if decoded["Parent"] in PARENT_CACHE:
-            parent = PARENT_CACHE[decoded["Parent"]]
-        else:
-            parent = get_lookup_data(decoded["Parent"], False)
-            PARENT_CACHE[decoded["Parent"]] = parent
-
+    if parent is not None:
         if description == "" and "description" in parent:
             description = parent["description"]
 
@@ -80,31 +76,157 @@ def get_lookup_data(ensembl_id: str, deep=True) -> dict:
     }
 
 
+async def fetch_lookup(client: EnsemblClient, head: str) -> dict | None:
+    """
+    Fetches the /lookup/id response for one unversioned accession, using the response cache.
+    :param client:
+    :param head: The unversioned accession
+    :return: The decoded response, None if the request failed
+    """
+    cache = get_response_cache()
+    decoded = cache.get(client.server, "lookup/id", head)
+    if decoded is None:
+        decoded = await client.get_json(f"/lookup/id/{head}?", headers={"species": "homo_sapiens"})
+        if decoded is None:
+            return None
+        cache.set(client.server, "lookup/id", head, decoded)
+    return decoded
+
+
+async def post_lookup_ids(client: EnsemblClient, ensembl_ids: list[str]) -> dict[str, dict]:
+    """
+    Looks up several accessions with one request to the POST /lookup/id endpoint.
+    Accessions in the response cache are not requested again.
+    :param client:
+    :param ensembl_ids: At most MAX_BATCH_SIZE unversioned accessions
+    :return: The decoded response per accession, accessions that could not be found are missing
+    """
+    cache = get_response_cache()
+    found = cache.get_many(client.server, "lookup/id", ensembl_ids)
+    missing = [ensembl_id for ensembl_id in ensembl_ids if ensembl_id not in found]
+    if not missing:
+        return found
+
+    decoded = await client.post_json("/lookup/id", {"ids": missing})
+    if decoded is None:
+        return found
+
+    fetched = {ensembl_id: response for ensembl_id, response in decoded.items() if response}
+    cache.set_many(client.server, "lookup/id", fetched)
+    return found | fetched
+
+
+def _batches(items: list[str], batch_size: int) -> list[list[str]]:
+    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+
+async def _fetch_lookups(client: EnsemblClient, heads: list[str], batch_size: int | None, label: str) \
+        -> dict[str, dict]:
+    if batch_size:
+        results = await gather_with_progress(
+            (post_lookup_ids(client, batch) for batch in _batches(heads, batch_size)), label)
+        return {head: decoded for result in results for head, decoded in result.items()}
+
+    results = await gather_with_progress((fetch_lookup(client, head) for head in heads), label)
+    return {head: decoded for head, decoded in zip(heads, results) if decoded is not None}
+
+
+async def lookup_accessions(client: EnsemblClient, ensembl_ids: Iterable[str], batch_size: int | None = None,
+                            deep=True) -> dict[str, dict]:
+    """
+    Looks up many accessions concurrently. All accessions are resolved first, then all parents that are not yet
+    in PARENT_CACHE in a second round.
+    :param client:
+    :param ensembl_ids:
+    :param batch_size: Ids per POST request, at most MAX_BATCH_SIZE. If None every id gets its own GET request.
+    :param deep: Resolve the parents and use their description and display name if missing
+    :return: The formatted lookup entries keyed by accession, {} for accessions that could not be resolved
+    """
+    if batch_size:
+        batch_size = min(batch_size, MAX_BATCH_SIZE)
+    heads = {ensembl_id: ensembl_id.split(".", 1)[0] for ensembl_id in ensembl_ids}
+    decoded = await _fetch_lookups(client, sorted(set(heads.values())), batch_size, "Accessions")
+
+    if deep:
+        parent_ids = {response["Parent"] for response in decoded.values() if "Parent" in response}
+        missing_parents = sorted(parent_ids - PARENT_CACHE.keys())
+        decoded_parents = await _fetch_lookups(client, missing_parents, batch_size, "Parents")
+
+        for parent_id in missing_parents:
+            if parent_id in decoded_parents:
+                PARENT_CACHE[parent_id] = format_lookup_data(parent_id, decoded_parents[parent_id])
+            else:
+                PARENT_CACHE[parent_id] = {}
+
+    lookup: dict[str, dict] = {}
+    for ensembl_id, head in heads.items():
+        if head not in decoded:
+            lookup[ensembl_id] = {}
+            continue
+
+        response = decoded[head]
+        parent = PARENT_CACHE[response["Parent"]] if deep and "Parent" in response else None
+        lookup[ensembl_id] = format_lookup_data(ensembl_id, response, parent)
+
+    return lookup
+
+
+def get_lookup_data(ensembl_id: str, deep=True) -> dict:
+    return asyncio.run(lookup_accessions(get_ensembl_client(), [ensembl_id], deep=deep))[ensembl_id]
+
+
+def get_lookup_data_batched(ensembl_ids: Iterable[str], batch_size=MAX_BATCH_SIZE) -> dict[str, dict]:
+    """
+    Batched version of get_lookup_data for many accessions, the batches are sent concurrently.
+    :param ensembl_ids:
+    :param batch_size: Ids per request, at most MAX_BATCH_SIZE
+    :return: The same entries get_lookup_data returns, keyed by accession
+    """
+    return asyncio.run(lookup_accessions(get_ensembl_client(), ensembl_ids, batch_size))
+
+
 @click.command("get-lookup-file")
 @click.option("-o", "--out-file", type=click.File("w"), default=sys.stdout)
+@click.option("--batch/--no-batch", default=True,
+              help="Look up accessions in batches with POST requests instead of one GET request per accession.")
+@click.option("--batch-size", type=click.IntRange(1, MAX_BATCH_SIZE), default=MAX_BATCH_SIZE)
+@click.option("--store", "store_path", type=click.Path(dir_okay=False, path_type=Path), default=None,
+              help="Write an indexed SQLite lookup store (.sqlite) to this path instead of JSON. All commands taking "
+                   "a lookup file accept it and only read the accessions they need.")
 @click.argument("in_files", type=click.File("r"), nargs=-1)
-def get_lookup_file(out_file: TextIO, in_files: tuple[TextIO]):
+@profile_options
+@ensembl_client_options
+def get_lookup_file(out_file: TextIO, in_files: tuple[TextIO], batch=True, batch_size=MAX_BATCH_SIZE,
+                    store_path: Path | None = None):
     """
     Takes in a arbitrary number of files and extracts all ENSENMBLE identifiers from them.
     Using those it calls the ENSEMBLE /lookup/id/ endpoint.
     The returned data is then written to JSON with the Accession as key.
     :param out_file: Defaults to stdout
     :param in_files:
+    :param batch: Send up to batch_size accessions per request
+    :param batch_size:
+    :param store_path: Write a LookupStore instead of JSON
     :return:
     """
+    profiler = get_profiler()
     accession_set = set()
-    for file in in_files:
-        text = file.read()
-        all_accessions = regex.findall("ENS.\d{11}", text)
-        accession_set.update(all_accessions)
+    with profiler.stage("extract"):
+        for file in in_files:
+            text = file.read()
+            all_accessions = regex.findall("ENS.\d{11}", text)
+            accession_set.update(all_accessions)
 
-    accession_lookup = {}
-    with click.progressbar(accession_set) as bar:
-        for accession in bar:
-            accession_lookup[accession] = get_lookup_data(accession)
+    client = get_ensembl_client()
+    with profiler.stage("lookup"):
+        accession_lookup = asyncio.run(lookup_accessions(client, accession_set, batch_size if batch else None))
 
     accession_lookup |= PARENT_CACHE
-    json.dump(accession_lookup, out_file, indent=4)
+    with profiler.stage("write"):
+        if store_path:
+            LookupStore.create(store_path, accession_lookup).close()
+        else:
+            json.dump(accession_lookup, out_file, indent=4)
 
 
 if __name__ == "__main__":
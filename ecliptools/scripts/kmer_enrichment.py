@@ -0,0 +1,109 @@
+#!/usr/bin/python
+import sys
+from pathlib import Path
+from typing import TextIO
+
+import click
+import numpy as np
+
+from ecliptools.util.fasta import IndexedFasta, Region, peak_regions, read_fasta
+from ecliptools.util.kmers import MAX_K, EncodedSequences, count_kmers, kmer_enrichment
+from ecliptools.util.read_peak_table import read_peak_table
+
+FASTA_SUFFIXES = (".fa", ".fasta", ".fna")
+
+
+def flanking_regions(regions: list[Region], distance: int) -> list[Region]:
+    """
+    :return: For every region the regions of the same length distance bases up- and downstream of it
+    """
+    flanks = []
+    for region in regions:
+        length = region.end - region.start
+        flanks.append(Region(region.chrom, max(0, region.start - distance - length), max(0, region.start - distance),
+                             region.strand))
+        flanks.append(Region(region.chrom, region.end + distance, region.end + distance + length, region.strand))
+    return flanks
+
+
+def read_sequences(in_path: Path, genome: Path | None) -> tuple[list[str], list[Region] | None]:
+    """
+    :param in_path: A FASTA file or a json or arrow peak file
+    :param genome: Needed to extract the sequences of a peak file
+    :return: The sequences and, for peak files, their regions
+    """
+    if in_path.suffix in FASTA_SUFFIXES:
+        with in_path.open("r") as f:
+            return [sequence for _, sequence in read_fasta(f)], None
+
+    if genome is None:
+        raise click.UsageError("--genome is needed to extract the sequences of a peak file")
+    regions = peak_regions(read_peak_table(in_path))
+    with IndexedFasta(genome) as fasta:
+        return fasta.fetch_many(regions), regions
+
+
+def kmer_enrichment_table(in_path: Path, k: int, genome: Path | None = None, background: Path | None = None,
+                          flank: int | None = None, shuffles=10, seed=0, pseudo_count=1.0):
+    """
+    Counts the k-mers of the peak sequences and tests them for enrichment against a background. The background
+    is, in this order, the sequences of the background file, the flanks of the peaks or shuffled peak sequences.
+    :param in_path: A FASTA file (e.g. written by extract-sequences) or a json or arrow peak file
+    :param k:
+    :param genome: Indexed genome FASTA, needed for peak files and flanks
+    :param background: A FASTA file or a json or arrow peak file
+    :param flank: Use the regions this many bases up- and downstream of every peak as background
+    :param shuffles: Number of shuffled copies of every peak sequence in the background
+    :param seed: Seed of the shuffles
+    :param pseudo_count:
+    :return: See kmer_enrichment
+    """
+    sequences, regions = read_sequences(in_path, genome)
+    encoded = EncodedSequences.from_strings(sequences)
+    foreground = count_kmers(encoded, k)
+
+    if background is not None:
+        background_counts = count_kmers(EncodedSequences.from_strings(read_sequences(background, genome)[0]), k)
+    elif flank is not None:
+        if regions is None or genome is None:
+            raise click.UsageError("--flank needs a peak file and --genome")
+        with IndexedFasta(genome) as fasta:
+            background_counts = count_kmers(
+                EncodedSequences.from_strings(fasta.fetch_many(flanking_regions(regions, flank))), k)
+    else:
+        rng = np.random.default_rng(seed)
+        background_counts = np.zeros_like(foreground)
+        for _ in range(shuffles):
+            background_counts += count_kmers(encoded.shuffled(rng), k)
+
+    return kmer_enrichment(foreground, background_counts, k, pseudo_count)
+
+
+@click.command("kmer-enrichment")
+@click.argument("in_path", type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("-o", "--out-file", type=click.File("w"), default=sys.stdout)
+@click.option("-k", type=click.IntRange(1, MAX_K), default=6, show_default=True)
+@click.option("--genome", type=click.Path(exists=True, dir_okay=False, path_type=Path), default=None,
+              envvar="ECLIPTOOLS_GENOME_FASTA", help="Indexed genome FASTA to extract the peak sequences from.")
+@click.option("--background", type=click.Path(exists=True, dir_okay=False, path_type=Path), default=None,
+              help="FASTA or peak file with the background sequences.")
+@click.option("--flank", type=click.IntRange(0), default=None,
+              help="Use the regions this many bases up- and downstream of the peaks as background.")
+@click.option("--shuffles", type=click.IntRange(1), default=10, show_default=True,
+              help="Shuffled copies of every peak sequence used as background if neither --background nor --flank "
+                   "is given.")
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--pseudo-count", type=click.FloatRange(0, min_open=True), default=1.0, show_default=True)
+def kmer_enrichment_command(in_path: Path, out_file: TextIO, k=6, genome: Path | None = None,
+                            background: Path | None = None, flank: int | None = None, shuffles=10, seed=0,
+                            pseudo_count=1.0):
+    """
+    Tests all k-mers of the peak sequences for enrichment against shuffled, flanking or given background
+    sequences. Takes a FASTA file or a json or arrow peak file together with --genome.
+    """
+    df = kmer_enrichment_table(in_path, k, genome, background, flank, shuffles, seed, pseudo_count)
+    df.to_csv(out_file, sep="\t", lineterminator="\n", index=False)
+
+
+if __name__ == "__main__":
+    kmer_enrichment_command()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+import asyncio
+import gzip
+import json
+import shutil
+from pathlib import Path
+
+import click
+import requests
+
+from ecliptools.scripts.annotate import annotate, read_annotation_bed, read_peak_bed, sweep_overlaps
+from ecliptools.scripts.append_references import append_references
+from ecliptools.scripts.count_gene_peaks import count_gene_peaks, create_gene_peak_matrix
+from ecliptools.scripts.get_lookup import MAX_BATCH_SIZE, PARENT_CACHE, lookup_accessions
+from ecliptools.util.ensembl_client import ensembl_client_options, get_ensembl_client
+from ecliptools.util.lookup_store import LookupStore
+from ecliptools.util.pipeline import Pipeline, Step
+
+ENCODE_URL = "https://www.encodeproject.org/files/{accession}/@@download/{accession}.bed.gz"
+DEFAULT_EXPERIMENTS = ("ENCFF663QIZ", "ENCFF128AKC")
+STATE_FILE = ".ecliptools-pipeline.json"
+
+
+def download_peaks(out_path: Path, url: str):
+    """
+    Downloads and unpacks a gzipped peak bed file.
+    """
+    temp_path = out_path.with_suffix(out_path.suffix + ".part")
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with gzip.GzipFile(fileobj=response.raw) as unpacked, temp_path.open("wb") as f:
+            shutil.copyfileobj(unpacked, f)
+    temp_path.replace(out_path)
+
+
+def collect_accessions(peak_path: Path, annotation_path: Path, out_path: Path):
+    """
+    Writes the accessions of all annotations overlapping a peak on the same strand, one per line.
+    Only those have to be looked up for the experiment.
+    """
+    with peak_path.open("r") as peak_file, annotation_path.open("r") as annotation_file:
+        peaks = read_peak_bed(peak_file)
+        annotations = read_annotation_bed(annotation_file)
+
+    accessions = set()
+    for chrom, chrom_peaks in peaks.items():
+        for peak, overlapping in sweep_overlaps(chrom_peaks, annotations.get(chrom, [])):
+            accessions.update(annotation.fields[4] for annotation in overlapping if annotation.strand == peak.strand)
+
+    with out_path.open("w") as f:
+        f.writelines(f"{accession}\n" for accession in sorted(accessions))
+
+
+def lookup_experiment(accession_path: Path, out_path: Path):
+    """
+    Writes the lookup file of the accessions of one experiment, including the parents of its transcripts.
+    """
+    with accession_path.open("r") as f:
+        accessions = [line.strip() for line in f if line.strip()]
+
+    lookup = asyncio.run(lookup_accessions(get_ensembl_client(), accessions, MAX_BATCH_SIZE))
+    parents = {entry["parent"] for entry in lookup.values() if entry.get("parent")}
+    lookup |= {parent: PARENT_CACHE[parent] for parent in sorted(parents) if parent in PARENT_CACHE}
+
+    with out_path.open("w") as f:
+        json.dump(lookup, f, indent=4)
+
+
+def annotate_experiment(peak_path: Path, annotation_path: Path, lookup_path: Path, out_path: Path):
+    with peak_path.open("r") as peak_file, annotation_path.open("r") as annotation_file, \
+            lookup_path.open("r") as lookup_file, out_path.open("w") as out_file:
+        annotate(peak_file, annotation_file, lookup_file, out_file)
+
+
+def _lookup_items(lookup_paths: list[Path]):
+    for lookup_path in lookup_paths:
+        with lookup_path.open("r") as f:
+            yield from json.load(f).items()
+
+
+def merge_lookups(*paths: Path):
+    """
+    Merges the lookup files of all experiments into one LookupStore, later files win like in dict.update.
+    Only one lookup file is held in memory at a time.
+    :param paths: The lookup files to merge followed by the output path
+    """
+    *lookup_paths, out_path = paths
+    LookupStore.create(out_path, _lookup_items(lookup_paths)).close()
+
+
+def count_experiments(*paths: Path):
+    """
+    :param paths: The annotated json files followed by the output path
+    """
+    *json_paths, out_path = paths
+    matrix = create_gene_peak_matrix(*json_paths)
+    with out_path.open("w") as f:
+        count_gene_peaks(matrix.to_frame(), f)
+
+
+def reference_counts(counted_path: Path, lookup_path: Path, out_path: Path):
+    with counted_path.open("r") as in_file, out_path.open("w") as out_file:
+        append_references(in_file, out_file, lookup_path)
+
+
+def create_pipeline(experiments: list[str], annotation_path: Path, workdir: Path) -> Pipeline:
+    """
+    Builds the eCLIP pipeline. Every experiment is downloaded (unless it is given as a bed file), its overlapping
+    accessions are looked up and its peaks are annotated independently of the other experiments. The lookups are
+    merged and all annotated experiments are counted and referenced together.
+    :param experiments: ENCODE file accessions or paths to peak bed files
+    :param annotation_path: The merged genes and rRNA bed file
+    :param workdir: Where all outputs and the pipeline state are written
+    :return:
+    """
+    pipeline = Pipeline(workdir / STATE_FILE)
+    annotated_paths: list[Path] = []
+    lookup_paths: list[Path] = []
+
+    for experiment in experiments:
+        if Path(experiment).suffix == ".bed" and Path(experiment).exists():
+            peak_path = Path(experiment)
+            name = peak_path.stem
+        else:
+            name = experiment
+            peak_path = workdir / f"{name}.bed"
+            pipeline.add(Step(f"download-{name}", download_peaks, outputs=(peak_path,),
+                              params={"url": ENCODE_URL.format(accession=name)}))
+
+        accession_path = workdir / f"{name}.accessions.txt"
+        lookup_path = workdir / f"{name}.lookup.json"
+        annotated_path = workdir / f"{name}.mapped.json"
+        pipeline.add(Step(f"accessions-{name}", collect_accessions, (peak_path, annotation_path), (accession_path,)))
+        # all lookups share the Ensembl rate limit and the response cache
+        pipeline.add(Step(f"lookup-{name}", lookup_experiment, (accession_path,), (lookup_path,), parallel=False))
+        pipeline.add(Step(f"annotate-{name}", annotate_experiment, (peak_path, annotation_path, lookup_path),
+                          (annotated_path,)))
+        lookup_paths.append(lookup_path)
+        annotated_paths.append(annotated_path)
+
+    lookup_path = workdir / "full.lookup.sqlite"
+    counted_path = workdir / "counted.tsv"
+    pipeline.add(Step("merge-lookups", merge_lookups, tuple(lookup_paths), (lookup_path,), parallel=False))
+    pipeline.add(Step("count", count_experiments, tuple(annotated_paths), (counted_path,)))
+    pipeline.add(Step("append-refs", reference_counts, (counted_path, lookup_path),
+                      (workdir / "counted.referenced.tsv",), parallel=False))
+    return pipeline
+
+
+@click.command("pipeline")
+@click.argument("experiments", nargs=-1)
+@click.option("-a", "--annotation", "annotation_path", required=True,
+              type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help="The merged genes and rRNA bed file.")
+@click.option("-w", "--workdir", type=click.Path(file_okay=False, path_type=Path), default=Path("."),
+              show_default=True)
+@click.option("-j", "--workers", type=click.IntRange(1), default=None,
+              help="Number of worker processes, defaults to the number of CPUs.")
+@click.option("--force", is_flag=True, help="Run all steps, even if they are up to date.")
+@click.option("--dry-run", is_flag=True, help="Only show which steps would run.")
+@ensembl_client_options
+def pipeline_command(experiments: tuple[str], annotation_path: Path, workdir: Path, workers: int | None = None,
+                     force=False, dry_run=False):
+    """
+    Downloads, annotates, counts and references eCLIP experiments, given as ENCODE file accessions or peak bed files
+    (DHX30 in HepG2 and K562 by default). Steps whose inputs did not change since their last run are skipped,
+    so adding an experiment only processes the new one before counting again.
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    pipeline = create_pipeline(list(experiments or DEFAULT_EXPERIMENTS), annotation_path, workdir)
+    results = pipeline.run(workers, force, dry_run)
+    if "failed" in results.values():
+        raise click.ClickException("Some steps failed")
+
+
+if __name__ == "__main__":
+    pipeline_command()
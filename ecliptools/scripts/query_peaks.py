@@ -0,0 +1,155 @@
+#!/usr/bin/python
+import os
+from pathlib import Path
+from typing import TextIO
+
+import click
+import numpy as np
+
+from ecliptools.classes.PeakIndex import PeakIndex, Region, is_peak_index
+from ecliptools.classes.PeakTable import PeakTable
+from ecliptools.util.peak_arrow import ARROW_SUFFIXES, arrow_to_peak_table, read_peak_arrow
+from ecliptools.util.profiling import get_profiler, profile_options
+from ecliptools.util.read_peak_json import read_peak_json
+
+RESULT_COLUMNS = ["chrom", "start", "end", "name", "strand", "source", "annotations", "genes"]
+
+
+@click.group()
+def query():
+    """
+    Finds the peaks of converted peak files in genomic regions or annotated to genes.
+    """
+    pass
+
+
+def read_peak_file(in_path: Path) -> PeakTable:
+    """
+    :param in_path: A json file written by to-json or an arrow file written by to-arrow
+    :return:
+    """
+    if in_path.suffix in ARROW_SUFFIXES:
+        return arrow_to_peak_table(read_peak_arrow(in_path))
+    with in_path.open("r") as in_file:
+        return PeakTable.from_peaks(read_peak_json(in_file.read()))
+
+
+def build_index(*in_paths: Path) -> PeakIndex:
+    """
+    :param in_paths: json or arrow peak files, the file names are reported as the source of a peak
+    :return:
+    """
+    if len(in_paths) < 1:
+        raise ValueError("You need to provide at least one file")
+    return PeakIndex.from_sources({os.path.basename(in_path): read_peak_file(in_path) for in_path in in_paths})
+
+
+def open_index(*in_paths: Path) -> PeakIndex:
+    """
+    :param in_paths: A single index written by the index command, or peak files that are indexed in memory
+    :return:
+    """
+    if len(in_paths) == 1 and is_peak_index(in_paths[0]):
+        return PeakIndex.load(in_paths[0])
+    return build_index(*in_paths)
+
+
+def write_result(index: PeakIndex, rows: np.ndarray, out_file: TextIO, query_name: str | None = None):
+    """
+    Writes the peaks as tab separated lines in the order of RESULT_COLUMNS, optionally preceded by the query.
+    Annotations are the accessions of the annotations of a peak, genes their parent genes.
+    """
+    for row in rows:
+        peak = index.peaks.peak(int(row))
+        annotations = list(dict.fromkeys(annotation.name for annotation in peak.annotations))
+        genes = list(dict.fromkeys(annotation.info.parent for annotation in peak.annotations
+                                   if annotation.info is not None and annotation.info.parent))
+        fields = [peak.chrom, peak.start, peak.end, peak.name, peak.strand, index.source(int(row)),
+                  ",".join(annotations), ",".join(genes)]
+        if query_name is not None:
+            fields.insert(0, query_name)
+        out_file.write("\t".join(str(field) for field in fields) + "\n")
+
+
+def write_header(out_file: TextIO, with_query: bool):
+    out_file.write("\t".join((["query"] if with_query else []) + RESULT_COLUMNS) + "\n")
+
+
+@query.command("index")
+@click.argument("out_path", type=click.Path(dir_okay=False, path_type=Path))
+@click.argument("in_paths", type=click.Path(exists=True, dir_okay=False, path_type=Path), nargs=-1, required=True)
+@profile_options
+def index_command(out_path: Path, in_paths: tuple[Path]):
+    """
+    Indexes one or more json or arrow peak files and saves the index to OUT_PATH, an arrow file that can be
+    queried without reading the peak files again.
+    """
+    profiler = get_profiler()
+    with profiler.stage("read"):
+        tables = {os.path.basename(in_path): read_peak_file(in_path) for in_path in in_paths}
+    with profiler.stage("index"):
+        index = PeakIndex.from_sources(tables)
+    with profiler.stage("save"):
+        index.save(out_path)
+    click.echo(f"Indexed {len(index)} peaks of {len(in_paths)} files on {len(index.groups)} chromosome strands "
+               f"and {len(index.genes)} accessions", err=True)
+
+
+@query.command("region")
+@click.argument("in_paths", type=click.Path(exists=True, dir_okay=False, path_type=Path), nargs=-1, required=True)
+@click.option("-r", "--region", "regions", multiple=True, required=True,
+              help="chrom:start-end in bed coordinates, e.g. chr3:193,593,144-193,697,811, or a whole chromosome. "
+                   "Can be given several times.")
+@click.option("--strand", type=click.Choice(["+", "-"]), default=None, help="Only report peaks on this strand.")
+@click.option("--count", is_flag=True, help="Only write the number of peaks per region.")
+@click.option("-o", "--out-file", type=click.File("w"), default="-", help="Output file, stdout by default.")
+@profile_options
+def region_command(in_paths: tuple[Path], regions: tuple[str], strand: str | None = None, count=False,
+                   out_file: TextIO = None):
+    """
+    Writes the peaks overlapping the regions. IN_PATHS is an index written by the index command or
+    json and arrow peak files, which are indexed in memory.
+    """
+    try:
+        parsed = [Region.parse(region) for region in regions]
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--region")
+
+    profiler = get_profiler()
+    with profiler.stage("read"):
+        index = open_index(*in_paths)
+    with profiler.stage("query"):
+        if count:
+            out_file.write("query\tcount\n")
+            for name, region in zip(regions, parsed):
+                out_file.write(f"{name}\t{index.count_region(*region, strand=strand)}\n")
+            return
+        write_header(out_file, len(regions) > 1)
+        for name, region in zip(regions, parsed):
+            write_result(index, index.region(*region, strand=strand), out_file, name if len(regions) > 1 else None)
+
+
+@query.command("gene")
+@click.argument("in_paths", type=click.Path(exists=True, dir_okay=False, path_type=Path), nargs=-1, required=True)
+@click.option("-g", "--gene", "genes", multiple=True, required=True,
+              help="Gene or transcript accession, e.g. ENSG00000198836. Can be given several times.")
+@click.option("--count", is_flag=True, help="Only write the number of peaks per gene.")
+@click.option("-o", "--out-file", type=click.File("w"), default="-", help="Output file, stdout by default.")
+@profile_options
+def gene_command(in_paths: tuple[Path], genes: tuple[str], count=False, out_file: TextIO = None):
+    """
+    Writes the peaks annotated to the genes, or to their transcripts. IN_PATHS is an index written by the index
+    command or json and arrow peak files, which are indexed in memory.
+    """
+    profiler = get_profiler()
+    with profiler.stage("read"):
+        index = open_index(*in_paths)
+    with profiler.stage("query"):
+        if count:
+            out_file.write("query\tcount\n")
+            for gene in genes:
+                out_file.write(f"{gene}\t{len(index.gene(gene))}\n")
+            return
+        write_header(out_file, len(genes) > 1)
+        for gene in genes:
+            write_result(index, index.gene(gene), out_file, gene if len(genes) > 1 else None)
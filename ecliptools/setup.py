@@ -1,16 +1,25 @@
 #!/usr/bin/python
-from setuptools import setup
+from setuptools import find_packages, setup
 
 setup(
     name='eclup-tools',
     version='0.1.0',
-    py_modules=['yourscript'],
+    # this file lies inside the package, its directory is the ecliptools package
+    package_dir={'ecliptools': '.'},
+    packages=['ecliptools'] + [f'ecliptools.{package}' for package in find_packages('.')],
     install_requires=[
         'Click',
+        'jsonpickle',
+        'numpy',
+        'pandas',
+        'pyarrow',
+        'regex',
+        'requests',
+        'scipy',
     ],
     entry_points={
         'console_scripts': [
-            'test = yourscript:cli',
+            'ecliptools = ecliptools.cli:cli',
         ],
     },
 )
@@ -0,0 +1,20 @@
+#!/usr/bin/python
+from typing import Callable
+
+
+def option_group(function: Callable) -> Callable[[Callable], Callable]:
+    """
+    Decorator for the wrapper of a decorator that adds a group of click options to a command, e.g.
+    ensembl_client_options. The wrapper takes over the name and docstring of the command function and keeps the
+    options of decorators like it applied before, so option groups can be stacked.
+    :param function: The command function the options are added to
+    :return:
+    """
+    def decorator(wrapper: Callable) -> Callable:
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__click_params__ = getattr(wrapper, "__click_params__", []) + \
+            getattr(function, "__click_params__", [])
+        return wrapper
+
+    return decorator
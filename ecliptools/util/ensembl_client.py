@@ -0,0 +1,269 @@
+#!/usr/bin/python
+import asyncio
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Iterable, TypeVar
+
+import click
+import requests
+from requests.adapters import HTTPAdapter
+
+from ecliptools.util.click_options import option_group
+
+SERVER = "https://rest.ensembl.org"
+# Ensembl allows 15 requests per second and client
+DEFAULT_RATE_LIMIT = 15.0
+DEFAULT_CONCURRENCY = 10
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+
+
+class TokenBucket(object):
+    """
+    Async token bucket, every request takes one token and tokens are refilled with rate per second.
+    """
+    rate: float
+    capacity: float
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def block(self, seconds: float):
+        """
+        Hands out no tokens for the given time, used when the server asks to retry later.
+        """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class EnsemblClient(object):
+    """
+    Async client for the Ensembl REST API.
+    Requests go through one pooled requests.Session running in a thread pool, at most concurrency requests are in
+    flight and a token bucket keeps them below rate_limit per second. Failed requests (429, 5xx, connection
+    errors) are retried with exponential backoff, a Retry-After header of the server is respected.
+    """
+    server: str
+    concurrency: int
+    rate_limit: float
+    max_retries: int
+    backoff: float
+    timeout: float
+
+    request_count: int
+    retry_count: int
+    error_count: int
+    bytes_received: int
+
+    def __init__(self, server=SERVER, concurrency=DEFAULT_CONCURRENCY, rate_limit=DEFAULT_RATE_LIMIT,
+                 max_retries=5, backoff=1.0, timeout=60.0):
+        self.server = server.rstrip("/")
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.request_count = 0
+        self.retry_count = 0
+        self.error_count = 0
+        self.bytes_received = 0
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._bucket: TokenBucket | None = None
+
+    @classmethod
+    def from_environment(cls) -> "EnsemblClient":
+        """
+        Creates a client configured by ENSEMBL_SERVER, ENSEMBL_CONCURRENCY and ENSEMBL_RATE_LIMIT.
+        """
+        return cls(
+            server=os.environ.get("ENSEMBL_SERVER", SERVER),
+            concurrency=int(os.environ.get("ENSEMBL_CONCURRENCY", DEFAULT_CONCURRENCY)),
+            rate_limit=float(os.environ.get("ENSEMBL_RATE_LIMIT", DEFAULT_RATE_LIMIT))
+        )
+
+    def _bind_loop(self):
+        # asyncio primitives belong to one event loop, every asyncio.run gets new ones
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._bucket = TokenBucket(self.rate_limit)
+
+    async def request(self, method: str, ext: str, **kwargs) -> requests.Response | None:
+        """
+        Sends a request to the server, retrying it if necessary.
+        :param method: "GET" or "POST"
+        :param ext: The resource, e.g. /lookup/id/ENSG00000198836?
+        :param kwargs: Passed on to requests
+        :return: The last response, None if no response was received at all
+        """
+        self._bind_loop()
+        url = self.server + ext
+        send = partial(self._session.request, method, url, timeout=self.timeout, **kwargs)
+
+        response: requests.Response | None = None
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            async with self._semaphore:
+                try:
+                    response = await self._loop.run_in_executor(self._executor, send)
+                except requests.RequestException as e:
+                    click.echo(f"Request Error for {url}: {e}", file=sys.stderr)
+                    response = None
+            self.request_count += 1
+
+            if response is not None:
+                self.bytes_received += len(response.content)
+                if response.status_code not in RETRY_STATUS:
+                    return response
+
+            if attempt == self.max_retries:
+                break
+
+            delay = self.backoff * 2 ** attempt * (1 + random.random() / 10)
+            if response is not None and response.status_code == 429 and "Retry-After" in response.headers:
+                delay = float(response.headers["Retry-After"])
+                self._bucket.block(delay)
+            self.retry_count += 1
+            await asyncio.sleep(delay)
+
+        return response
+
+    async def _json(self, method: str, ext: str, **kwargs) -> Any | None:
+        response = await self.request(method, ext, **kwargs)
+        if response is None:
+            self.error_count += 1
+            return None
+        if not response.ok:
+            self.error_count += 1
+            click.echo(f"Request Error for {self.server + ext} {response.status_code}: {response.reason}",
+                       file=sys.stderr)
+            return None
+        return response.json()
+
+    async def get_json(self, ext: str, headers: dict[str, str] | None = None, params: dict | None = None) \
+            -> Any | None:
+        """
+        :return: The decoded response, None if the request failed
+        """
+        headers = {"Content-Type": "application/json"} | (headers or {})
+        return await self._json("GET", ext, headers=headers, params=params)
+
+    async def post_json(self, ext: str, body: Any, headers: dict[str, str] | None = None) -> Any | None:
+        """
+        :return: The decoded response, None if the request failed
+        """
+        headers = {"Content-Type": "application/json", "Accept": "application/json"} | (headers or {})
+        return await self._json("POST", ext, headers=headers, json=body)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "requests": self.request_count,
+            "retries": self.retry_count,
+            "errors": self.error_count,
+            "bytes_received": self.bytes_received,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+async def gather_with_progress(awaitables: Iterable[Awaitable[T]], label: str | None = None) -> list[T]:
+    """
+    Runs all awaitables concurrently while showing a click progressbar on stderr.
+    :return: The results in the order of the awaitables
+    """
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    with click.progressbar(length=len(tasks), label=label, file=sys.stderr) as bar:
+        for finished in asyncio.as_completed(tasks):
+            await finished
+            bar.update(1)
+    return [task.result() for task in tasks]
+
+
+_DEFAULT_CLIENT: EnsemblClient | None = None
+
+
+def get_ensembl_client() -> EnsemblClient:
+    """
+    The client shared by all commands calling Ensembl, created from the environment on first use.
+    """
+    global _DEFAULT_CLIENT
+    if _DEFAULT_CLIENT is None:
+        _DEFAULT_CLIENT = EnsemblClient.from_environment()
+    return _DEFAULT_CLIENT
+
+
+def current_ensembl_client() -> EnsemblClient | None:
+    """
+    The shared client if one was created, unlike get_ensembl_client this never creates one.
+    """
+    return _DEFAULT_CLIENT
+
+
+def set_ensembl_client(client: EnsemblClient):
+    global _DEFAULT_CLIENT
+    _DEFAULT_CLIENT = client
+
+
+def ensembl_client_options(function):
+    """
+    Adds --server, --concurrency and --rate-limit options to a click command and installs the configured client
+    as the shared client before the command runs.
+    """
+    @option_group(function)
+    @click.option("--server", default=None, envvar="ENSEMBL_SERVER",
+                  help=f"The Ensembl REST server, can point to a local stand-in. Defaults to {SERVER}")
+    @click.option("--concurrency", type=click.IntRange(1), default=DEFAULT_CONCURRENCY, show_default=True,
+                  help="Maximum number of requests in flight.")
+    @click.option("--rate-limit", type=click.FloatRange(min=0, min_open=True), default=DEFAULT_RATE_LIMIT,
+                  show_default=True, help="Maximum number of requests per second.")
+    @click.pass_context
+    def wrapper(ctx: click.Context, *args, server: str | None = None, concurrency=DEFAULT_CONCURRENCY,
+                rate_limit=DEFAULT_RATE_LIMIT, **kwargs):
+        client = EnsemblClient(server or SERVER, concurrency, rate_limit)
+        set_ensembl_client(client)
+        ctx.call_on_close(client.close)
+        return ctx.invoke(function, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+import mmap
+import os
+import sys
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, TextIO
+
+import click
+import numpy as np
+
+from ecliptools.classes.PeakTable import PeakTable
+
+_COMPLEMENT = bytes.maketrans(b"ACGTUNacgtunRYKMSWBDHVrykmswbdhv", b"TGCAANtgcaanYRMKSWVHDByrmkswvhdb")
+
+
+class FaiEntry(NamedTuple):
+    name: str
+    length: int
+    offset: int
+    line_bases: int
+    line_width: int
+
+
+class Region(NamedTuple):
+    chrom: str
+    start: int
+    end: int
+    strand: str = "+"
+
+
+def reverse_complement(sequence: str) -> str:
+    return sequence.encode("ascii").translate(_COMPLEMENT)[::-1].decode("ascii")
+
+
+def read_fai(fai_path: Path | str) -> dict[str, FaiEntry]:
+    """
+    Reads a samtools faidx index, only the first five columns are used.
+    """
+    entries: dict[str, FaiEntry] = {}
+    with open(fai_path, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 5:
+                continue
+            entries[fields[0]] = FaiEntry(fields[0], *(int(field) for field in fields[1:5]))
+    return entries
+
+
+def build_fai(fasta_path: Path | str, fai_path: Path | str | None = None) -> dict[str, FaiEntry]:
+    """
+    Indexes an uncompressed FASTA file the way samtools faidx does and writes the index next to it.
+    Every sequence needs lines of equal length, only its last line may be shorter.
+    :param fasta_path:
+    :param fai_path: Defaults to <fasta_path>.fai
+    :return: The index entries by sequence name
+    """
+    fai_path = Path(fai_path) if fai_path else Path(f"{fasta_path}.fai")
+
+    entries: dict[str, FaiEntry] = {}
+    name: str | None = None
+    length = offset = line_bases = line_width = 0
+    short_line = False
+
+    def finish():
+        if name is not None:
+            entries[name] = FaiEntry(name, length, offset, line_bases, line_width)
+
+    position = 0
+    with open(fasta_path, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                finish()
+                name = line[1:].split()[0].decode("ascii")
+                length = line_bases = line_width = 0
+                offset = position + len(line)
+                short_line = False
+            elif name is not None and line.strip():
+                bases = len(line.rstrip(b"\r\n"))
+                if short_line or (line_bases and bases > line_bases):
+                    raise ValueError(f"{fasta_path}: lines of {name} have different lengths, it can not be indexed")
+                if not line_bases:
+                    line_bases, line_width = bases, len(line)
+                elif bases < line_bases:
+                    short_line = True
+                length += bases
+            position += len(line)
+        finish()
+
+    with open(fai_path, "w") as f:
+        for entry in entries.values():
+            f.write("\t".join(str(field) for field in entry) + "\n")
+    return entries
+
+
+class IndexedFasta(object):
+    """
+    Random access to a local genome FASTA through its .fai index. The file is memory mapped, fetching a region
+    only touches the pages holding it, independent of the size of the genome.
+    Coordinates are 0-based and end exclusive like in BED files.
+    Chromosome names are matched with and without the "chr" prefix, so UCSC named peaks work with Ensembl genomes.
+    """
+    path: Path
+    index: dict[str, FaiEntry]
+
+    def __init__(self, path: Path | str, fai_path: Path | str | None = None):
+        self.path = Path(path)
+        fai_path = Path(fai_path) if fai_path else Path(f"{path}.fai")
+        self.index = read_fai(fai_path) if fai_path.exists() else build_fai(self.path, fai_path)
+
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._aliases: dict[str, FaiEntry | None] = {}
+
+    @classmethod
+    def from_environment(cls) -> "IndexedFasta | None":
+        """
+        Opens the FASTA file ECLIPTOOLS_GENOME_FASTA points to, None if it is not set.
+        """
+        path = os.environ.get("ECLIPTOOLS_GENOME_FASTA")
+        return cls(path) if path else None
+
+    def entry(self, chrom: str) -> FaiEntry | None:
+        if chrom not in self._aliases:
+            candidates = [chrom, chrom[3:] if chrom.startswith("chr") else f"chr{chrom}"]
+            if chrom in ("chrM", "MT"):
+                candidates += ["MT", "chrM"]
+            self._aliases[chrom] = next((self.index[name] for name in candidates if name in self.index), None)
+        return self._aliases[chrom]
+
+    def _byte_offset(self, entry: FaiEntry, position: int) -> int:
+        return entry.offset + position // entry.line_bases * entry.line_width + position % entry.line_bases
+
+    def fetch(self, chrom: str, start: int, end: int, strand="+") -> str:
+        """
+        :param chrom:
+        :param start: 0-based
+        :param end: Exclusive
+        :param strand: "-" returns the reverse complement
+        :return: The sequence as stored in the file (soft masked bases stay lower case), clipped to the chromosome
+        """
+        entry = self.entry(chrom)
+        if entry is None:
+            raise KeyError(f"{chrom} is not in {self.path}")
+
+        if start < 0:
+            click.echo(f"WARN: Sequence got clipped by {-start} at the start", sys.stderr)
+            start = 0
+        if end > entry.length:
+            click.echo(f"WARN: Sequence got clipped by {end - entry.length} at the end", sys.stderr)
+            end = entry.length
+        if end <= start:
+            return ""
+
+        raw = self._mmap[self._byte_offset(entry, start):self._byte_offset(entry, end)]
+        sequence = raw.translate(None, b"\r\n")
+        if strand == "-":
+            sequence = sequence.translate(_COMPLEMENT)[::-1]
+        return sequence.decode("ascii")
+
+    def fetch_many(self, regions: Iterable[Region | tuple[str, int, int, str]]) -> list[str]:
+        """
+        Batch version of fetch. The regions are read in file order, which keeps the page cache warm
+        when many peaks lie close together.
+        :return: The sequences in the order of the regions
+        """
+        regions = [Region(*region) for region in regions]
+        order = sorted(range(len(regions)), key=lambda i: (
+            entry.offset if (entry := self.entry(regions[i].chrom)) else -1, regions[i].start))
+
+        sequences: list[str] = [""] * len(regions)
+        for i in order:
+            sequences[i] = self.fetch(*regions[i])
+        return sequences
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def peak_regions(peak_table: PeakTable) -> list[Region]:
+    chroms = np.array(peak_table.chroms.values, dtype=object)
+    return [Region(chrom, start, end, "-" if minus_strand else "+") for chrom, start, end, minus_strand in zip(
+        chroms[peak_table.peak_chrom] if len(peak_table) else [], peak_table.peak_start.tolist(),
+        peak_table.peak_end.tolist(), peak_table.peak_minus_strand.tolist())]
+
+
+def peak_sequences(fasta: IndexedFasta, peak_table: PeakTable) -> list[str]:
+    """
+    Extracts the sequences of all peaks in a PeakTable at once, minus strand peaks are reverse complemented.
+    """
+    return fasta.fetch_many(peak_regions(peak_table))
+
+
+def read_fasta(in_file: TextIO) -> Iterator[tuple[str, str]]:
+    """
+    :return: (name, sequence) for every record, the name is the header without ">"
+    """
+    name: str | None = None
+    lines: list[str] = []
+    for line in in_file:
+        line = line.rstrip("\r\n")
+        if line.startswith(">"):
+            if name is not None:
+                yield name, "".join(lines)
+            name, lines = line[1:], []
+        elif name is not None:
+            lines.append(line)
+    if name is not None:
+        yield name, "".join(lines)
+
+
+def write_fasta(names: Iterable[str], sequences: Iterable[str], out_file: TextIO, line_width=60) -> int:
+    """
+    :return: The number of written sequences
+    """
+    count = 0
+    for name, sequence in zip(names, sequences):
+        out_file.write(f">{name}\n")
+        for i in range(0, len(sequence), line_width):
+            out_file.write(sequence[i:i + line_width] + "\n")
+        count += 1
+    return count
+
+
+_DEFAULT_GENOME: IndexedFasta | None = None
+_GENOME_LOADED = False
+
+
+def get_genome_fasta() -> IndexedFasta | None:
+    """
+    The genome shared by all commands extracting sequences, opened from the environment on first use.
+    None means sequences are requested from Ensembl.
+    """
+    global _DEFAULT_GENOME, _GENOME_LOADED
+    if not _GENOME_LOADED:
+        _DEFAULT_GENOME = IndexedFasta.from_environment()
+        _GENOME_LOADED = True
+    return _DEFAULT_GENOME
+
+
+def set_genome_fasta(fasta: IndexedFasta | None):
+    global _DEFAULT_GENOME, _GENOME_LOADED
+    _DEFAULT_GENOME = fasta
+    _GENOME_LOADED = True
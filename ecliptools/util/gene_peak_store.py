@@ -0,0 +1,118 @@
+#!/usr/bin/python
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterable
+
+import pandas as pd
+
+PAIR_COLUMNS = ["gene", "strand", "chrom", "start", "end"]
+# SQLite limits the number of host parameters per statement
+_MAX_PARAMETERS = 500
+
+
+class GenePeakStore(object):
+    """
+    Sidecar of a count-gene-peaks table, stored in SQLite. Keeps the gene-peak pairs of every experiment, so single
+    experiments can be added, replaced or removed without reading the other input files again.
+    Experiments keep the order they were added in, which is the column order of the table.
+    """
+    path: Path
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._connection = sqlite3.connect(str(self.path))
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS experiments (name TEXT PRIMARY KEY, position INTEGER NOT NULL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pairs (experiment TEXT NOT NULL, gene TEXT NOT NULL, "
+                "strand TEXT, chrom TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS pairs_experiment ON pairs (experiment)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS pairs_gene ON pairs (gene)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+
+    @property
+    def experiments(self) -> list[str]:
+        rows = self._connection.execute("SELECT name FROM experiments ORDER BY position").fetchall()
+        return [row[0] for row in rows]
+
+    def get_setting(self, key: str, default: Any = None) -> Any:
+        row = self._connection.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_setting(self, key: str, value: Any):
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                     (key, json.dumps(value)))
+
+    def add(self, experiment: str, long_df: pd.DataFrame, replace=False):
+        """
+        :param experiment:
+        :param long_df: One row per annotation with the columns gene, strand, chrom, start and end
+        :param replace: Replace the pairs of an experiment that was added before, otherwise that is an error.
+        A replaced experiment keeps its position.
+        """
+        experiments = self.experiments
+        if experiment in experiments and not replace:
+            raise ValueError(f"{experiment} is already part of {self.path}")
+
+        rows = long_df[PAIR_COLUMNS].astype({"start": "int64", "end": "int64"}).itertuples(index=False, name=None)
+        with self._connection:
+            if experiment in experiments:
+                self._connection.execute("DELETE FROM pairs WHERE experiment = ?", (experiment,))
+            else:
+                self._connection.execute(
+                    "INSERT INTO experiments (name, position) "
+                    "VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM experiments))", (experiment,))
+            self._connection.executemany(
+                "INSERT INTO pairs (experiment, gene, strand, chrom, start, end) VALUES (?, ?, ?, ?, ?, ?)",
+                ((experiment, gene, strand, chrom, int(start), int(end)) for gene, strand, chrom, start, end in rows))
+
+    def remove(self, experiment: str):
+        if experiment not in self.experiments:
+            raise KeyError(f"{experiment} is not part of {self.path}")
+        with self._connection:
+            self._connection.execute("DELETE FROM pairs WHERE experiment = ?", (experiment,))
+            self._connection.execute("DELETE FROM experiments WHERE name = ?", (experiment,))
+
+    def clear(self):
+        with self._connection:
+            self._connection.execute("DELETE FROM pairs")
+            self._connection.execute("DELETE FROM experiments")
+
+    def genes(self, experiment: str) -> set[str]:
+        rows = self._connection.execute("SELECT DISTINCT gene FROM pairs WHERE experiment = ?", (experiment,))
+        return {row[0] for row in rows}
+
+    def pairs(self, genes: Iterable[str] | None = None) -> pd.DataFrame:
+        """
+        :param genes: Only read the pairs of these genes, all pairs by default
+        :return: The long table create_gene_peak_matrix builds from the input files, with the columns experiment,
+        gene, strand, chrom, start and end in the order the experiments and their annotations were added
+        """
+        query = ("SELECT pairs.experiment, gene, strand, chrom, start, end, position, pairs.rowid FROM pairs "
+                 "JOIN experiments ON experiments.name = pairs.experiment")
+        columns = ["experiment", *PAIR_COLUMNS, "position", "rowid"]
+        if genes is None:
+            df = pd.DataFrame(self._connection.execute(query).fetchall(), columns=columns)
+        else:
+            genes = list(dict.fromkeys(genes))
+            rows = []
+            for i in range(0, len(genes), _MAX_PARAMETERS):
+                chunk = genes[i:i + _MAX_PARAMETERS]
+                rows += self._connection.execute(f"{query} WHERE gene IN ({','.join('?' * len(chunk))})",
+                                                 chunk).fetchall()
+            df = pd.DataFrame(rows, columns=columns)
+
+        df = df.sort_values(["position", "rowid"], kind="stable", ignore_index=True)
+        return df.drop(columns=["position", "rowid"]).astype({"start": "int64", "end": "int64"})
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,11 +1,12 @@
-import math
+import asyncio
 import sys
-from typing import TypedDict, Literal
+from typing import Literal, NamedTuple, TypedDict
 
 import click
-import requests
 
-from classes.BedPeak import BedPeak
+from ecliptools.util.ensembl_client import EnsemblClient, gather_with_progress, get_ensembl_client
+from ecliptools.util.fasta import get_genome_fasta, reverse_complement
+from ecliptools.util.response_cache import get_response_cache
 
 
 class SequenceResponse(TypedDict):
@@ -17,33 +18,27 @@ class SequenceResponse(TypedDict):
     seq: str
 
 
-SEQUENCE_CACHE: dict[str, SequenceResponse] = {}
+async def fetch_ensemble_sequence(client: EnsemblClient, ensemble_accession: str, cds=False) -> SequenceResponse:
+    cache = get_response_cache()
+    cache_key = f"{ensemble_accession}:{'cds' if cds else 'genomic'}"
+    cached = cache.get(client.server, "sequence/id", cache_key)
+    if cached is not None:
+        return cached
 
-
-def get_ensemble_sequence(ensemble_accession: str, cds=False) -> SequenceResponse:
-    if ensemble_accession in SEQUENCE_CACHE:
-        return SEQUENCE_CACHE[ensemble_accession]
-
-    server = "https://rest.ensembl.org"
     resource = f"/sequence/id/{ensemble_accession}?"
-    request_url = server + resource
-
-    headers = {
-        "Content-Type": "application/json",
-        "Type": cds.__str__()
-    }
+    decoded_response = await client.get_json(resource, params={"type": "cds"} if cds else None)
 
-    response = requests.get(request_url, headers=headers)
-
-    if not response.ok:
-        click.echo(f"Request Error for {request_url} {response.status_code}: {response.reason}", file=sys.stderr)
+    if decoded_response is None:
         return SequenceResponse(query=ensemble_accession, molecule="FAILED", version=-1, desc="", id="", seq="")
 
-    decoded_response = response.json()
-    SEQUENCE_CACHE[ensemble_accession] = decoded_response
+    cache.set(client.server, "sequence/id", cache_key, decoded_response)
     return decoded_response
 
 
+def get_ensemble_sequence(ensemble_accession: str, cds=False) -> SequenceResponse:
+    return asyncio.run(fetch_ensemble_sequence(get_ensembl_client(), ensemble_accession, cds))
+
+
 class Position(TypedDict):
     chrom: str
     start: int
@@ -71,54 +66,91 @@ def parse_ensemble_position(desc: str) -> Position:
     return Position(chrom=chrom, start=start, end=end, strand=strand)
 
 
-def get_binding_sequence(gene_accession: str, start: int, end: int) -> str:
-    seq_response = get_ensemble_sequence(gene_accession)
-    response_position = parse_ensemble_position(seq_response["desc"])
-
-    start_offset = start - response_position["start"]
-    end_offset = start_offset + end - start
-
-    if start_offset < 0:
-        click.echo(f"WARN: Sequence got clipped by {abs(start_offset)} at the start", sys.stderr)
-        start_offset = 0
-    if end_offset > len(seq_response["seq"]):
-        clipped = abs(end_offset - len(seq_response['seq']))
-        click.echo(f"WARN: Sequence got clipped by {clipped} at the end", sys.stderr)
-        return seq_response["seq"][start_offset:]
-
-    return seq_response["seq"][start_offset:end_offset]
-
-
-def get_reading_frame(transcript_accession: str, peak_sequence: str):
-    transcript_res = get_ensemble_sequence(transcript_accession, cds=True)
-    transcript_seq = transcript_res["seq"]
-
-    peak_start = transcript_seq.find(peak_sequence)
-    peak_end = peak_start + len(peak_sequence)
-
-    if peak_start == -1:
-        return
-
-    codon_counts = {}
-    current_pos = 0
-    while True:
-        codon = transcript_seq[current_pos:current_pos + 3]
-        current_pos += 3
-
-        if current_pos -3 <= peak_start:
-            continue
-        if current_pos > peak_end:
-            break
-
-        if codon in codon_counts:
-            codon_counts[codon] += 1
-        else:
-            codon_counts[codon] = 1
+class BindingRegion(NamedTuple):
+    gene_accession: str
+    # 0-based and end exclusive, like the peak bed files
+    start: int
+    end: int
+    # only needed to read from a local genome
+    chrom: str | None = None
+    strand: Literal["+", "-"] = "+"
 
-    return codon_counts
 
+def get_binding_sequence(gene_accession: str, start: int, end: int, chrom: str | None = None,
+                         strand: Literal["+", "-"] = "+") -> str:
+    """
+    Cuts the peak out of the gene sequence. If a local genome is configured (ECLIPTOOLS_GENOME_FASTA) and the
+    chromosome is given, the sequence is read from it instead of downloading the whole gene from Ensembl.
+    Both return the same sequence.
+    :param gene_accession:
+    :param start: 0-based, like the peak bed files
+    :param end:
+    :param chrom: Only used by the local genome
+    :param strand: "-" returns the reverse complement
+    :return:
+    """
+    return get_binding_sequences([BindingRegion(gene_accession, start, end, chrom, strand)])[0]
 
 
-if __name__ == "__main__":
-    peak_sequence = get_binding_sequence("ENSG00000198836", 193614721, 193695408)
-    result = get_reading_frame("ENST00000361510", peak_sequence)
+def get_binding_sequences(regions: list[BindingRegion | tuple]) -> list[str]:
+    """
+    Concurrent version of get_binding_sequence, every gene sequence is only requested once.
+    Regions with a chromosome are read from the local genome if one is configured.
+    :param regions: BindingRegions or (gene accession, start, end[, chrom, strand]) per peak
+    :return: The binding sequences in the order of the regions
+    """
+    regions = [BindingRegion(*region) for region in regions]
+    genome = get_genome_fasta()
+    sequences: list[str | None] = [None] * len(regions)
+    remote = list(range(len(regions)))
+    if genome is not None:
+        local = [i for i in remote if regions[i].chrom is not None]
+        local_sequences = genome.fetch_many(
+            (regions[i].chrom, regions[i].start, regions[i].end, regions[i].strand) for i in local)
+        for i, sequence in zip(local, local_sequences):
+            sequences[i] = sequence
+        remote = [i for i in remote if regions[i].chrom is None]
+
+    if remote:
+        client = get_ensembl_client()
+        accessions = list(dict.fromkeys(regions[i].gene_accession for i in remote))
+        responses = asyncio.run(gather_with_progress(
+            (fetch_ensemble_sequence(client, accession) for accession in accessions), "Sequences"))
+        by_accession = dict(zip(accessions, responses))
+        for i in remote:
+            region = regions[i]
+            sequences[i] = cut_binding_sequence(by_accession[region.gene_accession], region.start, region.end,
+                                                region.strand)
+    return sequences
+
+
+def cut_binding_sequence(seq_response: SequenceResponse, start: int, end: int,
+                         strand: Literal["+", "-"] = "+") -> str:
+    """
+    Cuts a region out of the gene sequence returned by Ensembl. The position in its desc is 1-based and inclusive,
+    genes on the minus strand come reverse complemented, so they are indexed from the gene end.
+    :param seq_response:
+    :param start: 0-based, like the peak bed files
+    :param end: Exclusive
+    :param strand: "-" returns the reverse complement, like IndexedFasta.fetch
+    :return: The sequence, clipped to the gene
+    """
+    response_position = parse_ensemble_position(seq_response["desc"])
+    gene_start = response_position["start"] - 1
+    gene_end = response_position["end"]
+
+    if start < gene_start:
+        click.echo(f"WARN: Sequence got clipped by {gene_start - start} at the start", sys.stderr)
+        start = gene_start
+    if end > gene_end:
+        click.echo(f"WARN: Sequence got clipped by {end - gene_end} at the end", sys.stderr)
+        end = gene_end
+    if end <= start:
+        return ""
+
+    if response_position["strand"] == 1:
+        sequence = seq_response["seq"][start - gene_start:end - gene_start]
+    else:
+        sequence = seq_response["seq"][gene_end - end:gene_end - start]
+    gene_strand = "+" if response_position["strand"] == 1 else "-"
+    return sequence if strand == gene_strand else reverse_complement(sequence)
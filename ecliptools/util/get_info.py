@@ -0,0 +1,56 @@
+#!/usr/bin/python
+from typing import Iterable, Mapping
+
+from ecliptools.classes.Peak import Info
+from ecliptools.util.lookup_store import lookup_many
+
+
+def get_info(name: str, lookup: Mapping[str, dict[str, any]]) -> Info | None:
+    """
+    Creates the Info for a (versioned) accession from the lookup data created by get-lookup-file.
+    :param name: The accession, the version suffix is ignored
+    :param lookup: The lookup dict or a LookupStore
+    :return: None if the accession is not part of the lookup or could not be looked up ({} entry)
+    """
+    info_dict = lookup.get(name.split(".")[0])
+    if info_dict:
+        return Info(info_dict=info_dict)
+    return None
+
+
+class InfoCache(object):
+    """
+    Flyweight cache of Info objects. Every accession is looked up and turned into an Info once, all annotations of
+    the same transcript or gene share that instance. Accessions missing from the lookup are remembered as well.
+    Memory grows with the number of distinct accessions used, not with the size of the lookup.
+    """
+    lookup: Mapping[str, dict[str, any]]
+
+    def __init__(self, lookup: Mapping[str, dict[str, any]]):
+        self.lookup = lookup
+        self._infos: dict[str, Info | None] = {}
+
+    def prefetch(self, names: Iterable[str]):
+        """
+        Looks up all accessions not seen before in one batch, which saves a query per accession for stores.
+        :param names: (Versioned) accessions
+        """
+        missing = {name.split(".")[0] for name in names} - self._infos.keys()
+        if not missing:
+            return
+        found = lookup_many(self.lookup, missing)
+        for accession in missing:
+            info_dict = found.get(accession)
+            self._infos[accession] = Info(info_dict=info_dict) if info_dict else None
+
+    def get(self, name: str) -> Info | None:
+        """
+        Same as get_info, but returns the same Info for every call with the same accession.
+        """
+        accession = name.split(".")[0]
+        if accession not in self._infos:
+            self._infos[accession] = get_info(accession, self.lookup)
+        return self._infos[accession]
+
+    def __len__(self):
+        return len(self._infos)
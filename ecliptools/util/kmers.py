@@ -0,0 +1,175 @@
+#!/usr/bin/python
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+BASES = "ACGT"
+# counts are kept for all 4 ** k k-mers, 4 ** 12 int64 counts are 128 MB
+MAX_K = 12
+_INVALID = 4
+
+_BASE_CODES = np.full(256, _INVALID, dtype=np.uint8)
+for _code, _base in enumerate(BASES):
+    _BASE_CODES[ord(_base)] = _BASE_CODES[ord(_base.lower())] = _code
+_BASE_CODES[ord("U")] = _BASE_CODES[ord("u")] = 3
+
+
+class EncodedSequences(object):
+    """
+    Many sequences concatenated into one array of base codes, one uint8 per base: 0-3 for ACGT (U counts as T)
+    and 4 for N and other symbols. The bases of sequence i are codes[offsets[i]:offsets[i + 1]].
+    """
+    codes: np.ndarray
+    offsets: np.ndarray
+
+    def __init__(self, codes: np.ndarray, offsets: np.ndarray):
+        self.codes = codes
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, sequences: Iterable[str]) -> "EncodedSequences":
+        sequences = [sequence.encode("ascii") for sequence in sequences]
+        lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=len(sequences))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        codes = _BASE_CODES[np.frombuffer(b"".join(sequences), dtype=np.uint8)]
+        return cls(codes, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def sequence_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self), dtype=np.int32), self.lengths)
+
+    def shuffled(self, rng: np.random.Generator) -> "EncodedSequences":
+        """
+        Shuffles the bases inside every sequence, which keeps the base composition of each sequence.
+        """
+        # a random fraction added to the sequence id only reorders bases inside their sequence
+        order = np.argsort(self.sequence_ids() + rng.random(len(self.codes)))
+        return EncodedSequences(self.codes[order], self.offsets)
+
+
+def kmer_dtype(k: int) -> type:
+    """
+    :return: The smallest unsigned integer type holding the 2 * k bit codes of k-mers
+    """
+    return np.uint16 if k <= 8 else np.uint32
+
+
+def kmer_codes(sequences: EncodedSequences, k: int, start=0, stop: int | None = None) -> np.ndarray:
+    """
+    Computes the integer code of every k-mer window of all sequences at once. The code of a window is built from
+    k shifted views of the base array, windows crossing the end of a sequence or containing N are dropped.
+    Besides the codes (kmer_dtype) only two bool and one uint8 array per window are allocated, the bases are not
+    copied.
+    :param sequences:
+    :param k:
+    :param start: First window, windows are numbered by their first base in sequences.codes
+    :param stop: Window after the last one, all windows by default
+    :return: The codes of all valid windows, in [0, 4 ** k)
+    """
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f"k has to be between 1 and {MAX_K}")
+
+    window_count = len(sequences.codes) - k + 1
+    stop = window_count if stop is None else min(stop, window_count)
+    if stop <= start:
+        return np.zeros(0, dtype=kmer_dtype(k))
+
+    length = stop - start
+    codes = np.zeros(length, dtype=kmer_dtype(k))
+    valid = np.ones(length, dtype=np.bool_)
+    base_valid = np.empty(length, dtype=np.bool_)
+    base_bits = np.empty(length, dtype=np.uint8)
+    for shift in range(k):
+        bases = sequences.codes[start + shift:stop + shift]
+        valid &= np.not_equal(bases, _INVALID, out=base_valid)
+        np.bitwise_and(bases, 3, out=base_bits)
+        np.left_shift(codes, 2, out=codes)
+        codes |= base_bits
+
+    # the k - 1 windows before the start of every sequence cross into it
+    sequence_starts = sequences.offsets[1:-1]
+    sequence_starts = sequence_starts[(sequence_starts > start) & (sequence_starts - k < stop)] - start
+    for before in range(1, k):
+        windows = sequence_starts - before
+        valid[windows[(windows >= 0) & (windows < length)]] = False
+    return codes[valid]
+
+
+# windows encoded at once by count_kmers, np.bincount copies the codes of a chunk to int64
+COUNT_CHUNK_SIZE = 1 << 20
+
+
+def count_kmers(sequences: EncodedSequences, k: int) -> np.ndarray:
+    """
+    Counts the windows in chunks of COUNT_CHUNK_SIZE, so memory does not grow with the number of bases.
+    :return: The number of occurrences of every k-mer, indexed by k-mer code
+    """
+    counts = np.zeros(4 ** k, dtype=np.int64)
+    for start in range(0, max(len(sequences.codes) - k + 1, 0), COUNT_CHUNK_SIZE):
+        codes = kmer_codes(sequences, k, start, start + COUNT_CHUNK_SIZE)
+        if 4 ** k <= COUNT_CHUNK_SIZE:
+            counts += np.bincount(codes, minlength=4 ** k)
+        else:
+            # a bincount of all 4 ** k k-mers per chunk would be larger than the chunk
+            found, found_counts = np.unique(codes, return_counts=True)
+            counts[found] += found_counts
+    return counts
+
+
+def decode_kmers(codes: np.ndarray, k: int) -> list[str]:
+    letters = np.array(list(BASES))
+    shifts = np.arange(2 * (k - 1), -1, -2)
+    digits = (np.asarray(codes)[:, None] >> shifts) & 3
+    return ["".join(row) for row in letters[digits]]
+
+
+def benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+    p_values = np.asarray(p_values, dtype=np.float64)
+    if not len(p_values):
+        return p_values
+    order = np.argsort(p_values)
+    ranked = p_values[order] * len(p_values) / np.arange(1, len(p_values) + 1)
+    q_values = np.empty_like(ranked)
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+
+def kmer_enrichment(foreground: np.ndarray, background: np.ndarray, k: int, pseudo_count=1.0) -> pd.DataFrame:
+    """
+    Tests every k-mer for enrichment in the foreground counts compared to the background counts.
+    The foreground count is tested against the binomial distribution of all foreground k-mers with the
+    (pseudo counted) background frequency of the k-mer.
+    :param foreground: Counts as returned by count_kmers
+    :param background: Counts as returned by count_kmers, can come from several shuffles
+    :param k:
+    :param pseudo_count: Added to every background count, so k-mers missing in the background can be tested
+    :return: One row per k-mer with the columns kmer, foreground, background, foreground_frequency,
+    background_frequency, log2_enrichment, p_value and q_value (Benjamini-Hochberg), sorted by p_value
+    """
+    foreground_total = foreground.sum()
+    background_total = background.sum()
+
+    foreground_frequency = foreground / max(foreground_total, 1)
+    background_frequency = (background + pseudo_count) / (background_total + pseudo_count * len(background))
+    pseudo_frequency = (foreground + pseudo_count) / (foreground_total + pseudo_count * len(foreground))
+    p_values = stats.binom.sf(foreground - 1, foreground_total, background_frequency)
+
+    df = pd.DataFrame({
+        "kmer": decode_kmers(np.arange(4 ** k), k),
+        "foreground": foreground,
+        "background": background,
+        "foreground_frequency": foreground_frequency,
+        "background_frequency": background_frequency,
+        "log2_enrichment": np.log2(pseudo_frequency / background_frequency),
+        "p_value": p_values,
+        "q_value": benjamini_hochberg(p_values),
+    })
+    return df.sort_values(["p_value", "log2_enrichment"], ascending=[True, False], ignore_index=True)
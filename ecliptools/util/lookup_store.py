@@ -0,0 +1,130 @@
+#!/usr/bin/python
+import collections.abc
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, Mapping, TextIO
+
+LOOKUP_STORE_SUFFIXES = (".sqlite", ".db")
+# SQLite limits the number of host parameters per statement
+_MAX_PARAMETERS = 500
+
+
+class LookupStore(collections.abc.Mapping):
+    """
+    Read only, indexed version of the lookup file created by get-lookup-file, stored in SQLite.
+    Accessions are read on demand through the primary key index, so opening a store takes the same time and memory
+    no matter how many accessions it holds. It can be used wherever the json.load-ed lookup dict is expected.
+    """
+    path: Path
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"Lookup store {self.path} does not exist")
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True,
+                                           check_same_thread=False)
+
+    @classmethod
+    def create(cls, path: Path | str, lookup: Mapping[str, dict] | Iterable[tuple[str, dict]]) -> "LookupStore":
+        """
+        Writes a store, an existing one is replaced once the new one is complete.
+        :param path:
+        :param lookup: The lookup data as created by get-lookup-file or its items
+        :return: The opened store
+        """
+        path = Path(path)
+        items = lookup.items() if isinstance(lookup, collections.abc.Mapping) else lookup
+
+        temp_path = path.with_suffix(path.suffix + ".tmp")
+        temp_path.unlink(missing_ok=True)
+        connection = sqlite3.connect(str(temp_path))
+        try:
+            with connection:
+                connection.execute("CREATE TABLE lookup (accession TEXT PRIMARY KEY, value TEXT NOT NULL) "
+                                   "WITHOUT ROWID")
+                connection.executemany("INSERT OR REPLACE INTO lookup (accession, value) VALUES (?, ?)",
+                                       ((accession, json.dumps(value)) for accession, value in items))
+        finally:
+            connection.close()
+        temp_path.replace(path)
+        return cls(path)
+
+    def __getitem__(self, accession: str) -> dict:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM lookup WHERE accession = ?", (accession,)).fetchone()
+        if row is None:
+            raise KeyError(accession)
+        return json.loads(row[0])
+
+    def get_many(self, accessions: Iterable[str]) -> dict[str, dict]:
+        """
+        Batch version of get.
+        :return: The entries of all accessions in the store
+        """
+        accessions = list(dict.fromkeys(accessions))
+        found: dict[str, dict] = {}
+        with self._lock:
+            for i in range(0, len(accessions), _MAX_PARAMETERS):
+                chunk = accessions[i:i + _MAX_PARAMETERS]
+                rows = self._connection.execute(
+                    f"SELECT accession, value FROM lookup WHERE accession IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                found.update((accession, json.loads(value)) for accession, value in rows)
+        return found
+
+    def __contains__(self, accession) -> bool:
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM lookup WHERE accession = ?", (accession,)).fetchone()
+        return row is not None
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            accessions = [row[0] for row in self._connection.execute("SELECT accession FROM lookup")]
+        return iter(accessions)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM lookup").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def is_lookup_store(lookup_file: TextIO | Path | str) -> bool:
+    path = Path(lookup_file) if isinstance(lookup_file, (str, Path)) else Path(getattr(lookup_file, "name", ""))
+    return path.suffix in LOOKUP_STORE_SUFFIXES
+
+
+def open_lookup(lookup_file: TextIO | Path | str) -> Mapping[str, dict]:
+    """
+    Opens the lookup data created by get-lookup-file. SQLite stores (.sqlite or .db) are opened as LookupStore,
+    everything else is read as JSON.
+    :param lookup_file:
+    :return: The lookup data by unversioned accession
+    """
+    if is_lookup_store(lookup_file):
+        path = lookup_file if isinstance(lookup_file, (str, Path)) else lookup_file.name
+        return LookupStore(path)
+
+    if isinstance(lookup_file, (str, Path)):
+        with open(lookup_file, "r") as f:
+            return json.load(f)
+    return json.load(lookup_file)
+
+
+def lookup_many(lookup: Mapping[str, dict], accessions: Iterable[str]) -> dict[str, dict]:
+    """
+    The entries of all accessions that are part of the lookup, in one query for stores.
+    """
+    if isinstance(lookup, LookupStore):
+        return lookup.get_many(accessions)
+    return {accession: lookup[accession] for accession in dict.fromkeys(accessions) if accession in lookup}
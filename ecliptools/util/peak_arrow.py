@@ -0,0 +1,182 @@
+#!/usr/bin/python
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from ecliptools.classes.Peak import BasePeak, Info
+from ecliptools.classes.PeakTable import PeakTable, StringTable
+
+ARROW_SUFFIXES = (".arrow", ".feather")
+INFO_FIELDS = ["ID", "object_type", "display_name", "biotype", "description", "seq_region_name", "parent"]
+
+
+def _dictionary(codes: np.ndarray, table: StringTable | list[str], null_mask: np.ndarray | None = None) \
+        -> pa.DictionaryArray:
+    indices = pa.array(codes.astype(np.int32), mask=null_mask)
+    return pa.DictionaryArray.from_arrays(indices, pa.array(list(table), type=pa.string()))
+
+
+def _unique_codes(values: list[str | None]) -> tuple[np.ndarray, list[str]]:
+    """
+    :return: The code of every value in the unique values and the unique values, None gets the code -1
+    """
+    uniques: dict[str, int] = {}
+    codes = np.array([-1 if value is None else uniques.setdefault(value, len(uniques)) for value in values],
+                     dtype=np.int32)
+    return codes, list(uniques)
+
+
+def _strand(minus_strand: np.ndarray, null_mask: np.ndarray | None = None) -> pa.DictionaryArray:
+    return _dictionary(minus_strand.astype(np.int32), ["+", "-"], null_mask)
+
+
+def peak_table_to_arrow(peak_table: PeakTable) -> pa.Table:
+    """
+    Flattens a PeakTable into one arrow table with one row per annotation. The peak columns are repeated
+    for every annotation of the peak, peaks without annotations get a single row with null annotation columns.
+    Strings are dictionary encoded, so repeating them costs only an int32 per row.
+    :param peak_table:
+    :return:
+    """
+    annotation_counts = np.diff(peak_table.annotation_offsets)
+    row_counts = np.maximum(annotation_counts, 1)
+    peak_ids = np.repeat(np.arange(len(peak_table), dtype=np.int32), row_counts)
+
+    annotation_ids = np.zeros(len(peak_ids), dtype=np.int64)
+    has_annotation = np.repeat(annotation_counts > 0, row_counts)
+    annotation_ids[has_annotation] = np.arange(peak_table.annotation_count)
+    no_annotation = ~has_annotation
+
+    info_ids = np.where(has_annotation, peak_table.annotation_info[annotation_ids] if peak_table.annotation_count
+                        else -1, -1)
+    no_info = info_ids < 0
+    info_ids = np.maximum(info_ids, 0)
+
+    columns = {
+        "peak_id": pa.array(peak_ids),
+        "peak_chrom": _dictionary(peak_table.peak_chrom[peak_ids], peak_table.chroms),
+        "peak_start": pa.array(peak_table.peak_start[peak_ids]),
+        "peak_end": pa.array(peak_table.peak_end[peak_ids]),
+        "peak_name": _dictionary(peak_table.peak_name[peak_ids], peak_table.names),
+        "peak_strand": _strand(peak_table.peak_minus_strand[peak_ids]),
+    }
+
+    def annotation_column(values: np.ndarray) -> np.ndarray:
+        return values[annotation_ids] if peak_table.annotation_count else np.zeros(len(peak_ids), values.dtype)
+
+    columns |= {
+        "chrom": _dictionary(annotation_column(peak_table.annotation_chrom), peak_table.chroms, no_annotation),
+        "start": pa.array(annotation_column(peak_table.annotation_start), mask=no_annotation),
+        "end": pa.array(annotation_column(peak_table.annotation_end), mask=no_annotation),
+        "name": _dictionary(annotation_column(peak_table.annotation_name), peak_table.names, no_annotation),
+        "strand": _strand(annotation_column(peak_table.annotation_minus_strand), no_annotation),
+        "type": _dictionary(annotation_column(peak_table.annotation_type), peak_table.types, no_annotation),
+        "sub_type": _dictionary(annotation_column(peak_table.annotation_sub_type), peak_table.types, no_annotation),
+    }
+
+    for field in INFO_FIELDS:
+        # many infos share a value (e.g. the parent gene), dictionaries have to be unique to be read by pandas
+        field_codes, values = _unique_codes([getattr(info, field) for info in peak_table.infos])
+        codes = field_codes[info_ids] if len(field_codes) else np.full(len(info_ids), -1, dtype=np.int32)
+        columns[f"info_{field}"] = _dictionary(np.maximum(codes, 0), values, no_info | (codes < 0))
+    is_canonical = pa.array([info.is_canonical for info in peak_table.infos], type=pa.bool_())
+    columns["info_is_canonical"] = is_canonical.take(pa.array(info_ids, mask=no_info)) if len(is_canonical) \
+        else pa.nulls(len(peak_ids), type=pa.bool_())
+
+    return pa.table(columns)
+
+
+def write_peak_arrow(peaks: PeakTable | Iterable[BasePeak], out_path: Path | str, compression="uncompressed"):
+    """
+    Writes peaks as an Arrow IPC (feather v2) file. Uncompressed files can be memory mapped by read_peak_arrow.
+    :param peaks: A PeakTable or BasePeaks, which can come from a generator
+    :param out_path:
+    :param compression: "uncompressed", "lz4" or "zstd"
+    :return:
+    """
+    if not isinstance(peaks, PeakTable):
+        peaks = PeakTable.from_peaks(peaks)
+    feather.write_feather(peak_table_to_arrow(peaks), str(out_path), compression=compression)
+
+
+def read_peak_arrow(in_path: Path | str, columns: list[str] | None = None, memory_map=True) -> pa.Table:
+    """
+    Reads a file written by write_peak_arrow. Only the requested columns are read, with memory_map=True and an
+    uncompressed file they are not even copied into memory.
+    :param in_path:
+    :param columns: The columns to read, all if None
+    :param memory_map:
+    :return:
+    """
+    return feather.read_table(str(in_path), columns=columns, memory_map=memory_map)
+
+
+def _codes(column: pa.ChunkedArray, table: StringTable) -> np.ndarray:
+    column = column.unify_dictionaries()
+    if not column.num_chunks:
+        return np.zeros(0, dtype=np.int32)
+
+    remap = np.array([table.code(value) for value in column.chunk(0).dictionary.to_pylist()] or [0],
+                     dtype=np.int32)
+    indices = [chunk.indices.fill_null(0).to_numpy(zero_copy_only=False) for chunk in column.chunks]
+    return remap[np.concatenate(indices)]
+
+
+def arrow_to_peak_table(table: pa.Table) -> PeakTable:
+    """
+    Converts a table read with read_peak_arrow (all columns) back into a PeakTable.
+    :param table:
+    :return:
+    """
+    chroms = StringTable()
+    names = StringTable()
+    types = StringTable()
+
+    peak_ids = table.column("peak_id").to_numpy()
+    if not len(peak_ids):
+        return PeakTable.from_peaks([])
+
+    first_rows = np.flatnonzero(np.diff(peak_ids, prepend=-1) != 0)
+    annotated = table.column("start").is_valid().to_numpy(zero_copy_only=False)
+
+    peak_minus_strand = _codes(table.column("peak_strand"), StringTable(["+", "-"])) == 1
+    peak_columns = {
+        "chrom": _codes(table.column("peak_chrom"), chroms)[first_rows],
+        "start": table.column("peak_start").to_numpy()[first_rows],
+        "end": table.column("peak_end").to_numpy()[first_rows],
+        "name": _codes(table.column("peak_name"), names)[first_rows],
+        "minus_strand": peak_minus_strand[first_rows],
+    }
+
+    info_ids = pc.dictionary_encode(table.column("info_ID").cast(pa.string())).combine_chunks()
+    info_valid = info_ids.is_valid().to_numpy(zero_copy_only=False)
+    info_codes = np.full(len(table), -1, dtype=np.int32)
+    infos: list[Info] = []
+    if info_valid.any():
+        info_rows = np.flatnonzero(info_valid)
+        _, first_info_rows, inverse = np.unique(info_ids.indices.to_numpy(zero_copy_only=False)[info_rows],
+                                                return_index=True, return_inverse=True)
+        info_codes[info_rows] = inverse
+        info_fields = INFO_FIELDS + ["is_canonical"]
+        info_table = table.select([f"info_{field}" for field in info_fields]).take(info_rows[first_info_rows])
+        for row in info_table.to_pylist():
+            infos.append(Info({field: row[f"info_{field}"] for field in info_fields}))
+
+    annotation_counts = np.bincount(peak_ids[annotated], minlength=len(first_rows))
+    annotation_columns = {
+        "offsets": np.concatenate([[0], np.cumsum(annotation_counts)]),
+        "chrom": _codes(table.column("chrom"), chroms)[annotated],
+        "start": table.column("start").fill_null(0).to_numpy()[annotated],
+        "end": table.column("end").fill_null(0).to_numpy()[annotated],
+        "name": _codes(table.column("name"), names)[annotated],
+        "minus_strand": (_codes(table.column("strand"), StringTable(["+", "-"])) == 1)[annotated],
+        "type": _codes(table.column("type"), types)[annotated],
+        "sub_type": _codes(table.column("sub_type"), types)[annotated],
+        "info": info_codes[annotated],
+    }
+
+    return PeakTable(chroms, names, types, infos, peak_columns, annotation_columns)
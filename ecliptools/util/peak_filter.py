@@ -0,0 +1,96 @@
+#!/usr/bin/python
+from typing import Iterable, NamedTuple
+
+import click
+
+from ecliptools.classes.Peak import Info
+from ecliptools.util.click_options import option_group
+
+
+def _as_set(values: Iterable[str] | None) -> frozenset[str] | None:
+    values = frozenset(values or ())
+    return values or None
+
+
+class PeakFilter(NamedTuple):
+    """
+    Predicates applied while annotated peaks are parsed, before Annotation objects are created or accessions are
+    looked up. None (or False and 0) means no restriction.
+    Peak predicates are checked first, then the annotation type and sub type of the bed columns and only the
+    remaining annotations are looked up for their biotype and canonical flag.
+    """
+    chroms: frozenset[str] | None = None
+    min_width: int = 0
+    types: frozenset[str] | None = None
+    sub_types: frozenset[str] | None = None
+    biotypes: frozenset[str] | None = None
+    canonical_only: bool = False
+    # peaks without any annotation left after filtering
+    drop_unannotated: bool = False
+
+    @classmethod
+    def create(cls, chroms: Iterable[str] | None = None, min_width=0, types: Iterable[str] | None = None,
+               sub_types: Iterable[str] | None = None, biotypes: Iterable[str] | None = None, canonical_only=False,
+               drop_unannotated=False) -> "PeakFilter":
+        return cls(_as_set(chroms), min_width, _as_set(types), _as_set(sub_types), _as_set(biotypes),
+                   canonical_only, drop_unannotated)
+
+    @property
+    def filters_info(self) -> bool:
+        return self.biotypes is not None or self.canonical_only
+
+    def accepts_peak(self, chrom: str, start: int, end: int) -> bool:
+        if self.chroms is not None and chrom not in self.chroms:
+            return False
+        return end - start >= self.min_width
+
+    def accepts_annotation(self, type: str, sub_type: str) -> bool:
+        if self.types is not None and type not in self.types:
+            return False
+        return self.sub_types is None or sub_type in self.sub_types
+
+    def accepts_info(self, info: Info | None) -> bool:
+        """
+        Annotations without lookup data are rejected as soon as biotypes or canonical transcripts are requested.
+        """
+        if not self.filters_info:
+            return True
+        if info is None:
+            return False
+        if self.biotypes is not None and info.biotype not in self.biotypes:
+            return False
+        return not self.canonical_only or info.is_canonical
+
+
+NO_FILTER = PeakFilter()
+
+
+def peak_filter_options(function):
+    """
+    Adds the filter options --chrom, --min-width, --type, --sub-type, --biotype, --canonical-only and
+    --drop-unannotated to a click command and passes them on as the keyword argument peak_filter.
+    """
+    @option_group(function)
+    @click.option("--chrom", "chroms", multiple=True,
+                  help="Only keep peaks on this chromosome, can be given several times.")
+    @click.option("--min-width", type=click.IntRange(0), default=0, show_default=True,
+                  help="Only keep peaks spanning at least this many bases.")
+    @click.option("--type", "types", multiple=True,
+                  help="Only keep annotations of this type (6th annotation column, e.g. TRANSCRIPT or rRNA), "
+                       "can be given several times.")
+    @click.option("--sub-type", "sub_types", multiple=True,
+                  help="Only keep annotations of this sub type (7th annotation column), can be given several times.")
+    @click.option("--biotype", "biotypes", multiple=True,
+                  help="Only keep annotations whose looked up biotype is this, e.g. protein_coding, "
+                       "can be given several times.")
+    @click.option("--canonical-only", is_flag=True, help="Only keep annotations of canonical transcripts.")
+    @click.option("--drop-unannotated", is_flag=True,
+                  help="Drop peaks without any annotation left after filtering. Peaks bedmap could not map "
+                       "(UNKNOWN) are always dropped.")
+    def wrapper(*args, chroms=(), min_width=0, types=(), sub_types=(), biotypes=(), canonical_only=False,
+                drop_unannotated=False, **kwargs):
+        peak_filter = PeakFilter.create(chroms, min_width, types, sub_types, biotypes, canonical_only,
+                                        drop_unannotated)
+        return function(*args, peak_filter=peak_filter, **kwargs)
+
+    return wrapper
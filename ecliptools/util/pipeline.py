@@ -0,0 +1,197 @@
+#!/usr/bin/python
+import hashlib
+import json
+import multiprocessing
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, NamedTuple
+
+import click
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class Step(NamedTuple):
+    """
+    One node of a pipeline. The action is called as action(*inputs, *outputs, **params) and has to be a module level
+    function, so it can be sent to a worker process. Steps producing an input of this step have to run before it.
+    """
+    name: str
+    action: Callable[..., Any]
+    inputs: tuple[Path, ...] = ()
+    outputs: tuple[Path, ...] = ()
+    params: dict[str, Any] = {}
+    # steps that can not run in parallel, e.g. because they share the Ensembl rate limit, run in the main process
+    parallel: bool = True
+
+
+class FileHasher(object):
+    """
+    Content hashes of files, remembered by size and modification time so unchanged files are not read again.
+    """
+
+    def __init__(self, known: dict[str, dict] | None = None):
+        self.known = known or {}
+
+    def hash(self, path: Path) -> str | None:
+        """
+        :return: The sha256 of the file content, None if the file does not exist
+        """
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+
+        key = str(path.resolve())
+        entry = self.known.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["sha256"]
+
+        digest = hashlib.sha256()
+        with path.open("rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        self.known[key] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+
+def _run_step(step: Step):
+    step.action(*step.inputs, *step.outputs, **step.params)
+
+
+class Pipeline(object):
+    """
+    Runs a DAG of steps and skips every step whose inputs, parameters and outputs did not change since its last
+    successful run. Inputs are fingerprinted by content hash, the fingerprints are kept in a JSON state file.
+    Independent parallel steps run in worker processes.
+    """
+    steps: dict[str, Step]
+    state_path: Path
+
+    def __init__(self, state_path: Path | str):
+        self.steps = {}
+        self.state_path = Path(state_path)
+
+    def add(self, step: Step) -> Step:
+        if step.name in self.steps:
+            raise ValueError(f"Step {step.name} exists already")
+        self.steps[step.name] = step
+        return step
+
+    def dependencies(self) -> dict[str, set[str]]:
+        """
+        :return: The names of the steps every step depends on, derived from their inputs and outputs
+        """
+        producers: dict[Path, str] = {}
+        for step in self.steps.values():
+            for output in step.outputs:
+                if output.resolve() in producers:
+                    raise ValueError(f"{output} is produced by {producers[output.resolve()]} and {step.name}")
+                producers[output.resolve()] = step.name
+
+        return {name: {producers[path.resolve()] for path in step.inputs if path.resolve() in producers}
+                for name, step in self.steps.items()}
+
+    def _load_state(self) -> dict:
+        if self.state_path.exists():
+            with self.state_path.open("r") as f:
+                return json.load(f)
+        return {"steps": {}, "files": {}}
+
+    def _save_state(self, state: dict):
+        temp_path = self.state_path.with_suffix(self.state_path.suffix + ".tmp")
+        with temp_path.open("w") as f:
+            json.dump(state, f, indent=1)
+        temp_path.replace(self.state_path)
+
+    def fingerprint(self, step: Step, hasher: FileHasher) -> str | None:
+        """
+        :return: A hash of the action, parameters and input contents, None if an input is missing
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{step.action.__module__}.{step.action.__qualname__}".encode())
+        digest.update(json.dumps(step.params, sort_keys=True, default=str).encode())
+        for path in step.inputs:
+            file_hash = hasher.hash(path)
+            if file_hash is None:
+                return None
+            digest.update(file_hash.encode())
+        return digest.hexdigest()
+
+    def is_up_to_date(self, step: Step, state: dict, hasher: FileHasher) -> bool:
+        recorded = state["steps"].get(step.name)
+        if recorded is None or recorded["fingerprint"] != self.fingerprint(step, hasher):
+            return False
+        # outputs changed or deleted by hand, or not produced by the recorded run, have to be produced again
+        return all((file_hash := hasher.hash(path)) is not None and file_hash == recorded["outputs"].get(str(path))
+                   for path in step.outputs)
+
+    def run(self, workers: int | None = None, force=False, dry_run=False) -> dict[str, str]:
+        """
+        :param workers: Number of worker processes, defaults to the number of CPUs
+        :param force: Run all steps, even if they are up to date
+        :param dry_run: Only report which steps would run
+        :return: "skipped", "ran", "would run" or "failed" per step
+        """
+        dependencies = self.dependencies()
+        state = self._load_state()
+        hasher = FileHasher(state["files"])
+        results: dict[str, str] = {}
+        remaining = dict(dependencies)
+
+        def ready() -> list[str]:
+            return [name for name, needs in remaining.items() if all(need in results for need in needs)]
+
+        def finished(name: str, result: str):
+            results[name] = result
+            if result == "ran":
+                step = self.steps[name]
+                state["steps"][name] = {"fingerprint": self.fingerprint(step, hasher),
+                                        "outputs": {str(path): hasher.hash(path) for path in step.outputs}}
+                self._save_state(state)
+            click.echo(f"{name}: {result}", file=sys.stderr)
+
+        # spawned workers do not inherit the threads of the Ensembl client or the response cache connection
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            running: dict[Future, str] = {}
+            while remaining or running:
+                # steps handled in the main process can make further steps ready right away
+                while names := ready():
+                    for name in names:
+                        del remaining[name]
+                        step = self.steps[name]
+                        needed = {results[need] for need in dependencies[name]}
+                        if "failed" in needed:
+                            finished(name, "failed")
+                        elif "would run" in needed:
+                            finished(name, "would run")
+                        elif not force and self.is_up_to_date(step, state, hasher):
+                            finished(name, "skipped")
+                        elif dry_run:
+                            finished(name, "would run")
+                        elif step.parallel:
+                            running[executor.submit(_run_step, step)] = name
+                        else:
+                            try:
+                                _run_step(step)
+                                finished(name, "ran")
+                            except Exception as e:
+                                click.echo(f"ERROR: {name} failed: {e!r}", file=sys.stderr)
+                                finished(name, "failed")
+
+                if not running:
+                    if remaining:
+                        raise ValueError(f"The steps {sorted(remaining)} depend on each other")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        click.echo(f"ERROR: {name} failed: {future.exception()!r}", file=sys.stderr)
+                        finished(name, "failed")
+                    else:
+                        finished(name, "ran")
+
+        return results
@@ -0,0 +1,239 @@
+#!/usr/bin/python
+import contextlib
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator
+
+import click
+
+from ecliptools.util.click_options import option_group
+from ecliptools.util.ensembl_client import current_ensembl_client
+from ecliptools.util.response_cache import current_response_cache
+
+
+def _io_counters() -> dict[str, int]:
+    """
+    Bytes passed through read and write calls of this process (files and sockets), only available on Linux.
+    """
+    try:
+        with open("/proc/self/io", "r") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return {"bytes_read": int(fields["rchar"]), "bytes_written": int(fields["wchar"])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _http_counters() -> dict[str, int]:
+    client = current_ensembl_client()
+    if client is None:
+        return {}
+    return {f"http_{name}": value for name, value in client.stats().items()}
+
+
+def _cache_counters() -> dict[str, int]:
+    cache = current_response_cache()
+    if cache is None:
+        return {}
+    return {"cache_hits": sum(cache.stats.hits.values()), "cache_misses": sum(cache.stats.misses.values())}
+
+
+def _counters() -> dict[str, int]:
+    return _io_counters() | _http_counters() | _cache_counters()
+
+
+def _counter_sources() -> tuple:
+    return current_ensembl_client(), current_response_cache()
+
+
+class Stage(object):
+    name: str
+    metrics: dict[str, float | int]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.metrics = {}
+        self.peak_memory = 0
+        self.profile: cProfile.Profile | None = None
+
+    def to_dict(self):
+        return {"name": self.name} | self.metrics
+
+
+class Profiler(object):
+    """
+    Records wall time, CPU time, peak traced memory, HTTP requests, response cache hits and bytes read and written
+    for every stage of a command. Stages can be nested, the metrics of a stage include its nested stages.
+    Counters are cheaper than stages and only sum up the time of many short calls, e.g. encoding single peaks.
+    """
+    memory: bool
+    cprofile: bool
+    stages: list[Stage]
+    counters: dict[str, dict[str, float]]
+
+    def __init__(self, memory=True, cprofile=False):
+        self.memory = memory
+        self.cprofile = cprofile
+        self.stages = []
+        self.counters = {}
+        self._open: list[Stage] = []
+
+    def _update_peaks(self):
+        if not self.memory:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for stage in self._open:
+            stage.peak_memory = max(stage.peak_memory, peak)
+        tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, cprofile=True) -> Iterator[Stage]:
+        """
+        :param name:
+        :param cprofile: Profile this stage with cProfile if the profiler was created with cprofile
+        """
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        stage = Stage(name)
+        self.stages.append(stage)
+        self._update_peaks()
+        self._open.append(stage)
+
+        # only one cProfile profiler can be active, it profiles the outermost stages
+        if self.cprofile and cprofile and not any(open_stage.profile for open_stage in self._open):
+            stage.profile = cProfile.Profile()
+            stage.profile.enable()
+
+        counters = _counters()
+        sources = _counter_sources()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.metrics["wall_seconds"] = time.perf_counter() - wall
+            stage.metrics["cpu_seconds"] = time.process_time() - cpu
+            if stage.profile:
+                stage.profile.disable()
+            self._update_peaks()
+            self._open.remove(stage)
+            if self.memory:
+                stage.metrics["peak_memory_mb"] = stage.peak_memory / 2 ** 20
+
+            # a client or cache installed during the stage, e.g. by the command itself, counts from zero
+            end_sources = _counter_sources()
+            if end_sources[0] is not sources[0]:
+                counters = {name: value for name, value in counters.items() if not name.startswith("http_")}
+            if end_sources[1] is not sources[1]:
+                counters = {name: value for name, value in counters.items() if not name.startswith("cache_")}
+            for counter, value in _counters().items():
+                stage.metrics[counter] = value - counters.get(counter, 0)
+            lookups = stage.metrics.get("cache_hits", 0) + stage.metrics.get("cache_misses", 0)
+            if lookups:
+                stage.metrics["cache_hit_rate"] = stage.metrics["cache_hits"] / lookups
+
+    @contextlib.contextmanager
+    def count(self, name: str) -> Iterator[None]:
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            counter = self.counters.setdefault(name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            counter["calls"] += 1
+            counter["wall_seconds"] += time.perf_counter() - wall
+            counter["cpu_seconds"] += time.process_time() - cpu
+
+    def hot_stage(self) -> Stage | None:
+        """
+        :return: The profiled stage with the longest wall time
+        """
+        profiled = [stage for stage in self.stages if stage.profile and "wall_seconds" in stage.metrics]
+        return max(profiled, key=lambda stage: stage.metrics["wall_seconds"], default=None)
+
+    def to_dict(self) -> dict:
+        return {
+            "argv": sys.argv,
+            "stages": [stage.to_dict() for stage in self.stages],
+            "counters": self.counters,
+        }
+
+    def write(self, metrics_path: Path | str, cprofile_path: Path | str | None = None):
+        """
+        Writes the metrics as JSON and, if profiled, the cProfile stats of the hot stage (readable with pstats).
+        """
+        metrics = self.to_dict()
+        hot_stage = self.hot_stage()
+        if cprofile_path and hot_stage:
+            hot_stage.profile.dump_stats(str(cprofile_path))
+            metrics["cprofile_stage"] = hot_stage.name
+        with open(metrics_path, "w") as f:
+            json.dump(metrics, f, indent=2)
+
+
+class NullProfiler(Profiler):
+    """
+    Used while no command is profiled, stages and counters cost nothing.
+    """
+
+    @contextlib.contextmanager
+    def stage(self, name: str, cprofile=True) -> Iterator[None]:
+        yield None
+
+    @contextlib.contextmanager
+    def count(self, name: str) -> Iterator[None]:
+        yield
+
+
+_NULL_PROFILER = NullProfiler(memory=False)
+_PROFILER: Profiler = _NULL_PROFILER
+
+
+def get_profiler() -> Profiler:
+    """
+    The profiler of the running command, a NullProfiler if it is not profiled.
+    """
+    return _PROFILER
+
+
+def set_profiler(profiler: Profiler | None):
+    global _PROFILER
+    _PROFILER = profiler or _NULL_PROFILER
+
+
+def profile_options(function):
+    """
+    Adds --profile, --profile-memory/--no-profile-memory and --cprofile options to a click command.
+    With --profile the whole command runs as stage "total" and the metrics are written when it finishes.
+    """
+    @option_group(function)
+    @click.option("--profile", "profile_path", type=click.Path(dir_okay=False, path_type=Path), default=None,
+                  help="Write wall and CPU time, peak memory, HTTP requests, cache hits and bytes read and written "
+                       "per stage to this JSON file.")
+    @click.option("--profile-memory/--no-profile-memory", default=True,
+                  help="Trace memory allocations while profiling, which slows allocation heavy stages down.")
+    @click.option("--cprofile", "cprofile_path", type=click.Path(dir_okay=False, path_type=Path), default=None,
+                  help="With --profile, also dump the cProfile stats of the slowest stage to this file.")
+    @click.pass_context
+    def wrapper(ctx: click.Context, *args, profile_path: Path | None = None, profile_memory=True,
+                cprofile_path: Path | None = None, **kwargs):
+        if profile_path is None:
+            return ctx.invoke(function, *args, **kwargs)
+
+        profiler = Profiler(memory=profile_memory, cprofile=cprofile_path is not None)
+        set_profiler(profiler)
+        try:
+            # the total stage would always be the slowest, cProfile is left to the stages inside it
+            with profiler.stage("total", cprofile=False):
+                return ctx.invoke(function, *args, **kwargs)
+        finally:
+            if profile_memory:
+                tracemalloc.stop()
+            profiler.write(profile_path, cprofile_path)
+            set_profiler(None)
+
+    return wrapper
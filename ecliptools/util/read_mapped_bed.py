@@ -0,0 +1,174 @@
+#!/usr/bin/python
+from itertools import chain, islice
+from pathlib import Path
+from typing import Mapping, TextIO, Iterator
+
+import numpy as np
+
+from ecliptools.classes.Peak import BasePeak, Info
+from ecliptools.classes.PeakTable import PeakTable, StringTable
+from ecliptools.util.get_info import InfoCache
+from ecliptools.util.peak_filter import NO_FILTER, PeakFilter
+from ecliptools.util.profiling import get_profiler
+
+# Columns of the ENCODE eCLIP peaks, the annotation blocks appended by bedmap start after them
+PEAK_COLUMNS = 10
+ANNOTATION_COLUMNS = 7
+# Lines parsed before the accessions of their annotations are looked up together
+PARSE_CHUNK_SIZE = 10_000
+
+
+class _MappedTables(object):
+    """
+    The string tables and infos shared by the chunks of one file, so their PeakTables can be concatenated.
+    Infos are deduplicated by their ID like in PeakTable.from_peaks.
+    """
+
+    def __init__(self):
+        self.chroms = StringTable()
+        self.names = StringTable()
+        self.types = StringTable()
+        self.infos: list[Info] = []
+        self._info_codes: dict[str, int] = {}
+
+    @staticmethod
+    def encode(values: np.ndarray, table: StringTable) -> np.ndarray:
+        """
+        :return: The code of every value, only the distinct values are interned
+        """
+        if not len(values):
+            return np.zeros(0, dtype=np.int32)
+        uniques, inverse = np.unique(values, return_inverse=True)
+        return np.array([table.code(value) for value in uniques], dtype=np.int32)[inverse]
+
+    def info_code(self, info: Info | None) -> int:
+        if info is None:
+            return -1
+        if info.ID not in self._info_codes:
+            self._info_codes[info.ID] = len(self.infos)
+            self.infos.append(info)
+        return self._info_codes[info.ID]
+
+
+def _parse_chunk(lines: list[str], delimiter: str, infos: InfoCache, peak_filter: PeakFilter,
+                 tables: _MappedTables) -> PeakTable:
+    """
+    Parses the lines into columns: the annotation blocks of all lines are reshaped into one long table keyed by
+    peak, the strand match, the filter and the lookup are applied to its columns.
+    Peaks that bedmap could not map are dropped.
+    """
+    rows = [fields for fields in (line.rstrip("\r\n").split(delimiter) for line in lines)
+            if len(fields) > PEAK_COLUMNS and fields[PEAK_COLUMNS] != "UNKNOWN"]
+    peak_fields = np.array([fields[:6] for fields in rows], dtype=object).reshape(-1, 6)
+    starts = peak_fields[:, 1].astype(np.int64)
+    ends = peak_fields[:, 2].astype(np.int64)
+    keep = ends - starts >= peak_filter.min_width
+    if peak_filter.chroms is not None:
+        keep &= np.isin(peak_fields[:, 0], list(peak_filter.chroms))
+    rows = [fields for fields, kept in zip(rows, keep) if kept]
+    peak_fields, starts, ends = peak_fields[keep], starts[keep], ends[keep]
+
+    # trailing fields that do not fill a whole block are ignored
+    block_counts = np.array([(len(fields) - PEAK_COLUMNS) // ANNOTATION_COLUMNS for fields in rows], dtype=np.int64)
+    blocks = np.array(list(chain.from_iterable(
+        fields[PEAK_COLUMNS:PEAK_COLUMNS + count * ANNOTATION_COLUMNS] for fields, count in zip(rows, block_counts)
+    )), dtype=object).reshape(-1, ANNOTATION_COLUMNS)
+    block_peaks = np.repeat(np.arange(len(rows)), block_counts)
+
+    keep_blocks = blocks[:, 3] == peak_fields[block_peaks, 5]
+    if peak_filter.types is not None:
+        keep_blocks &= np.isin(blocks[:, 5], list(peak_filter.types))
+    if peak_filter.sub_types is not None:
+        keep_blocks &= np.isin(blocks[:, 6], list(peak_filter.sub_types))
+    blocks, block_peaks = blocks[keep_blocks], block_peaks[keep_blocks]
+
+    # the lookup join, every accession of the chunk is looked up and checked once
+    accessions, accession_ids = np.unique(np.array([name.split(".")[0] for name in blocks[:, 4]], dtype=object),
+                                          return_inverse=True)
+    infos.prefetch(accessions)
+    accession_infos = [infos.get(accession) for accession in accessions]
+    accepted = np.array([peak_filter.accepts_info(info) for info in accession_infos], dtype=np.bool_)
+    info_codes = np.array([tables.info_code(info) if accept else -1
+                           for info, accept in zip(accession_infos, accepted)], dtype=np.int32)
+    keep_blocks = accepted[accession_ids] if len(blocks) else np.zeros(0, dtype=np.bool_)
+    blocks, block_peaks = blocks[keep_blocks], block_peaks[keep_blocks]
+    block_infos = info_codes[accession_ids[keep_blocks]] if len(keep_blocks) else np.zeros(0, dtype=np.int32)
+
+    annotation_counts = np.bincount(block_peaks, minlength=len(rows))
+    peaks = np.arange(len(rows))
+    if peak_filter.drop_unannotated:
+        peaks = np.flatnonzero(annotation_counts)
+        annotation_counts = annotation_counts[peaks]
+
+    peak_fields = peak_fields[peaks]
+    peak_columns = {
+        "chrom": tables.encode(peak_fields[:, 0], tables.chroms),
+        "start": starts[peaks],
+        "end": ends[peaks],
+        "name": tables.encode(peak_fields[:, 3], tables.names),
+        "minus_strand": peak_fields[:, 5] == "-",
+    }
+    annotation_columns = {
+        "offsets": np.concatenate([[0], np.cumsum(annotation_counts)]),
+        "chrom": tables.encode(blocks[:, 0], tables.chroms),
+        "start": blocks[:, 1].astype(np.int64),
+        "end": blocks[:, 2].astype(np.int64),
+        "minus_strand": blocks[:, 3] == "-",
+        "name": tables.encode(blocks[:, 4], tables.names),
+        "type": tables.encode(blocks[:, 5], tables.types),
+        "sub_type": tables.encode(blocks[:, 6], tables.types),
+        "info": block_infos,
+    }
+    return PeakTable(tables.chroms, tables.names, tables.types, tables.infos, peak_columns, annotation_columns)
+
+
+def _read_chunks(in_file: TextIO | Path, lookup: Mapping[str, dict[str, any]] | InfoCache, delimiter: str,
+                 peak_filter: PeakFilter) -> Iterator[PeakTable]:
+    """
+    :return: A PeakTable per chunk of PARSE_CHUNK_SIZE lines, all sharing their string tables and infos
+    """
+    if isinstance(in_file, Path):
+        in_file = in_file.open("r")
+
+    infos = lookup if isinstance(lookup, InfoCache) else InfoCache(lookup)
+    tables = _MappedTables()
+    profiler = get_profiler()
+    while lines := list(islice(in_file, PARSE_CHUNK_SIZE)):
+        with profiler.count("parse"):
+            peak_table = _parse_chunk(lines, delimiter, infos, peak_filter, tables)
+        yield peak_table
+
+
+def read_mapped_table(in_file: TextIO | Path, lookup: Mapping[str, dict[str, any]] | InfoCache, delimiter="\t",
+                      peak_filter: PeakFilter = NO_FILTER) -> PeakTable:
+    """
+    Reads a bed file annotated with bedmap --echo --echo-map directly into a PeakTable, without creating a
+    BasePeak or Annotation. Same peaks as read_mapped_bed.
+    :param in_file: The annotated (ragged) bed file
+    :param lookup: The lookup data created by get-lookup-file (dict or LookupStore) or an InfoCache on it
+    :param delimiter:
+    :param peak_filter:
+    :return:
+    """
+    chunks = list(_read_chunks(in_file, lookup, delimiter, peak_filter))
+    return PeakTable.concatenate(chunks) if chunks else PeakTable.from_peaks([])
+
+
+def read_mapped_bed(in_file: TextIO | Path, lookup: Mapping[str, dict[str, any]] | InfoCache, delimiter="\t",
+                    peak_filter: PeakFilter = NO_FILTER) -> Iterator[BasePeak]:
+    """
+    Streams a bed file annotated with bedmap --echo --echo-map and yields one BasePeak per line.
+    The file is read once in chunks of PARSE_CHUNK_SIZE lines, so memory does not depend on the file size.
+    Every chunk is parsed into columns and the filter is pushed down into them: lines and annotation blocks it
+    rejects are dropped before any object is created, only the accessions of the remaining annotations of a chunk
+    are looked up in one batch. BasePeaks are only created for the peaks that are left.
+    Annotations of the same accession share one Info.
+    Peaks that bedmap could not map are skipped and annotations that do not respect strandedness are removed.
+    :param in_file: The annotated (ragged) bed file
+    :param lookup: The lookup data created by get-lookup-file (dict or LookupStore) or an InfoCache on it
+    :param delimiter:
+    :param peak_filter:
+    :return:
+    """
+    for peak_table in _read_chunks(in_file, lookup, delimiter, peak_filter):
+        yield from peak_table
@@ -0,0 +1,17 @@
+#!/usr/bin/python
+from pathlib import Path
+
+from ecliptools.classes.PeakTable import PeakTable
+from ecliptools.util.peak_arrow import ARROW_SUFFIXES, arrow_to_peak_table, read_peak_arrow
+from ecliptools.util.read_peak_json import read_peak_json
+
+
+def read_peak_table(in_path: Path | str) -> PeakTable:
+    """
+    Reads a json file written by to-json or an arrow file written by to-arrow into a PeakTable.
+    """
+    in_path = Path(in_path)
+    if in_path.suffix in ARROW_SUFFIXES:
+        return arrow_to_peak_table(read_peak_arrow(in_path))
+    with in_path.open("r") as f:
+        return PeakTable.from_peaks(read_peak_json(f.read()))
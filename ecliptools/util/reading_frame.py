@@ -0,0 +1,219 @@
+#!/usr/bin/python
+import asyncio
+import itertools
+import sys
+
+import click
+import numpy as np
+
+from ecliptools.util.ensembl_client import EnsemblClient, get_ensembl_client
+from ecliptools.util.fasta import IndexedFasta, get_genome_fasta, reverse_complement
+from ecliptools.util.get_binding_sequence import fetch_ensemble_sequence
+from ecliptools.util.response_cache import get_response_cache
+
+CODONS = ["".join(codon) for codon in itertools.product("TCAG", repeat=3)]
+# codon code of codons containing anything but ACGT
+INVALID_CODON = len(CODONS)
+
+_BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate("TCAG"):
+    _BASE_CODES[ord(_base)] = _BASE_CODES[ord(_base.lower())] = _code
+
+
+def codon_codes(cds_sequence: str) -> np.ndarray:
+    """
+    :return: The code (index into CODONS) of every complete codon of the sequence, INVALID_CODON for codons with N etc.
+    """
+    bases = _BASE_CODES[np.frombuffer(cds_sequence.encode("ascii"), dtype=np.uint8)]
+    bases = bases[:len(bases) // 3 * 3].reshape(-1, 3).astype(np.int32)
+    codes = bases[:, 0] * 16 + bases[:, 1] * 4 + bases[:, 2]
+    codes[(bases == 4).any(axis=1)] = INVALID_CODON
+    return codes
+
+
+def count_codons(cds_sequence: str, cds_starts: np.ndarray, cds_ends: np.ndarray) -> np.ndarray:
+    """
+    Counts the codons of many CDS intervals of one transcript at once. A prefix sum over the one-hot encoded
+    codons turns every count into one subtraction, independent of the length of the transcript or the peak.
+    Only codons lying completely inside an interval are counted.
+    :param cds_sequence:
+    :param cds_starts: 0-based CDS positions
+    :param cds_ends: Exclusive
+    :return: An interval × len(CODONS) count matrix
+    """
+    codes = codon_codes(cds_sequence)
+    prefix = np.zeros((len(codes) + 1, INVALID_CODON + 1), dtype=np.int32)
+    np.add.at(prefix, (np.arange(1, len(codes) + 1), codes), 1)
+    np.cumsum(prefix, axis=0, out=prefix)
+
+    first = np.clip((np.asarray(cds_starts) + 2) // 3, 0, len(codes))
+    last = np.clip(np.asarray(cds_ends) // 3, 0, len(codes))
+    last = np.maximum(first, last)
+    return (prefix[last] - prefix[first])[:, :INVALID_CODON]
+
+
+class EnsemblRequestFailed(Exception):
+    """
+    Ensembl did not answer a request after all retries. Unlike a transcript without CDS, the data may exist.
+    """
+    pass
+
+
+class CdsMap(object):
+    """
+    Maps genomic positions of a transcript onto its coding sequence. The coding parts of the exons are kept sorted
+    by genomic start, so positions are mapped with binary search instead of walking the transcript.
+    Genomic coordinates are 1-based and inclusive like in Ensembl.
+    """
+    transcript: str
+    chrom: str
+    strand: int
+    segment_starts: np.ndarray
+    segment_ends: np.ndarray
+    # CDS position of the transcript 5' end of every segment
+    segment_offsets: np.ndarray
+
+    def __init__(self, transcript: str, chrom: str, strand: int, segments: list[tuple[int, int]]):
+        self.transcript = transcript
+        self.chrom = chrom
+        self.strand = strand
+
+        segments = sorted(segments)
+        self.segment_starts = np.array([start for start, _ in segments], dtype=np.int64)
+        self.segment_ends = np.array([end for _, end in segments], dtype=np.int64)
+        lengths = self.segment_ends - self.segment_starts + 1
+        if strand == 1:
+            self.segment_offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        else:
+            self.segment_offsets = np.concatenate([np.cumsum(lengths[::-1])[::-1][1:], [0]]).astype(np.int64)
+
+    @classmethod
+    def from_lookup(cls, decoded: dict) -> "CdsMap | None":
+        """
+        :param decoded: A /lookup/id response of a transcript requested with expand=1
+        :return: None for transcripts without translation
+        """
+        translation = decoded.get("Translation")
+        if not translation or not decoded.get("Exon"):
+            return None
+        segments = []
+        for exon in decoded["Exon"]:
+            start = max(exon["start"], translation["start"])
+            end = min(exon["end"], translation["end"])
+            if start <= end:
+                segments.append((start, end))
+        return cls(decoded["id"], decoded["seq_region_name"], decoded["strand"], segments)
+
+    @property
+    def length(self) -> int:
+        return int((self.segment_ends - self.segment_starts + 1).sum())
+
+    def cds_positions(self, positions: np.ndarray, segments: np.ndarray) -> np.ndarray:
+        if self.strand == 1:
+            return self.segment_offsets[segments] + positions - self.segment_starts[segments]
+        return self.segment_offsets[segments] + self.segment_ends[segments] - positions
+
+    def to_cds(self, starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Maps genomic intervals to the CDS interval covered by their coding bases. Intervals spanning an intron
+        cover the coding bases on both sides of it.
+        :param starts: 0-based genomic starts, like the peak bed files
+        :param ends: Exclusive genomic ends
+        :return: 0-based CDS starts and exclusive ends, both -1 for intervals without coding bases
+        """
+        first_position = np.asarray(starts, dtype=np.int64) + 1
+        last_position = np.asarray(ends, dtype=np.int64)
+        if not len(self.segment_starts):
+            missing = np.full(len(first_position), -1, dtype=np.int64)
+            return missing, missing.copy()
+
+        # first segment ending at or after the first position, last segment starting at or before the last position
+        first_segment = np.searchsorted(self.segment_ends, first_position, side="left")
+        last_segment = np.searchsorted(self.segment_starts, last_position, side="right") - 1
+        coding = (first_segment <= last_segment) & (first_segment < len(self.segment_starts)) & (last_segment >= 0)
+
+        first_segment = np.clip(first_segment, 0, len(self.segment_starts) - 1)
+        last_segment = np.clip(last_segment, 0, len(self.segment_starts) - 1)
+        low = np.maximum(first_position, self.segment_starts[first_segment])
+        high = np.minimum(last_position, self.segment_ends[last_segment])
+        coding &= low <= high
+
+        low_cds = self.cds_positions(low, first_segment)
+        high_cds = self.cds_positions(high, last_segment)
+        cds_starts = np.where(coding, np.minimum(low_cds, high_cds), -1)
+        cds_ends = np.where(coding, np.maximum(low_cds, high_cds) + 1, -1)
+        return cds_starts, cds_ends
+
+    def sequence(self, fasta: IndexedFasta) -> str:
+        """
+        Assembles the CDS from a local genome.
+        """
+        sequence = "".join(fasta.fetch(self.chrom, int(start) - 1, int(end))
+                           for start, end in zip(self.segment_starts, self.segment_ends))
+        if self.strand == 1:
+            return sequence
+        return reverse_complement(sequence)
+
+
+async def fetch_cds_map(client: EnsemblClient, transcript_accession: str) -> CdsMap | None:
+    """
+    Fetches the exon structure of a transcript, using the response cache.
+    :return: None if the transcript is not coding
+    :raises EnsemblRequestFailed: If the lookup request failed
+    """
+    head = transcript_accession.split(".", 1)[0]
+    cache = get_response_cache()
+    decoded = cache.get(client.server, "lookup/id/expand", head)
+    if decoded is None:
+        decoded = await client.get_json(f"/lookup/id/{head}?", params={"expand": 1})
+        if decoded is None:
+            raise EnsemblRequestFailed(f"Lookup of {head} failed")
+        cache.set(client.server, "lookup/id/expand", head, decoded)
+    return CdsMap.from_lookup(decoded)
+
+
+async def fetch_cds_sequence(client: EnsemblClient, cds_map: CdsMap, fasta: IndexedFasta | None = None) -> str:
+    """
+    The CDS of a transcript, assembled from the local genome if one is given, otherwise fetched from Ensembl.
+    Ensembl pads incomplete 5' ends with N, the padding is removed so the sequence matches the CdsMap.
+    :raises EnsemblRequestFailed: If the sequence request failed
+    """
+    if fasta is not None:
+        return cds_map.sequence(fasta)
+
+    response = await fetch_ensemble_sequence(client, cds_map.transcript, cds=True)
+    if response["molecule"] == "FAILED":
+        raise EnsemblRequestFailed(f"CDS sequence of {cds_map.transcript} failed")
+    sequence = response["seq"]
+    if len(sequence) != cds_map.length:
+        click.echo(f"WARN: CDS of {cds_map.transcript} has {len(sequence)} bases, its exons {cds_map.length}",
+                   sys.stderr)
+        if len(sequence) > cds_map.length:
+            sequence = sequence[len(sequence) - cds_map.length:]
+    return sequence
+
+
+def get_codon_counts(transcript_accession: str, start: int, end: int) -> dict[str, int]:
+    """
+    Codon counts of a single peak, located in the CDS by its genomic coordinates.
+    :param transcript_accession:
+    :param start: 0-based genomic start of the peak
+    :param end:
+    :return: The counts of the codons completely inside the coding part of the peak, {} if it has none
+    :raises EnsemblRequestFailed: If the transcript could not be fetched
+    """
+    async def run():
+        client = get_ensembl_client()
+        cds_map = await fetch_cds_map(client, transcript_accession)
+        if cds_map is None:
+            return None, ""
+        return cds_map, await fetch_cds_sequence(client, cds_map, get_genome_fasta())
+
+    cds_map, sequence = asyncio.run(run())
+    if cds_map is None:
+        return {}
+    cds_starts, cds_ends = cds_map.to_cds(np.array([start]), np.array([end]))
+    if cds_starts[0] < 0:
+        return {}
+    counts = count_codons(sequence, cds_starts, cds_ends)[0]
+    return {CODONS[code]: int(count) for code, count in enumerate(counts) if count}
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterable
+
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "ecliptools" / "ensembl.sqlite"
+
+
+class CacheStats(object):
+    hits: dict[str, int]
+    misses: dict[str, int]
+
+    def __init__(self):
+        self.hits = {}
+        self.misses = {}
+
+    def record(self, endpoint: str, hit: bool, count=1):
+        counter = self.hits if hit else self.misses
+        counter[endpoint] = counter.get(endpoint, 0) + count
+
+    @property
+    def hit_rate(self) -> float:
+        hits = sum(self.hits.values())
+        total = hits + sum(self.misses.values())
+        return hits / total if total else 0.0
+
+    def to_dict(self):
+        return {
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "hit_rate": self.hit_rate,
+        }
+
+
+class ResponseCache(object):
+    """
+    Persistent cache for decoded Ensembl REST responses, keyed by server, endpoint and accession and stored in
+    SQLite. Responses of a local stand-in or another assembly server never answer requests to a different server.
+    Entries expire after ttl seconds or when they were stored for another Ensembl release.
+    If max_entries is set the least recently used entries are evicted, only then reads record their access time.
+    Without a path the cache only lives in memory, which gives the old per run behaviour.
+    """
+    path: Path | None
+    ttl: float | None
+    release: int | None
+    max_entries: int | None
+    stats: CacheStats
+
+    def __init__(self, path: Path | str | None = DEFAULT_CACHE_PATH, ttl: float | None = None,
+                 release: int | None = None, max_entries: int | None = None):
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+        self.release = release
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.path) if self.path else ":memory:", check_same_thread=False)
+        with self._connection:
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(responses)")]
+            if columns and "server" not in columns:
+                # caches written before responses were kept per server, it is unknown which server they came from
+                self._connection.execute("DROP TABLE responses")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "server TEXT NOT NULL, endpoint TEXT NOT NULL, key TEXT NOT NULL, release INTEGER, "
+                "value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, "
+                "PRIMARY KEY (server, endpoint, key))"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @classmethod
+    def from_environment(cls) -> "ResponseCache":
+        """
+        Creates the cache configured by the environment:
+        ECLIPTOOLS_CACHE (path, "off" disables persistence), ECLIPTOOLS_CACHE_TTL (days),
+        ECLIPTOOLS_CACHE_MAX_ENTRIES and ENSEMBL_RELEASE.
+        :return:
+        """
+        path = os.environ.get("ECLIPTOOLS_CACHE", str(DEFAULT_CACHE_PATH))
+        ttl = os.environ.get("ECLIPTOOLS_CACHE_TTL")
+        max_entries = os.environ.get("ECLIPTOOLS_CACHE_MAX_ENTRIES")
+        release = os.environ.get("ENSEMBL_RELEASE")
+        return cls(
+            path=None if path.lower() in ("", "off", "none") else path,
+            ttl=float(ttl) * 24 * 60 * 60 if ttl else None,
+            release=int(release) if release else None,
+            max_entries=int(max_entries) if max_entries else None
+        )
+
+    def _is_valid(self, release: int | None, created: float, now: float) -> bool:
+        if self.release is not None and release != self.release:
+            return False
+        if self.ttl is not None and now - created > self.ttl:
+            return False
+        return True
+
+    def get_many(self, server: str, endpoint: str, keys: Iterable[str]) -> dict[str, Any]:
+        """
+        :param server: The base URL of the server that answered, e.g. EnsemblClient.server
+        :param endpoint:
+        :param keys:
+        :return: The cached values of all keys that are in the cache and still valid
+        """
+        keys = list(dict.fromkeys(keys))
+        found: dict[str, Any] = {}
+        now = time.time()
+        with self._lock:
+            # SQLite limits the number of host parameters per statement
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, release, value, created FROM responses WHERE server = ? AND endpoint = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})", [server, endpoint, *chunk]
+                ).fetchall()
+                for key, release, value, created in rows:
+                    if self._is_valid(release, created, now):
+                        found[key] = json.loads(value)
+
+            # the access time only orders the eviction, reads stay read only without it
+            if self.max_entries is not None and found:
+                with self._connection:
+                    self._connection.executemany(
+                        "UPDATE responses SET accessed = ? WHERE server = ? AND endpoint = ? AND key = ?",
+                        [(now, server, endpoint, key) for key in found])
+
+        self.stats.record(endpoint, True, len(found))
+        self.stats.record(endpoint, False, len(keys) - len(found))
+        return found
+
+    def get(self, server: str, endpoint: str, key: str, default=None) -> Any:
+        return self.get_many(server, endpoint, [key]).get(key, default)
+
+    def set_many(self, server: str, endpoint: str, values: dict[str, Any]):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO responses (server, endpoint, key, release, value, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(server, endpoint, key, self.release, json.dumps(value), now, now)
+                 for key, value in values.items()]
+            )
+            if self.max_entries is not None:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE rowid IN "
+                    "(SELECT rowid FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+                )
+
+    def set(self, server: str, endpoint: str, key: str, value: Any):
+        self.set_many(server, endpoint, {key: value})
+
+    def __contains__(self, item: tuple[str, str, str]) -> bool:
+        server, endpoint, key = item
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT release, created FROM responses WHERE server = ? AND endpoint = ? AND key = ?",
+                (server, endpoint, key)).fetchone()
+        return row is not None and self._is_valid(row[0], row[1], time.time())
+
+    def entry_counts(self) -> dict[tuple[str, str], int]:
+        """
+        :return: The number of cached responses per server and endpoint
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT server, endpoint, COUNT(*) FROM responses GROUP BY server, endpoint").fetchall()
+        return {(server, endpoint): count for server, endpoint, count in rows}
+
+    def purge(self) -> int:
+        """
+        Removes all expired entries and entries of other Ensembl releases.
+        :return: The number of removed entries
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT server, endpoint, key, release, created FROM responses").fetchall()
+            expired = [(server, endpoint, key) for server, endpoint, key, release, created in rows
+                       if not self._is_valid(release, created, now)]
+            with self._connection:
+                self._connection.executemany("DELETE FROM responses WHERE server = ? AND endpoint = ? AND key = ?",
+                                             expired)
+        return len(expired)
+
+    def clear(self, endpoint: str | None = None, server: str | None = None):
+        """
+        Removes the cached responses of an endpoint and/or a server, all responses if neither is given.
+        """
+        conditions = {column: value for column, value in (("endpoint", endpoint), ("server", server))
+                      if value is not None}
+        where = " AND ".join(f"{column} = ?" for column in conditions)
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses" + (f" WHERE {where}" if where else ""),
+                                     list(conditions.values()))
+
+
+_DEFAULT_CACHE: ResponseCache | None = None
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    The cache shared by all commands calling Ensembl, created from the environment on first use.
+    """
+    global _DEFAULT_CACHE
+    if _DEFAULT_CACHE is None:
+        _DEFAULT_CACHE = ResponseCache.from_environment()
+    return _DEFAULT_CACHE
+
+
+def current_response_cache() -> ResponseCache | None:
+    """
+    The shared cache if it was opened, unlike get_response_cache this never opens it.
+    """
+    return _DEFAULT_CACHE
+
+
+def set_response_cache(cache: ResponseCache):
+    global _DEFAULT_CACHE
+    _DEFAULT_CACHE = cache
@@ -0,0 +1,33 @@
+#!/usr/bin/python
+from typing import Iterable, TextIO
+
+import jsonpickle
+
+from ecliptools.classes.Peak import BasePeak
+from ecliptools.util.profiling import get_profiler
+
+
+def write_peak_json(peaks: Iterable[BasePeak], out_file: TextIO, clear_text=False) -> int:
+    """
+    Writes the peaks as a json list one peak at a time, so the peaks can come from a generator.
+    The result can be read with read_peak_json. Annotations may share Info objects, every one is written in full
+    because jsonpickle references do not survive include_properties.
+    :param peaks:
+    :param out_file:
+    :param clear_text: If True this outputs more humanly readable json, but it can not be read with read_peak_json
+    :return: The number of written peaks
+    """
+    profiler = get_profiler()
+    count = 0
+    out_file.write("[")
+    for peak in peaks:
+        if count:
+            out_file.write(",")
+        out_file.write("\n")
+        with profiler.count("encode"):
+            encoded = jsonpickle.encode(peak, unpicklable=not clear_text, indent=4, include_properties=True,
+                                      make_refs=False)
+        out_file.write(encoded)
+        count += 1
+    out_file.write("\n]")
+    return count